@@ -1,25 +1,73 @@
 #app.y
-from flask import Flask
+import os
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
-from config import Config
-from flask_migrate import Migrate 
-from authlib.integrations.flask_client import OAuth
+from flask_mail import Mail
+from config import config_by_name
+from shard_routing import RoutingSession
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
-oauth = OAuth()
+mail = Mail()
+
+def create_app(config=None):
+    """Application factory.
+
+    `config` may be a profile name ('development', 'testing', 'production'),
+    a config object, or None to use the APP_CONFIG environment variable.
+    """
+    if config is None:
+        config = os.getenv('APP_CONFIG', 'development')
+    if isinstance(config, str):
+        config = config_by_name[config]
 
-def create_app():
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config)
     CORS(app)
+
+    proxies = app.config.setdefault('TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    from sharding import shards
+    shards.init_app(app)  # adds the shard binds, so before db.init_app
     db.init_app(app)
-    bcrypt.init_app(app) 
+    bcrypt.init_app(app)
+    mail.init_app(app)
+
+    from mailer import email_queue
+    email_queue.init_app(app)
+
+    from ratelimit import limiter
+    limiter.init_app(app)
+
+    from compression import compress
+    compress.init_app(app)
+
+    from google_oidc import google_oidc
+    google_oidc.init_app(app)
+
+    from images import image_store
+    image_store.init_app(app)
+
+    from write_buffer import write_buffer
+    write_buffer.init_app(app)
+
+    from profiling import profiler
+    profiler.init_app(app)
+
+    from usage import usage
+    usage.init_app(app)
+
+    if app.config['ENABLE_MIGRATIONS']:
+        # Flask-Migrate pulls in alembic, which is only needed for `flask db`
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
-    Migrate(app, db) 
     # Register blueprints
     from routes import jwt_auth_blueprint, google_auth_blueprint, food_item_blueprint, food_type_blueprint, nutritional_info_blueprint, food_image_info_blueprint
     app.register_blueprint(jwt_auth_blueprint, url_prefix="/auth-user")
@@ -29,4 +77,31 @@ def create_app():
     app.register_blueprint(nutritional_info_blueprint, url_prefix="/nutritional-information")
     app.register_blueprint(food_image_info_blueprint, url_prefix="/image-information")
 
+    from partitioning import partitions_cli
+    app.cli.add_command(partitions_cli)
+    from stats import stats_cli
+    app.cli.add_command(stats_cli)
+    from images import images_cli
+    app.cli.add_command(images_cli)
+    from sharding import shards_cli
+    app.cli.add_command(shards_cli)
+
+    if app.config.get('AUTO_CREATE_TABLES'):
+        with app.app_context():
+            db.create_all()
+            shards.create_tables()
+
     return app
+
+def get_openai_client():
+    """Return the app's OpenAI client, creating it on first use.
+
+    The openai package is slow to import, so it is only loaded once an
+    endpoint actually needs it.
+    """
+    client = current_app.extensions.get('openai_client')
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(api_key=current_app.config['API_KEY'], base_url=current_app.config['OPENAI_BASE_URL'])
+        current_app.extensions['openai_client'] = client
+    return client
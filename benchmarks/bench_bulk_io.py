@@ -0,0 +1,98 @@
+"""Rows/sec of the bulk food-log export and import endpoints.
+
+Seeds a dataset with benchmarks.datagen, then streams the admin-wide
+export in every available format through the app and re-imports the CSV
+and NDJSON bodies through the admin import endpoint, reporting rows/sec,
+bytes and peak RSS for each. Point TEST_DATABASE_URI at Postgres to
+measure the COPY paths; the default is a SQLite file in a temp dir.
+
+    python benchmarks/bench_bulk_io.py --users 1000 --items-per-user 1000
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items-per-user', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_bulk_io_')
+    os.environ.setdefault('TEST_DATABASE_URI', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    from app import create_app
+    from benchmarks.datagen import generate, BENCH_PASSWORD
+    from models import User, FoodItem
+    import bulk_io
+
+    app = create_app('testing')
+    with app.app_context():
+        started = time.perf_counter()
+        generate(users=args.users, items_per_user=args.items_per_user, days=args.days, admins=1)
+        seed_seconds = time.perf_counter() - started
+        rows = FoodItem.query.count()
+        admin_email = User.query.filter_by(is_admin=True).first().email
+
+    client = app.test_client()
+    token = client.post('/auth-user/login', json={'email': admin_email, 'password': BENCH_PASSWORD}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    results = []
+    bodies = {}
+    for fmt in bulk_io.available_export_formats():
+        path = os.path.join(workdir, f'export.{fmt}')
+        started = time.perf_counter()
+        response = client.get(f'/auth-user/admin/food-items/export?format={fmt}', headers=headers, buffered=False)
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in response.response:
+                chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                size += len(chunk)
+                f.write(chunk)
+        response.close()
+        seconds = time.perf_counter() - started
+        bodies[fmt] = path
+        results.append({'op': 'export', 'format': fmt, 'rows': rows, 'seconds': seconds,
+                        'rows_per_sec': rows / seconds, 'bytes': size, 'peak_rss_mb': _peak_rss_mb()})
+
+    for fmt in bulk_io.IMPORT_FORMATS:
+        with open(bodies[fmt], 'rb') as f:
+            started = time.perf_counter()
+            # input_stream (not data=) so the test client streams the body instead of reading it all
+            response = client.post(f'/auth-user/admin/food-items/import?format={fmt}', headers=headers,
+                                   input_stream=f, content_length=os.path.getsize(bodies[fmt]))
+            seconds = time.perf_counter() - started
+        imported = response.get_json().get('imported', 0)
+        if response.status_code != 201:
+            print(f"import {fmt} failed: {response.get_json()}", file=sys.stderr)
+        results.append({'op': 'import', 'format': fmt, 'rows': imported, 'seconds': seconds,
+                        'rows_per_sec': imported / seconds if seconds else 0,
+                        'bytes': os.path.getsize(bodies[fmt]), 'peak_rss_mb': _peak_rss_mb()})
+
+    if args.json:
+        print(json.dumps({'seed_rows': rows, 'seed_seconds': seed_seconds, 'results': results}, indent=2))
+        return
+    print(f"seeded {rows} rows in {seed_seconds:.1f}s ({app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]})")
+    print(f"{'op':>7}{'format':>9}{'rows':>10}{'seconds':>9}{'rows/s':>10}{'MB':>9}{'peak RSS MB':>13}")
+    for r in results:
+        print(f"{r['op']:>7}{r['format']:>9}{r['rows']:10d}{r['seconds']:9.2f}{r['rows_per_sec']:10.0f}"
+              f"{r['bytes'] / 1e6:9.1f}{r['peak_rss_mb']:13.0f}")
+
+
+if __name__ == '__main__':
+    main()
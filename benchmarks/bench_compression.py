@@ -0,0 +1,79 @@
+"""Bytes on the wire and CPU cost of response compression per response size.
+
+Builds food-item listings shaped like the /food-items and admin listing
+responses at several sizes and, for each available coding and level,
+reports the compressed size, ratio and CPU time per response. Use it to
+tune COMPRESS_MIN_SIZE and COMPRESS_LEVELS.
+
+    python benchmarks/bench_compression.py --rows 1,10,100,1000,10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compression import available_encodings, compress_bytes  # noqa: E402
+from benchmarks.datagen import FOOD_CATALOG  # noqa: E402
+
+LEVELS = {'gzip': [1, 6, 9], 'br': [1, 4, 9], 'zstd': [1, 3, 9]}
+
+
+def listing_payload(rows, seed=0):
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+    items = []
+    for i in range(rows):
+        name, type_name, calories, carbs, fat, protein = rng.choice(FOOD_CATALOG)
+        stamp = (now - timedelta(minutes=97 * i)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        items.append({
+            'id': 100000 + i, 'name': name, 'volume': round(rng.uniform(50, 300), 1), 'food_type': type_name,
+            'timestamp': stamp, 'date_uploaded': stamp,
+            'nutrition': {'calories': calories, 'carbs': carbs, 'fat': fat, 'protein': protein},
+        })
+    return json.dumps(items).encode('utf-8')
+
+
+def measure(encoding, level, data, min_seconds=0.2):
+    iterations, started = 0, time.process_time()
+    while True:
+        compressed = compress_bytes(encoding, data, level)
+        iterations += 1
+        elapsed = time.process_time() - started
+        if elapsed >= min_seconds:
+            break
+    return len(compressed), elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1,10,100,1000,10000')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = []
+    for rows in (int(r) for r in args.rows.split(',')):
+        data = listing_payload(rows)
+        for encoding in available_encodings():
+            for level in LEVELS[encoding]:
+                size, cpu = measure(encoding, level, data)
+                results.append({'rows': rows, 'raw_bytes': len(data), 'encoding': encoding, 'level': level,
+                                'wire_bytes': size, 'ratio': len(data) / size, 'cpu_ms': cpu * 1000,
+                                'cpu_us_per_kb': cpu * 1e6 / (len(data) / 1024)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'rows':>6}{'raw B':>10}{'coding':>8}{'lvl':>5}{'wire B':>10}{'ratio':>8}{'cpu ms':>10}{'us/KB':>8}")
+    for r in results:
+        print(f"{r['rows']:6d}{r['raw_bytes']:10d}{r['encoding']:>8}{r['level']:5d}{r['wire_bytes']:10d}"
+              f"{r['ratio']:8.1f}{r['cpu_ms']:10.3f}{r['cpu_us_per_kb']:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Glycemic load engine cost over years of food-log history.
+
+Seeds one user with `--years` of history at `--items-per-day`, then times
+the vectorized engine on its own (glycemic.compute over every item) and
+the endpoint cold (query + compute + cache fill), warm (served from the
+daily_glycemic_load cache) and after a write invalidates one day.
+
+    python benchmarks/bench_glycemic.py --years 5 --items-per-day 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def timed(fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _span(days):
+    date_to = datetime.utcnow().date()
+    return date_to - timedelta(days=days), date_to
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--items-per-day', type=int, default=8)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TEST_DATABASE_URI',
+                          f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_glycemic_'), 'bench.db')}")
+
+    from app import create_app, db
+    from benchmarks.datagen import generate, BENCH_PASSWORD
+    import glycemic
+
+    app = create_app('testing')
+    days = args.years * 365
+    with app.app_context():
+        summary = generate(users=1, items_per_user=days * args.items_per_day, days=days, admins=0)
+        user_id, email = summary['user_ids'][0], summary['user_emails'][0]
+        rows = glycemic._load_rows(user_id, *_span(days))
+        gap = app.config['GLYCEMIC_MEAL_GAP_MINUTES'] * 60
+        computed, engine_seconds = timed(lambda: glycemic.compute(rows, gap), repeat=5)
+        db.session.remove()
+
+    client = app.test_client()
+    token = client.post('/auth-user/login', json={'email': email, 'password': BENCH_PASSWORD}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    date_from, date_to = _span(days)
+    url = f'/nutritional-information/glycemic-load?date_from={date_from.isoformat()}&date_to={date_to.isoformat()}'
+
+    def fetch():
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response
+
+    _, cold = timed(fetch)
+    _, warm = timed(fetch, repeat=5)
+    with app.app_context():
+        some_day = datetime.combine(date_to - timedelta(days=days // 2), datetime.min.time())
+        glycemic.invalidate([{'user_id': user_id, 'timestamp': some_day}])
+        db.session.commit()
+    _, after_write = timed(fetch)
+
+    results = {
+        'items': len(rows), 'days_with_meals': len(computed), 'meals': sum(len(d['meals']) for d in computed.values()),
+        'engine_ms': engine_seconds * 1000, 'engine_items_per_sec': len(rows) / engine_seconds,
+        'endpoint_cold_ms': cold * 1000, 'endpoint_warm_ms': warm * 1000, 'endpoint_after_write_ms': after_write * 1000,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['items']} items over {args.years} years -> {results['meals']} meals on "
+          f"{results['days_with_meals']} days")
+    print(f"engine (vectorized compute): {results['engine_ms']:8.1f} ms  "
+          f"({results['engine_items_per_sec']:,.0f} items/s)")
+    print(f"endpoint cold:               {results['endpoint_cold_ms']:8.1f} ms")
+    print(f"endpoint warm (cached):      {results['endpoint_warm_ms']:8.1f} ms")
+    print(f"endpoint after one write:    {results['endpoint_after_write_ms']:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""save_food_items under concurrency, committed per request vs. grouped.
+
+Serves the app from an in-process threaded server (like one gthread
+worker) and has `--concurrency` clients POST meals as fast as they can,
+first with one transaction per request, then with the group-commit write
+buffer (write_buffer.py). Reports requests/sec, database commits/sec, rows
+per commit and p50/p99 latency for both. Point TEST_DATABASE_URI at
+Postgres for realistic fsync costs; the default is a SQLite file.
+
+    python benchmarks/bench_group_commit.py --concurrency 64 --duration 10
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from benchmarks.loadgen import run_load  # noqa: E402
+
+MEAL = {"foods": [
+    {"name": "Apple", "type": "Fruit", "volume": 100, "calories": 52, "carbs": 14, "fat": 0.2, "protein": 0.3},
+    {"name": "Rice", "type": "Grain", "volume": 150, "calories": 195, "carbs": 42, "fat": 0.4, "protein": 4},
+]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mode')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--max-delay-ms', type=float, default=2)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TEST_DATABASE_URI',
+                          f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_group_commit_'), 'bench.db')}")
+
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    from app import create_app, db
+    from benchmarks.datagen import generate
+    from models import User
+    from routes import generate_tokens
+    from write_buffer import write_buffer
+
+    app = create_app('testing')
+    app.config['WRITE_BUFFER_MAX_DELAY_MS'] = args.max_delay_ms
+    with app.app_context():
+        generate(users=args.users, items_per_user=0, days=1, admins=0)
+        tokens = [generate_tokens(user)[0] for user in User.query.all()]
+        backend = db.engine.url.get_backend_name()
+        commits = [0]
+        event.listen(db.engine, 'commit', lambda connection: commits.__setitem__(0, commits[0] + 1))
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/food-items/food-items'
+    local = threading.local()
+
+    def send(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        token = tokens[index % len(tokens)]
+        response = local.session.post(url, json=MEAL, headers={'Authorization': f'Bearer {token}'})
+        return response.status_code == 201
+
+    results = {}
+    for mode in ('per_request', 'group_commit'):
+        app.config['WRITE_BUFFER_ENABLED'] = mode == 'group_commit'
+        before = commits[0]
+        summary = run_load(send, args.concurrency, duration=args.duration)
+        made = commits[0] - before
+        elapsed = summary['requests'] / summary['throughput_rps'] if summary['throughput_rps'] else args.duration
+        summary.update({
+            'commits': made,
+            'commits_per_sec': made / elapsed,
+            'rows_per_commit': summary['requests'] * len(MEAL['foods']) / made if made else None,
+        })
+        results[mode] = summary
+    server.shutdown()
+    results['group_commit']['buffer'] = write_buffer.counters()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.concurrency} clients, {args.duration:g}s per mode, {len(MEAL['foods'])} items per request "
+          f"({backend})")
+    print(f"{'mode':>13} {'req/s':>8} {'commits/s':>10} {'rows/commit':>12} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in ('per_request', 'group_commit'):
+        r = results[mode]
+        print(f"{mode:>13} {r['throughput_rps']:8.0f} {r['commits_per_sec']:10.0f} {r['rows_per_commit'] or 0:12.1f} "
+              f"{r['p50_ms'] or 0:8.1f} {r['p99_ms'] or 0:8.1f} {r['errors']:7d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Listing queries with nutrition in its own table vs. inline on food_item (Postgres only).
+
+Builds the same synthetic food log twice, in the schemas bench_legacy
+(food_item + nutritional_information, one row per item, joined on
+food_item_id) and bench_inline (nutrition columns on food_item, as since
+migration e4a7c1d9b362), with the application's indexes. The queries
+behind the listing endpoints are then run against both under
+EXPLAIN (ANALYZE, BUFFERS) and compared by join count, shared buffers
+touched (hit + read, 8 kB pages) and median execution time. Table and
+index sizes of both layouts are reported too.
+
+The legacy side uses a single LEFT JOIN, the best the old layout allowed;
+the user listing actually issued one nutrition query per item (see the
+baselines in benchmarks/plans/), so it did worse than shown here.
+
+    python benchmarks/bench_nutrition_layout.py --database-uri postgresql+psycopg2://localhost/glucocheck_bench
+"""
+import argparse
+import json
+import os
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+SCHEMAS = ('bench_legacy', 'bench_inline')
+NUTRIENTS = ('calories', 'carbs', 'fat', 'protein')
+_JOIN_NODES = {'Nested Loop', 'Hash Join', 'Merge Join'}
+
+
+def _build(connection, users, items_per_user, days):
+    connection.execute(text("SELECT setseed(0.42)"))
+    connection.execute(text("DROP TABLE IF EXISTS pg_temp.stage"))
+    connection.execute(text("""
+        CREATE TEMP TABLE stage AS
+        SELECT g AS id, 'Food ' || (g % 40) AS name, round((random() * 250)::numeric, 1)::float AS volume,
+               1 + g % 8 AS food_type_id, ts AS timestamp, ts AS date_uploaded, 1 + g % :users AS user_id,
+               round((random() * 500)::numeric, 1)::float AS calories, round((random() * 80)::numeric, 1)::float AS carbs,
+               round((random() * 30)::numeric, 1)::float AS fat, round((random() * 40)::numeric, 1)::float AS protein
+        FROM (SELECT g, :now - random() * (:days * interval '1 day') AS ts FROM generate_series(1, :rows) g) t
+        ORDER BY ts
+    """), {'users': users, 'rows': users * items_per_user, 'days': days, 'now': datetime.utcnow()})
+
+    for schema in SCHEMAS:
+        inline = schema == 'bench_inline'
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text(f"SET search_path TO {schema}"))
+        connection.execute(text("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, first_name VARCHAR(50), last_name VARCHAR(50),
+                                email VARCHAR(100) UNIQUE)
+        """))
+        connection.execute(text("CREATE TABLE food_type (id INTEGER PRIMARY KEY, type VARCHAR(50) UNIQUE)"))
+        nutrition_columns = ''.join(f", {n} FLOAT" for n in NUTRIENTS) if inline else ''
+        connection.execute(text(f"""
+            CREATE TABLE food_item (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, volume FLOAT,
+                                    food_type_id INTEGER NOT NULL, timestamp TIMESTAMP NOT NULL,
+                                    date_uploaded TIMESTAMP, user_id INTEGER NOT NULL{nutrition_columns})
+        """))
+        connection.execute(text("""
+            INSERT INTO users SELECT g, 'First' || g, 'Last' || g, 'user' || g || '@bench.example.com'
+            FROM generate_series(1, :users) g
+        """), {'users': users})
+        connection.execute(text("INSERT INTO food_type SELECT g, 'Type ' || g FROM generate_series(1, 8) g"))
+        columns = 'id, name, volume, food_type_id, timestamp, date_uploaded, user_id'
+        if inline:
+            columns += ', ' + ', '.join(NUTRIENTS)
+        connection.execute(text(f"INSERT INTO food_item ({columns}) SELECT {columns} FROM pg_temp.stage"))
+        if not inline:
+            connection.execute(text(f"""
+                CREATE TABLE nutritional_information (id SERIAL PRIMARY KEY, food_item_id INTEGER NOT NULL,
+                                                      {', '.join(f'{n} FLOAT' for n in NUTRIENTS)})
+            """))
+            connection.execute(text(f"""
+                INSERT INTO nutritional_information (food_item_id, {', '.join(NUTRIENTS)})
+                SELECT id, {', '.join(NUTRIENTS)} FROM pg_temp.stage ORDER BY timestamp
+            """))
+            connection.execute(text(
+                "CREATE INDEX idx_nutrition_food_item_id ON nutritional_information (food_item_id)"))
+        connection.execute(text("CREATE INDEX idx_food_timestamp ON food_item (timestamp)"))
+        connection.execute(text("CREATE INDEX idx_food_user_id ON food_item (user_id)"))
+        connection.execute(text("CREATE INDEX idx_food_type_id ON food_item (food_type_id)"))
+        connection.execute(text("CREATE INDEX idx_food_user_timestamp ON food_item (user_id, timestamp)"))
+    connection.commit()
+    # VACUUM can't run in a transaction; it sets the visibility map index-only scans rely on
+    with connection.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as autocommit:
+        for schema in SCHEMAS:
+            autocommit.execute(text(f"SET search_path TO {schema}"))
+            autocommit.execute(text("VACUUM ANALYZE"))
+
+
+def _queries(now):
+    """name -> (SQL for the legacy layout, SQL for the inline layout, params); the listing endpoints' shapes."""
+    n_cols = ', '.join(f'n.{c}' for c in NUTRIENTS)
+    f_cols = ', '.join(f'f.{c}' for c in NUTRIENTS)
+    join = "LEFT JOIN nutritional_information n ON n.food_item_id = f.id"
+    shapes = {
+        'user_food_items': ("""
+            SELECT f.id, f.name, f.volume, f.food_type_id, f.timestamp, f.date_uploaded, {cols}
+            FROM food_item f {join} WHERE f.user_id = :user_id ORDER BY f.timestamp DESC
+        """, {'user_id': 7}),
+        'admin_all_food_items': ("""
+            SELECT f.id, f.name, f.volume, f.timestamp, u.id, u.email, u.first_name, u.last_name, t.type, {cols}
+            FROM food_item f JOIN users u ON u.id = f.user_id JOIN food_type t ON t.id = f.food_type_id {join}
+            ORDER BY f.timestamp DESC LIMIT 20 OFFSET 40
+        """, {}),
+        'glycemic_load': ("""
+            SELECT f.id, f.name, t.type, f.timestamp, {carbs}
+            FROM food_item f JOIN food_type t ON t.id = f.food_type_id {join}
+            WHERE f.user_id = :user_id AND f.timestamp >= :date_from AND f.timestamp < :date_to
+            ORDER BY f.timestamp, f.id
+        """, {'user_id': 7, 'date_from': now - timedelta(days=60), 'date_to': now}),
+        'export_month': ("""
+            SELECT f.id, f.user_id, f.name, t.type AS food_type, f.volume, f.timestamp, f.date_uploaded, {cols}
+            FROM food_item f JOIN food_type t ON t.id = f.food_type_id {join}
+            WHERE f.timestamp >= :date_from AND f.timestamp <= :date_to ORDER BY f.timestamp, f.id
+        """, {'date_from': now - timedelta(days=30), 'date_to': now}),
+    }
+    return {name: (sql.format(cols=n_cols, carbs='n.carbs', join=join), sql.format(cols=f_cols, carbs='f.carbs', join=''),
+                   params)
+            for name, (sql, params) in shapes.items()}
+
+
+def _joins(node):
+    return (node['Node Type'] in _JOIN_NODES) + sum(_joins(child) for child in node.get('Plans', []))
+
+
+def _explain(connection, sql, params, repeat):
+    connection.execute(text(sql), params).all()  # warm the cache, as a busy server's would be
+    runs = []
+    for _ in range(repeat):
+        plan = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params).scalar()
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+        runs.append(plan)
+    root = runs[0]['Plan']
+    return {
+        'joins': _joins(root),
+        'buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'rows': root['Actual Rows'],
+        'ms': statistics.median(run['Execution Time'] for run in runs),
+    }
+
+
+def _sizes(connection, schema):
+    tables = ['food_item'] + (['nutritional_information'] if schema == 'bench_legacy' else [])
+    return {table: {
+        'table_mb': connection.execute(text("SELECT pg_table_size(:t) / 1048576.0"), {'t': f'{schema}.{table}'}).scalar(),
+        'indexes_mb': connection.execute(text("SELECT pg_indexes_size(:t) / 1048576.0"),
+                                         {'t': f'{schema}.{table}'}).scalar(),
+    } for table in tables}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', default=os.getenv('BENCH_DATABASE_URI'),
+                        help='Postgres database to create the bench_* schemas in (or BENCH_DATABASE_URI)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items-per-user', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5, help='EXPLAIN ANALYZE runs per query (median time)')
+    parser.add_argument('--keep', action='store_true', help='reuse the schemas of a previous run instead of rebuilding')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+    if not args.database_uri or not args.database_uri.startswith('postgresql'):
+        parser.error('--database-uri must point at a Postgres database')
+
+    engine = create_engine(args.database_uri)
+    with engine.connect() as connection:
+        if not args.keep:
+            _build(connection, args.users, args.items_per_user, args.days)
+        now = connection.execute(text("SELECT max(timestamp) FROM bench_inline.food_item")).scalar()
+        results = {'queries': {}, 'sizes': {}}
+        for name, (legacy_sql, inline_sql, params) in _queries(now).items():
+            results['queries'][name] = {}
+            for schema, sql in zip(SCHEMAS, (legacy_sql, inline_sql)):
+                connection.execute(text(f"SET search_path TO {schema}"))
+                results['queries'][name][schema] = _explain(connection, sql, params, args.repeat)
+        for schema in SCHEMAS:
+            results['sizes'][schema] = _sizes(connection, schema)
+        connection.rollback()
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=float))
+        return
+    print(f"{args.users * args.items_per_user} food items, {args.users} users")
+    print(f"{'query':>22} {'layout':>8} {'joins':>6} {'buffers':>9} {'rows':>7} {'ms':>8}")
+    for name, layouts in results['queries'].items():
+        for schema, r in layouts.items():
+            print(f"{name:>22} {schema.split('_')[1]:>8} {r['joins']:6d} {r['buffers']:9d} {r['rows']:7d} {r['ms']:8.2f}")
+    for schema, tables in results['sizes'].items():
+        total = sum(t['table_mb'] + t['indexes_mb'] for t in tables.values())
+        detail = ', '.join(f"{table} {t['table_mb']:.1f} + {t['indexes_mb']:.1f} idx" for table, t in tables.items())
+        print(f"{schema.split('_')[1]:>8}: {total:7.1f} MB ({detail})")
+
+
+if __name__ == '__main__':
+    main()
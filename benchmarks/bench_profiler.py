@@ -0,0 +1,105 @@
+"""Request overhead of the on-demand profiler (profiling.py).
+
+Serves the app from an in-process threaded server and has `--concurrency`
+clients fetch a user's food log, in four modes: hooks removed (as with
+PROFILING_ENABLED=false), no session running (the normal state), a
+session limited to another endpoint, and a session sampling every request
+every `--interval-ms`. Reports requests/sec and p50/p99 latency per mode,
+and the samples the last mode collected.
+
+    python benchmarks/bench_profiler.py --concurrency 8 --duration 10
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from benchmarks.loadgen import run_load  # noqa: E402
+
+MODES = ('disabled', 'idle', 'other_endpoint', 'sampling')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mode')
+    parser.add_argument('--items-per-user', type=int, default=200)
+    parser.add_argument('--interval-ms', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TEST_DATABASE_URI',
+                          f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_profiler_'), 'bench.db')}")
+
+    from werkzeug.serving import make_server
+    from app import create_app, db
+    from benchmarks.datagen import generate
+    from config import TestingConfig
+    from models import User, ProfilingSession
+    from profiling import profiler
+    from routes import generate_tokens
+
+    app = create_app(type('BenchConfig', (TestingConfig,), {'PROFILING_ENABLED': True}))
+    with app.app_context():
+        generate(users=20, items_per_user=args.items_per_user, days=30, admins=0)
+        tokens = [generate_tokens(user)[0] for user in User.query.all()]
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/food-items/food-items'
+    local = threading.local()
+
+    def send(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        response = local.session.get(url, headers={'Authorization': f'Bearer {tokens[index % len(tokens)]}'})
+        return response.status_code == 200
+
+    def start_session(endpoints):
+        with app.app_context():
+            now = datetime.utcnow()
+            ProfilingSession.query.update({'stopped_at': now})
+            db.session.add(ProfilingSession(endpoints=endpoints, sample_rate=1.0, interval_ms=args.interval_ms,
+                                            started_at=now, expires_at=now + timedelta(hours=1)))
+            db.session.commit()
+            profiler.refresh()
+
+    hooks = app.before_request_funcs[None], app.teardown_request_funcs[None]
+    results = {}
+    for mode in MODES:
+        if mode == 'disabled':
+            hooks[0].remove(profiler._before_request)
+            hooks[1].remove(profiler._teardown_request)
+        elif mode == 'idle':
+            hooks[0].append(profiler._before_request)
+            hooks[1].append(profiler._teardown_request)
+        else:
+            start_session('nutritional-information.get_glycemic_load' if mode == 'other_endpoint' else None)
+        results[mode] = run_load(send, args.concurrency, duration=args.duration)
+    results['sampling']['samples'] = profiler._samples
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.concurrency} clients, {args.duration:g}s per mode, {args.items_per_user} items per listing, "
+          f"sampling every {args.interval_ms} ms")
+    print(f"{'mode':>15} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in MODES:
+        r = results[mode]
+        print(f"{mode:>15} {r['throughput_rps']:8.0f} {r['p50_ms'] or 0:8.1f} {r['p99_ms'] or 0:8.1f} {r['errors']:7d}")
+    print(f"{results['sampling']['samples']} samples taken")
+
+
+if __name__ == '__main__':
+    main()
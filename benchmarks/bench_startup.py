@@ -0,0 +1,65 @@
+"""Startup-time benchmark.
+
+Measures, in fresh interpreters, how long it takes to import the app module
+and to boot the testing profile (in-memory SQLite, tables created) up to the
+first served request. Exits non-zero when the median boot time exceeds the
+budget so import-time regressions fail CI.
+
+    python benchmarks/bench_startup.py --runs 5 --budget 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app('testing')
+t2 = time.perf_counter()
+flask_app.test_client().get('/food-items/food-items')
+t3 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'first_request': t3 - t2, 'total': t3 - t0}))
+"""
+
+
+def run_once():
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=float(os.getenv('STARTUP_BUDGET_SECONDS', 1.0)),
+                        help='maximum allowed median total boot time in seconds')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    result = {phase: statistics.median(s[phase] for s in samples) for phase in samples[0]}
+    result['budget'] = args.budget
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for phase in ('import', 'create_app', 'first_request', 'total'):
+            print(f"{phase:>14}: {result[phase] * 1000:8.1f} ms")
+
+    if result['total'] > args.budget:
+        print(f"startup regression: {result['total']:.3f}s > budget {args.budget:.3f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Compare two benchmark result files from run_suite.py and flag regressions.
+
+    python benchmarks/compare.py base.json new.json --threshold 0.15
+
+Exits 1 when any scenario's p95 latency or throughput got worse by more than
+the threshold, or its query count per request went up.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(base, new, threshold):
+    rows, regressions = [], []
+    for name in sorted(set(base) & set(new)):
+        b, n = base[name], new[name]
+        checks = {
+            'p95_ms': ((n['p95_ms'] or 0) - (b['p95_ms'] or 0)) / b['p95_ms'] if b['p95_ms'] else 0.0,
+            'throughput_rps': (b['throughput_rps'] - n['throughput_rps']) / b['throughput_rps']
+            if b['throughput_rps'] else 0.0,
+        }
+        flagged = [metric for metric, worse_by in checks.items() if worse_by > threshold]
+        if n['queries_per_request'] > b['queries_per_request'] + 0.5:
+            flagged.append('queries_per_request')
+        if n['errors'] > b['errors']:
+            flagged.append('errors')
+        rows.append((name, b, n, flagged))
+        if flagged:
+            regressions.append((name, flagged))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative slowdown tolerated before flagging (default 15%%)')
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    rows, regressions = compare(base, new, args.threshold)
+
+    print(f"{'scenario':<32}{'p95 base':>10}{'p95 new':>10}{'rps base':>10}{'rps new':>10}{'q base':>8}{'q new':>8}")
+    for name, b, n, flagged in rows:
+        mark = '  <-- ' + ', '.join(flagged) if flagged else ''
+        print(f"{name:<32}{b['p95_ms'] or 0:10.2f}{n['p95_ms'] or 0:10.2f}{b['throughput_rps']:10.1f}"
+              f"{n['throughput_rps']:10.1f}{b['queries_per_request']:8.1f}{n['queries_per_request']:8.1f}{mark}")
+    for name in sorted(set(base) ^ set(new)):
+        print(f"{name:<32}only in {'base' if name in base else 'new'}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
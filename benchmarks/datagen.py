@@ -0,0 +1,168 @@
+"""Synthetic data for the benchmarks.
+
+`generate()` bulk-inserts users, food types and food items (with their
+nutrition) at a configurable scale using executemany batches, so a
+million-row dataset takes seconds rather than an ORM flush per row.
+`generate_usage()` adds image analysis accounting rows for those users.
+"""
+import random
+from datetime import datetime, timedelta
+
+from app import db, bcrypt
+from models import AnalysisUsage, User, FoodType, FoodItem
+
+FOOD_CATALOG = [
+    # name, type, calories, carbs, fat, protein (per serving)
+    ("Apple", "Fruit", 52, 14, 0.2, 0.3),
+    ("Banana", "Fruit", 89, 23, 0.3, 1.1),
+    ("Orange", "Fruit", 47, 12, 0.1, 0.9),
+    ("Rice", "Grain", 130, 28, 0.3, 2.7),
+    ("Bread", "Grain", 265, 49, 3.2, 9.0),
+    ("Oatmeal", "Grain", 68, 12, 1.4, 2.4),
+    ("Pasta", "Grain", 131, 25, 1.1, 5.0),
+    ("Chicken Breast", "Protein", 165, 0, 3.6, 31),
+    ("Egg", "Protein", 155, 1.1, 11, 13),
+    ("Salmon", "Protein", 208, 0, 13, 20),
+    ("Lentils", "Legume", 116, 20, 0.4, 9),
+    ("Chickpeas", "Legume", 164, 27, 2.6, 9),
+    ("Milk", "Dairy", 42, 5, 1, 3.4),
+    ("Yogurt", "Dairy", 59, 3.6, 0.4, 10),
+    ("Cheese", "Dairy", 402, 1.3, 33, 25),
+    ("Broccoli", "Vegetable", 34, 7, 0.4, 2.8),
+    ("Potato", "Vegetable", 77, 17, 0.1, 2),
+    ("Carrot", "Vegetable", 41, 10, 0.2, 0.9),
+    ("Chocolate", "Snack", 546, 61, 31, 4.9),
+    ("Orange Juice", "Beverage", 45, 10, 0.2, 0.7),
+]
+
+BENCH_PASSWORD = 'Bench#12345'
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _sync_sequences():
+    # Rows were inserted with explicit ids; move Postgres sequences past them
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in (User, FoodItem):
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {table}))"
+        ))
+
+
+def _ensure_food_types():
+    types = {t.type: t.id for t in FoodType.query.all()}
+    missing = sorted({type_name for _, type_name, *_ in FOOD_CATALOG} - set(types))
+    if missing:
+        db.session.execute(db.insert(FoodType), [{'type': t} for t in missing])
+        types = {t.type: t.id for t in FoodType.query.all()}
+    return types
+
+
+def generate(users=100, items_per_user=50, days=90, seed=0, admins=1, chunk_size=5000,
+             email_domain='bench.example.com'):
+    """Insert a synthetic dataset and return a summary.
+
+    Every user gets `items_per_user` food items spread over the last `days`
+    days, with nutrition. All users share the password BENCH_PASSWORD
+    (hashed once). The first `admins` users are admins.
+    """
+    rng = random.Random(seed)
+    password_hash = bcrypt.generate_password_hash(BENCH_PASSWORD).decode('utf-8')
+    types = _ensure_food_types()
+
+    first_user_id = _next_id(User)
+    user_rows = []
+    for n in range(users):
+        user_id = first_user_id + n
+        is_admin = n < admins
+        user_rows.append({
+            'id': user_id,
+            'first_name': f'First{user_id}',
+            'last_name': f'Last{user_id}',
+            'email': f'{"admin" if is_admin else "user"}{user_id}@{email_domain}',
+            'password': password_hash,
+            'role': 'GLUCOCHECK_ADMIN' if is_admin else 'GLUCOCHECK_USER',
+            'is_admin': is_admin,
+        })
+    for start in range(0, len(user_rows), chunk_size):
+        db.session.execute(db.insert(User), user_rows[start:start + chunk_size])
+
+    now = datetime.utcnow()
+    span_seconds = days * 86400
+    next_item_id = _next_id(FoodItem)
+    items = []
+
+    def flush():
+        if items:
+            db.session.execute(db.insert(FoodItem), items)
+            items.clear()
+
+    for user in user_rows:
+        for _ in range(items_per_user):
+            name, type_name, calories, carbs, fat, protein = rng.choice(FOOD_CATALOG)
+            portion = rng.uniform(0.5, 2.5)
+            logged_at = now - timedelta(seconds=rng.randrange(span_seconds))
+            items.append({
+                'id': next_item_id,
+                'name': name,
+                'volume': round(portion * 100, 1),
+                'food_type_id': types[type_name],
+                'timestamp': logged_at,
+                'date_uploaded': logged_at,
+                'user_id': user['id'],
+                'calories': round(calories * portion, 1),
+                'carbs': round(carbs * portion, 1),
+                'fat': round(fat * portion, 1),
+                'protein': round(protein * portion, 1),
+            })
+            next_item_id += 1
+            if len(items) >= chunk_size:
+                flush()
+    flush()
+    _sync_sequences()
+    db.session.commit()
+
+    return {
+        'users': users,
+        'food_items': users * items_per_user,
+        'admin_emails': [u['email'] for u in user_rows[:admins]],
+        'user_emails': [u['email'] for u in user_rows[admins:]],
+        'user_ids': [u['id'] for u in user_rows[admins:]],
+    }
+
+
+def generate_usage(user_ids, calls_per_user=20, days=30, seed=0, cache_hit_rate=0.3, chunk_size=5000):
+    """Insert analysis_usage rows for `user_ids` over the last `days` days; returns how many."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    rows = []
+    for user_id in user_ids:
+        for _ in range(calls_per_user):
+            cache_hit = rng.random() < cache_hit_rate
+            rows.append({
+                'user_id': user_id,
+                'created_at': now - timedelta(seconds=rng.randrange(days * 86400)),
+                'image_sha256': f'{rng.getrandbits(256):064x}',
+                'image_bytes': rng.randrange(50_000, 2_000_000),
+                'cache_hit': cache_hit,
+                'model': None if cache_hit else 'gpt-4o',
+                'prompt_tokens': None if cache_hit else rng.randrange(700, 1000),
+                'completion_tokens': None if cache_hit else rng.randrange(80, 200),
+                'latency_ms': None if cache_hit else rng.randrange(800, 4000),
+                'status': 'ok',
+            })
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(db.insert(AnalysisUsage), rows[start:start + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+def seed_user_with_items(rows, seed=0):
+    """Create one user with `rows` food items and return it."""
+    summary = generate(users=1, items_per_user=rows, seed=seed, admins=0,
+                       email_domain=f'load{_next_id(User)}.example.com')
+    return User.query.filter_by(email=summary['user_emails'][0]).first()
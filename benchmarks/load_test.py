@@ -0,0 +1,168 @@
+"""Compare gunicorn worker configurations on the CRUD and analyze endpoints.
+
+Each configuration is started with gunicorn.conf.py / wsgi:app against a
+seeded database, with OpenAI replaced by a local stub that answers after
+--upstream-latency seconds. Requires gunicorn (and gevent for gevent configs).
+
+    python benchmarks/load_test.py --configs sync:4,gthread:4:8,gevent:4:200 \
+        --concurrency 32 --duration 15 --upstream-latency 0.8
+
+A configuration is `worker_class:workers[:threads_or_connections]`.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from benchmarks.loadgen import run_load  # noqa: E402
+from benchmarks.stubs import StubOpenAIServer, meal_image  # noqa: E402
+
+FOOD_PAYLOAD = {"foods": [
+    {"name": "Apple", "type": "Fruit", "volume": 100, "calories": 52, "carbs": 14, "fat": 0.2, "protein": 0.3},
+    {"name": "Rice", "type": "Grain", "volume": 150, "calories": 195, "carbs": 42, "fat": 0.4, "protein": 4},
+]}
+# Distinct images per request and per run, so analyze misses the analysis cache
+_RUN_ID = os.urandom(4).hex()
+_image_seq = itertools.count()
+
+
+def parse_config(spec):
+    parts = spec.split(':')
+    worker_class, workers = parts[0], int(parts[1])
+    env = {'GUNICORN_WORKER_CLASS': worker_class, 'GUNICORN_WORKERS': str(workers)}
+    if len(parts) > 2:
+        key = 'GUNICORN_WORKER_CONNECTIONS' if worker_class == 'gevent' else 'GUNICORN_THREADS'
+        env[key] = parts[2]
+    return env
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def seed_database(database_uri, rows):
+    """Create the schema, one user with `rows` food items; return a bearer token."""
+    os.environ['DATABASE_URI'] = database_uri
+    from app import create_app, db
+    from routes import generate_tokens
+    from benchmarks.datagen import seed_user_with_items
+
+    app = create_app('production')
+    with app.app_context(), app.test_request_context():
+        db.create_all()
+        user = seed_user_with_items(rows)
+        access_token, _ = generate_tokens(user)
+    return access_token
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + '/food-items/food-items', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+def scenarios(base_url, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    sessions = {}
+
+    def session(index):
+        # one keep-alive connection per load thread
+        if index not in sessions:
+            sessions[index] = requests.Session()
+            sessions[index].headers.update(headers)
+        return sessions[index]
+
+    def list_items(i):
+        return session(i).get(base_url + '/food-items/food-items').status_code == 200
+
+    def save_items(i):
+        return session(i).post(base_url + '/food-items/food-items', json=FOOD_PAYLOAD).status_code == 201
+
+    def analyze(i):
+        files = {'image': (f'meal-{i}.png', io.BytesIO(meal_image(f'{_RUN_ID}-{next(_image_seq)}')), 'image/png')}
+        return session(i).post(base_url + '/image-information/analyze', files=files).status_code == 200
+
+    return {'list': list_items, 'save': save_items, 'analyze': analyze}
+
+
+def run_config(spec, args, stub_url, database_uri, token):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    # Production settings, minus the per-client rate limits and the per-process analyze cap:
+    # every request comes from one IP and user, so they would measure throttling, not the workers
+    env = dict(os.environ, DATABASE_URI=database_uri, OPENAI_BASE_URL=stub_url, APP_CONFIG='production',
+               RATELIMIT_ENABLED='false', ANALYZE_MAX_CONCURRENCY=str(args.concurrency),
+               GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='', **parse_config(spec))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(base_url)
+        results = {}
+        for name, send in scenarios(base_url, token).items():
+            if name not in args.endpoints:
+                continue
+            results[name] = run_load(send, args.concurrency, duration=args.duration)
+        return results
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', default='sync:4,gthread:4:8',
+                        help='comma-separated worker_class:workers[:threads_or_connections]')
+    parser.add_argument('--endpoints', default='list,save,analyze')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per endpoint')
+    parser.add_argument('--upstream-latency', type=float, default=0.5, help='stub OpenAI response delay')
+    parser.add_argument('--rows', type=int, default=200, help='food items seeded for the listing')
+    parser.add_argument('--database-uri', help='defaults to a temporary SQLite file')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+    args.endpoints = args.endpoints.split(',')
+
+    tmpdir = tempfile.mkdtemp(prefix='glucocheck-load-')
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(tmpdir, 'load.db')}"
+    token = seed_database(database_uri, args.rows)
+
+    report = {}
+    with StubOpenAIServer(latency=args.upstream_latency) as stub:
+        for spec in args.configs.split(','):
+            report[spec] = run_config(spec, args, stub.base_url, database_uri, token)
+
+    print(f"{'config':<18}{'endpoint':<10}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for spec, results in report.items():
+        for name, r in results.items():
+            fmt = lambda v: f"{v:10.1f}" if v is not None else f"{'-':>10}"
+            print(f"{spec:<18}{name:<10}{r['throughput_rps']:9.1f}{fmt(r['p50_ms'])}{fmt(r['p95_ms'])}"
+                  f"{fmt(r['p99_ms'])}{r['errors']:8d}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Closed-loop HTTP load generator shared by the benchmark scripts."""
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def run_load(send, concurrency, duration=None, requests=None):
+    """Call `send(worker_index)` from `concurrency` threads.
+
+    Runs for `duration` seconds or until `requests` calls have been made in
+    total. `send` returns True on success. Returns a summary dict with
+    throughput and p50/p95/p99 latency.
+    """
+    if duration is None and requests is None:
+        raise ValueError("either duration or requests is required")
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = [requests]
+    stop_at = time.perf_counter() + duration if duration else None
+
+    def worker(index):
+        nonlocal errors
+        local_latencies, local_errors = [], 0
+        while True:
+            if stop_at is not None and time.perf_counter() >= stop_at:
+                break
+            if remaining[0] is not None:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                ok = send(index)
+            except Exception:
+                ok = False
+            if ok:
+                local_latencies.append(time.perf_counter() - started)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
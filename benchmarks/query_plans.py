@@ -0,0 +1,329 @@
+"""Query-plan regression checks for the hot SQL paths (Postgres only).
+
+Migrates an empty Postgres database to head, so food_item is partitioned
+and indexed as in production, and seeds it with benchmarks/datagen.py. Each
+hot endpoint is then driven through the test client while every SELECT it
+issues is captured. Each distinct statement is re-run under
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) and checked against the scenario's
+expectations: indexes that must be used, tables that must not be
+sequentially scanned, how many partitions may be touched and how far the
+planner's row estimates may be off.
+
+The normalized plans (SQL, node types, tables and indexes, with no costs or
+timings) are compared with the baselines in benchmarks/plans/, so plan
+changes show up as diffs in review. Exits 1 when an expectation fails, or
+with --strict when a plan no longer matches its baseline.
+
+    python benchmarks/query_plans.py --database-uri postgresql+psycopg2://localhost/glucocheck_plans
+    python benchmarks/query_plans.py --database-uri ... --reset --update   # re-record the baselines
+"""
+import argparse
+import difflib
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event, text  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from benchmarks import datagen  # noqa: E402
+
+PLANS_DIR = os.path.join(ROOT, 'benchmarks', 'plans')
+
+_SCAN_NODES = {'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan'}
+
+
+def build_scenarios(ctx):
+    """name -> (url, headers, expectations).
+
+    An expectation applies to every captured statement whose SQL matches
+    `match` (at least one must): `indexes` lists indexes of which one must
+    appear in the plan, `no_seq_scan` tables that must not be read with a
+    Seq Scan, and `max_partitions` caps the food_item partitions executed.
+    """
+    user, admin = ctx.user_headers, ctx.admin_headers
+    week_from = (ctx.now - timedelta(days=30)).date().isoformat()
+    week_to = (ctx.now - timedelta(days=23)).date().isoformat()
+    user_items = {'match': r'FROM food_item\b.*WHERE food_item\.user_id =',
+                  'indexes': {'idx_food_user_timestamp', 'idx_food_user_id'}, 'no_seq_scan': {'food_item'}}
+    user_activity = {'match': r'FROM food_item\b.*GROUP BY food_item\.user_id',
+                     'indexes': {'idx_food_user_timestamp'}, 'no_seq_scan': {'food_item'}}
+    return {
+        'user_food_items': (
+            '/food-items/food-items', user, [user_items]),
+        'admin_user_food_items': (
+            f'/auth-user/admin/users/{ctx.user_id}/food-items', admin, [user_items]),
+        'admin_all_food_items': (
+            '/auth-user/admin/all-food-items?page=3&per_page=20', admin,
+            [{'match': r'ORDER BY food_item\.timestamp DESC\s+LIMIT',
+              'indexes': {'idx_food_timestamp'}, 'no_seq_scan': {'food_item'}}]),
+        'admin_all_food_items_by_user': (
+            f'/auth-user/admin/all-food-items?user_id={ctx.user_id}&per_page=20', admin,
+            [{'match': r'food_item\.user_id = .*LIMIT',
+              'indexes': {'idx_food_user_timestamp', 'idx_food_user_id'}, 'no_seq_scan': {'food_item'}},
+             {'match': r'^SELECT count', 'no_seq_scan': {'food_item'}}]),
+        'admin_all_food_items_by_date': (
+            f'/auth-user/admin/all-food-items?date_from={week_from}&date_to={week_to}&per_page=20', admin,
+            [{'match': r'food_item\.timestamp >= .*LIMIT', 'max_partitions': 2},
+             {'match': r'^SELECT count', 'max_partitions': 2}]),
+        'admin_users': (
+            '/auth-user/admin/users?limit=10', admin, [user_activity]),
+        'admin_users_by_email': (
+            '/auth-user/admin/users?email=USER12&limit=10', admin,
+            [user_activity]),
+        'glycemic_load': (
+            f'/nutritional-information/glycemic-load?date_from={(ctx.now - timedelta(days=60)).date().isoformat()}',
+            user,
+            [{'match': r'FROM food_item JOIN food_type .*food_item\.user_id =',
+              'indexes': {'idx_food_user_timestamp', 'idx_food_user_id'},
+              'no_seq_scan': {'food_item'},
+              'max_partitions': 4}]),
+    }
+
+
+class StatementCapture:
+    """Records the SELECTs issued on an engine while active, in order."""
+
+    def __init__(self, engine):
+        self.active = False
+        self.statements = []
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not executemany and re.match(r'\s*(SELECT|WITH)\b', statement, re.I):
+            with self._lock:
+                self.statements.append((statement, parameters))
+
+    def distinct(self):
+        """[(statement, first parameters, times issued)] in first-issued order."""
+        seen = {}
+        for statement, parameters in self.statements:
+            if statement in seen:
+                seen[statement][2] += 1
+            else:
+                seen[statement] = [statement, parameters, 1]
+        return [tuple(entry) for entry in seen.values()]
+
+
+def inheritance_names(conn):
+    """{partition or partition index: parent} so plans read the same whatever partitions exist."""
+    return dict(conn.execute(text(
+        "SELECT c.relname, p.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent"
+    )).all())
+
+
+def walk(node, under_limit=False):
+    yield node, under_limit
+    under_limit = under_limit or node['Node Type'] == 'Limit'
+    for child in node.get('Plans', []):
+        yield from walk(child, under_limit)
+
+
+def render(node, names, depth=0):
+    """Normalized plan lines: node type, join type, index and table, without costs or timings."""
+    label = node['Node Type']
+    if node.get('Join Type') and node['Join Type'] != 'Inner':
+        label += f" {node['Join Type']}"
+    if node.get('Index Name'):
+        label += f" using {names.get(node['Index Name'], node['Index Name'])}"
+    if node.get('Relation Name'):
+        label += f" on {names.get(node['Relation Name'], node['Relation Name'])}"
+    if node.get('Parent Relationship') in ('SubPlan', 'InitPlan'):
+        label = f"[{node.get('Subplan Name', node['Parent Relationship'])}] {label}"
+    lines = ['  ' * depth + label]
+    children = [render(child, names, depth + 1) for child in node.get('Plans', [])]
+    if node['Node Type'] in ('Append', 'Merge Append'):
+        # One line per distinct partition plan; how many partitions exist depends on the date
+        unique = []
+        for child in children:
+            if child not in unique:
+                unique.append(child)
+        children = unique
+    for child in children:
+        lines.extend(child)
+    return lines
+
+
+def check(plan, names, expectation, max_misestimate, min_rows):
+    """Problems with one EXPLAIN ANALYZE plan against one expectation."""
+    problems = []
+    nodes = list(walk(plan['Plan']))
+    indexes = {names.get(n['Index Name'], n['Index Name']) for n, _ in nodes if n.get('Index Name')}
+    wanted = expectation.get('indexes')
+    if wanted and not indexes & wanted:
+        problems.append(f"expected an index scan using {' or '.join(sorted(wanted))}, "
+                        f"used {', '.join(sorted(indexes)) or 'no index'}")
+    for node, _ in nodes:
+        table = names.get(node.get('Relation Name'), node.get('Relation Name'))
+        if node['Node Type'] != 'Seq Scan' or table not in expectation.get('no_seq_scan', ()):
+            continue
+        # Empty partitions (future months, the default) are always seq scanned; that's fine
+        read = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * node.get('Actual Loops', 0)
+        if read >= min_rows:
+            problems.append(f"Seq Scan on {node['Relation Name']} read {read} rows")
+    if 'max_partitions' in expectation:
+        scanned = {n['Relation Name'] for n, _ in nodes
+                   if n.get('Relation Name') and names.get(n['Relation Name']) == 'food_item'
+                   and n.get('Actual Loops', 0) > 0}
+        if len(scanned) > expectation['max_partitions']:
+            problems.append(f"scanned {len(scanned)} food_item partitions (max {expectation['max_partitions']}): "
+                            f"{', '.join(sorted(scanned))}")
+    for node, under_limit in nodes:
+        # Below a Limit nodes stop early, so their actual rows say nothing about the estimate
+        if under_limit or node['Node Type'] not in _SCAN_NODES or not node.get('Actual Loops'):
+            continue
+        estimated, actual = node['Plan Rows'], node['Actual Rows']
+        if max(estimated, actual) >= min_rows and max(estimated, actual) / max(min(estimated, actual), 1) > max_misestimate:
+            problems.append(f"{node['Node Type']} on {node.get('Relation Name', '?')}: estimated {estimated} rows, "
+                            f"got {actual}")
+    return problems
+
+
+def run_scenario(app, conn, capture, names, name, url, headers, expectations, args):
+    capture.statements = []
+    capture.active = True
+    try:
+        response = app.test_client().get(url, headers=headers)
+    finally:
+        capture.active = False
+    if response.status_code != 200:
+        return [f"GET {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}"], [], []
+
+    problems, baseline, report = [], [], []
+    matched = [0] * len(expectations)
+    for number, (statement, parameters, issued) in enumerate(capture.distinct(), 1):
+        plan = conn.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters).scalar()[0]
+        sql = ' '.join(statement.split())
+        baseline.append(f"-- statement {number} (issued {issued}x)\n{sql}\n" + '\n'.join(render(plan['Plan'], names)))
+        top = plan['Plan']
+        report.append((number, issued, plan['Execution Time'],
+                       top.get('Shared Hit Blocks', 0), top.get('Shared Read Blocks', 0), sql[:70]))
+        for i, expectation in enumerate(expectations):
+            if re.search(expectation['match'], sql, re.S):
+                matched[i] += 1
+                problems.extend(f"statement {number}: {p}"
+                                for p in check(plan, names, expectation, args.max_misestimate, args.min_rows))
+    for expectation, count in zip(expectations, matched):
+        if not count:
+            problems.append(f"no statement matched {expectation['match']!r}")
+    return problems, baseline, report
+
+
+def make_config(args):
+    class PlanConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = args.database_uri
+        AUTO_CREATE_TABLES = False
+        ENABLE_MIGRATIONS = True
+        IMAGE_GC_INTERVAL = 0
+    return PlanConfig
+
+
+def seed(app, args):
+    """Migrate to head, create monthly partitions over the seeded span, load data and ANALYZE."""
+    from flask_migrate import upgrade
+    from partitioning import ensure_partitions
+
+    with app.app_context():
+        tables = db.session.execute(text(
+            "SELECT count(*) FROM information_schema.tables WHERE table_schema = 'public'")).scalar()
+        if tables and not args.reset:
+            sys.exit("The database is not empty; pass --reset to drop everything in its public schema first")
+        if tables:
+            db.session.execute(text("DROP SCHEMA public CASCADE"))
+            db.session.execute(text("CREATE SCHEMA public"))
+            db.session.commit()
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        ensure_partitions(args.days // 28 + 4, today=datetime.utcnow() - timedelta(days=args.days))
+        summary = datagen.generate(users=args.users, items_per_user=args.items_per_user, days=args.days,
+                                   seed=args.seed)
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM ANALYZE')
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', default=os.getenv('PLANS_DATABASE_URI'),
+                        help='an empty Postgres database (or PLANS_DATABASE_URI)')
+    parser.add_argument('--reset', action='store_true', help="drop the database's public schema before seeding")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items-per-user', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--max-misestimate', type=float, default=10.0,
+                        help='largest tolerated ratio between estimated and actual rows of a scan (default 10)')
+    parser.add_argument('--min-rows', type=int, default=100,
+                        help='ignore estimate errors on scans of fewer rows than this')
+    parser.add_argument('--update', action='store_true', help='write the current plans as the new baselines')
+    parser.add_argument('--strict', action='store_true', help='also fail when a plan differs from its baseline')
+    args = parser.parse_args()
+    if not args.database_uri or not args.database_uri.startswith('postgresql'):
+        parser.error('--database-uri must point at a Postgres database')
+
+    app = create_app(make_config(args))
+    summary = seed(app, args)
+    print(f"Seeded {summary['food_items']} food items for {summary['users']} users over {args.days} days")
+
+    from models import User
+    from routes import generate_tokens
+    failures = changed = 0
+    with app.app_context():
+        user = User.query.filter_by(email=summary['user_emails'][0]).first()
+        admin = User.query.filter_by(email=summary['admin_emails'][0]).first()
+        with app.test_request_context():
+            user_token, _ = generate_tokens(user)
+            admin_token, _ = generate_tokens(admin)
+        ctx = SimpleNamespace(user_id=user.id, now=datetime.utcnow(),
+                              user_headers={'Authorization': f'Bearer {user_token}'},
+                              admin_headers={'Authorization': f'Bearer {admin_token}'})
+        scenarios = build_scenarios(ctx)
+        if args.only:
+            scenarios = {n: s for n, s in scenarios.items() if n in args.only.split(',')}
+        capture = StatementCapture(db.engine)
+        db.session.remove()
+
+        os.makedirs(PLANS_DIR, exist_ok=True)
+        with db.engine.connect() as conn:
+            names = inheritance_names(conn)
+            for name, (url, headers, expectations) in scenarios.items():
+                problems, baseline, report = run_scenario(app, conn, capture, names, name, url, headers,
+                                                          expectations, args)
+                conn.rollback()
+                print(f"\n{name}: GET {url}")
+                for number, issued, ms, hit, read, sql in report:
+                    print(f"  #{number:<3}{issued:>5}x {ms:9.2f} ms  buffers hit={hit:<6} read={read:<6} {sql}")
+                for problem in problems:
+                    print(f"  FAIL {problem}")
+                failures += bool(problems)
+
+                path = os.path.join(PLANS_DIR, f'{name}.plan')
+                current = '\n\n'.join(baseline) + '\n'
+                previous = open(path).read() if os.path.exists(path) else None
+                if args.update:
+                    with open(path, 'w') as f:
+                        f.write(current)
+                elif previous is None:
+                    print(f"  no baseline yet ({os.path.relpath(path, ROOT)}); run with --update to record it")
+                elif previous != current:
+                    changed += 1
+                    print(f"  plan differs from {os.path.relpath(path, ROOT)}:")
+                    for line in difflib.unified_diff(previous.splitlines(), current.splitlines(),
+                                                     'baseline', 'current', lineterm=''):
+                        print(f"    {line}")
+
+    print(f"\n{len(scenarios)} scenario(s), {failures} failing, {changed} with changed plans")
+    return 1 if failures or (args.strict and changed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""Per-endpoint benchmark suite covering every blueprint.
+
+Seeds a synthetic dataset (benchmarks/datagen.py), then drives each endpoint
+through the Flask test client and records throughput, p50/p95/p99 latency
+and SQL statements per request. OpenAI, Google OAuth and SMTP are stubbed so
+only this service's own cost is measured. Results are written as JSON and
+can be compared between runs with benchmarks/compare.py.
+
+    python benchmarks/run_suite.py --users 200 --items-per-user 100 --output base.json
+    python benchmarks/run_suite.py --database-uri postgresql://localhost/glucocheck_bench --output pg.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+import stats  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from benchmarks import datagen  # noqa: E402
+from benchmarks.loadgen import run_load  # noqa: E402
+from benchmarks.stubs import STUB_ANALYSIS, StubOIDCIssuer, meal_image  # noqa: E402
+
+FOOD_PAYLOAD = {"foods": [
+    {"name": "Apple", "type": "Fruit", "volume": 100, "calories": 52, "carbs": 14, "fat": 0.2, "protein": 0.3},
+    {"name": "Rice", "type": "Grain", "volume": 150, "calories": 195, "carbs": 42, "fat": 0.4, "protein": 4},
+]}
+IMPORT_ROWS = 100  # rows per import request
+
+
+def import_csv(user_id=None):
+    """An import body of IMPORT_ROWS catalog foods; with a user_id column for the admin import."""
+    prefix = f'{user_id},' if user_id else ''
+    lines = [('user_id,' if user_id else '') + 'name,food_type,volume,calories,carbs,fat,protein']
+    for n in range(IMPORT_ROWS):
+        name, food_type, calories, carbs, fat, protein = datagen.FOOD_CATALOG[n % len(datagen.FOOD_CATALOG)]
+        lines.append(f'{prefix}{name},{food_type},100,{calories},{carbs},{fat},{protein}')
+    return '\n'.join(lines) + '\n'
+
+
+class FakeOpenAIClient:
+    """Answers chat.completions.create() with a canned analysis."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        message = SimpleNamespace(role='assistant', content=json.dumps(STUB_ANALYSIS))
+        usage = SimpleNamespace(prompt_tokens=850, completion_tokens=120, total_tokens=970)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage, model='gpt-4o')
+
+
+class FakeGoogleSession:
+    """Stands in for the requests-oauthlib session used by the Google callback.
+
+    The token response carries an ID token signed by the local issuer, so
+    the callback exercises local verification against its cached JWKS.
+    """
+
+    def __init__(self, email, issuer):
+        self._email = email
+        self._issuer = issuer
+
+    def fetch_token(self, *args, **kwargs):
+        return {'access_token': 'stub', 'token_type': 'Bearer', 'expires_in': 3600,
+                'id_token': self._issuer.id_token(self._email)}
+
+    def get(self, url):
+        return SimpleNamespace(json=lambda: {'email': self._email, 'given_name': 'Google', 'family_name': 'User'})
+
+
+class QueryCounter:
+    """Counts SQL statements executed on the current thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def make_config(args):
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = args.database_uri
+        BCRYPT_LOG_ROUNDS = args.bcrypt_rounds
+        SERVER_NAME = 'localhost'
+    return BenchConfig
+
+
+def build_scenarios(ctx):
+    """name -> (blueprint, request factory). A factory returns (method, url, kwargs, expected_status)."""
+    user_auth = {'Authorization': f'Bearer {ctx.user_token}'}
+    admin_auth = {'Authorization': f'Bearer {ctx.admin_token}'}
+    counter = iter(range(10 ** 9))
+
+    def register(i):
+        n = next(counter)
+        return 'POST', '/auth-user/register', {'json': {
+            'first_name': 'New', 'last_name': 'User', 'email': f'new{n}-{ctx.run_id}@bench.example.com',
+            'password': datagen.BENCH_PASSWORD}}, 201
+
+    def login(i):
+        return 'POST', '/auth-user/login', {'json': {'email': ctx.user_email, 'password': datagen.BENCH_PASSWORD}}, 200
+
+    def refresh(i):
+        return 'POST', '/auth-user/refresh', {'json': {'refresh_token': ctx.refresh_token}}, 200
+
+    def forgot_password(i):
+        return 'POST', '/auth-user/forgot-password', {'json': {'email': ctx.user_email}}, 200
+
+    def google_callback(i):
+        return 'GET', '/google-auth/google/authorized?code=stub&state=stub', {}, 200
+
+    def save_items(i):
+        return 'POST', '/food-items/food-items', {'json': FOOD_PAYLOAD, 'headers': user_auth}, 201
+
+    def list_items(i):
+        return 'GET', '/food-items/food-items', {'headers': user_auth}, 200
+
+    def delete_item(i):
+        return 'DELETE', f'/food-items/food-items/{ctx.deletable.pop()}', {'headers': user_auth}, 200
+
+    def analyze(i):
+        # New bytes every time (and every run), or all but the first request are analysis cache hits
+        image = meal_image(f'{ctx.run_id}-{next(counter)}')
+        return 'POST', '/image-information/analyze', {
+            'data': {'image': (io.BytesIO(image), 'meal.png')},
+            'headers': user_auth, 'content_type': 'multipart/form-data'}, 200
+
+    def admin_users(i):
+        return 'GET', '/auth-user/admin/users', {'headers': admin_auth}, 200
+
+    def admin_users_search(i):
+        return 'GET', '/auth-user/admin/users?name=first1&limit=50', {'headers': admin_auth}, 200
+
+    def admin_users_page(i):
+        return 'GET', f'/auth-user/admin/users?after={ctx.middle_user_id}&limit=50', {'headers': admin_auth}, 200
+
+    def admin_user_items(i):
+        return 'GET', f'/auth-user/admin/users/{ctx.user_id}/food-items', {'headers': admin_auth}, 200
+
+    def admin_all_items(i):
+        return 'GET', '/auth-user/admin/all-food-items?page=3&per_page=50', {'headers': admin_auth}, 200
+
+    def admin_all_items_filtered(i):
+        return 'GET', (f'/auth-user/admin/all-food-items?food_type=Fruit&date_from={ctx.date_from}'
+                       f'&per_page=50'), {'headers': admin_auth}, 200
+
+    def export_items(i):
+        return 'GET', '/food-items/food-items/export?format=csv', {'headers': user_auth}, 200
+
+    def export_items_ndjson(i):
+        return 'GET', '/food-items/food-items/export?format=ndjson', {'headers': user_auth}, 200
+
+    def import_items(i):
+        return 'POST', '/food-items/food-items/import', {
+            'data': ctx.import_csv, 'headers': user_auth, 'content_type': 'text/csv'}, 201
+
+    def glycemic_load(i):
+        return 'GET', '/nutritional-information/glycemic-load', {'headers': user_auth}, 200
+
+    def glycemic_load_range(i):
+        return 'GET', f'/nutritional-information/glycemic-load?date_from={ctx.glycemic_from}', {
+            'headers': user_auth}, 200
+
+    def admin_stats(i):
+        return 'GET', '/auth-user/admin/stats', {'headers': admin_auth}, 200
+
+    def admin_analysis_usage(i):
+        return 'GET', '/auth-user/admin/analysis-usage', {'headers': admin_auth}, 200
+
+    def admin_export(i):
+        return 'GET', f'/auth-user/admin/food-items/export?format=csv&food_type=Fruit&date_from={ctx.date_from}', {
+            'headers': admin_auth}, 200
+
+    def admin_import(i):
+        return 'POST', '/auth-user/admin/food-items/import', {
+            'data': ctx.admin_import_csv, 'headers': admin_auth, 'content_type': 'text/csv'}, 201
+
+    return {
+        'auth.register': ('auth', register),
+        'auth.login': ('auth', login),
+        'auth.refresh': ('auth', refresh),
+        'auth.forgot_password': ('auth', forgot_password),
+        'google_oauth.authorized': ('google_oauth', google_callback),
+        'food_items.save': ('food-items', save_items),
+        'food_items.list': ('food-items', list_items),
+        'food_items.delete': ('food-items', delete_item),
+        'food_items.export': ('food-items', export_items),
+        'food_items.export_ndjson': ('food-items', export_items_ndjson),
+        'food_items.import': ('food-items', import_items),
+        'nutritional_information.glycemic_load': ('nutritional-information', glycemic_load),
+        'nutritional_information.glycemic_load_range': ('nutritional-information', glycemic_load_range),
+        'image_information.analyze': ('image-information', analyze),
+        'admin.users': ('auth', admin_users),
+        'admin.users_search': ('auth', admin_users_search),
+        'admin.users_page': ('auth', admin_users_page),
+        'admin.user_food_items': ('auth', admin_user_items),
+        'admin.all_food_items': ('auth', admin_all_items),
+        'admin.all_food_items_filtered': ('auth', admin_all_items_filtered),
+        'admin.stats': ('auth', admin_stats),
+        'admin.analysis_usage': ('auth', admin_analysis_usage),
+        'admin.export': ('auth', admin_export),
+        'admin.import': ('auth', admin_import),
+    }
+
+
+def install_stubs(app, google_email, issuer):
+    import routes
+    app.extensions['openai_client'] = FakeOpenAIClient()
+    app.config['GOOGLE_DISCOVERY_URL'] = issuer.discovery_url
+    app.config['GOOGLE_CLIENT_ID'] = issuer.client_id
+    routes.get_google_oauth_session = lambda state=None, token=None: FakeGoogleSession(google_email, issuer)
+
+
+def run_scenario(app, counter, factory, args):
+    errors = []
+    query_counts = []
+
+    def send(worker):
+        method, url, kwargs, expected = factory(worker)
+        with app.test_client() as client:
+            counter.reset()
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()  # streamed bodies (exports) run their queries while being read
+            query_counts.append(counter.count)
+            if response.status_code != expected and len(errors) < 3:
+                errors.append(f'{response.status_code}: {response.get_data(as_text=True)[:200]}')
+            return response.status_code == expected
+
+    for i in range(args.warmup):
+        send(i)
+    query_counts.clear()
+    result = run_load(send, args.concurrency, requests=args.requests)
+    result['queries_per_request'] = sum(query_counts) / len(query_counts) if query_counts else 0
+    if errors:
+        result['sample_errors'] = errors
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', help='defaults to a temporary SQLite file')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--items-per-user', type=int, default=100)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--only', help='comma-separated scenario names or blueprint names')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        args.database_uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='glucocheck-bench-'), 'bench.db')}"
+
+    app = create_app(make_config(args))
+    issuer = StubOIDCIssuer(client_id='bench-client.apps.googleusercontent.com').__enter__()
+    with app.app_context():
+        db.create_all()
+        summary = datagen.generate(users=args.users, items_per_user=args.items_per_user, days=args.days,
+                                   seed=args.seed)
+        # The admin statistics read aggregates, which the bulk-inserted items bypass
+        stats.rebuild()
+        datagen.generate_usage(summary['user_ids'], days=min(args.days, 30), seed=args.seed)
+        install_stubs(app, summary['user_emails'][1], issuer)
+        counter = QueryCounter(db.engine)
+
+        from models import FoodItem, User
+        from routes import generate_tokens
+        user = User.query.filter_by(email=summary['user_emails'][0]).first()
+        admin = User.query.filter_by(email=summary['admin_emails'][0]).first()
+        with app.test_request_context():
+            user_token, refresh_token = generate_tokens(user)
+            admin_token, _ = generate_tokens(admin)
+        deletable = [row.id for row in FoodItem.query.filter_by(user_id=user.id)
+                     .order_by(FoodItem.id).limit(args.requests + args.warmup)]
+        ctx = SimpleNamespace(
+            user_email=user.email, user_id=user.id, user_token=user_token, refresh_token=refresh_token,
+            admin_token=admin_token, deletable=deletable, run_id=os.urandom(4).hex(),
+            date_from=(datetime.utcnow() - timedelta(days=max(1, args.days // 3))).date().isoformat(),
+            glycemic_from=(datetime.utcnow() - timedelta(days=args.days)).date().isoformat(),
+            middle_user_id=summary['user_ids'][len(summary['user_ids']) // 2],
+            import_csv=import_csv(), admin_import_csv=import_csv(user.id),
+        )
+        db.session.remove()
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    for name, (blueprint, factory) in build_scenarios(ctx).items():
+        if only and name not in only and blueprint not in only:
+            continue
+        if name == 'food_items.delete' and len(ctx.deletable) < args.requests + args.warmup:
+            continue
+        results[name] = run_scenario(app, counter, factory, args)
+        results[name]['blueprint'] = blueprint
+        r = results[name]
+        print(f"{name:<46}{r['throughput_rps']:9.1f} rps  p50 {r['p50_ms'] or 0:8.2f}  "
+              f"p95 {r['p95_ms'] or 0:8.2f}  p99 {r['p99_ms'] or 0:8.2f} ms  "
+              f"{r['queries_per_request']:6.1f} q/req  {r['errors']} err", file=sys.stderr)
+
+    issuer.__exit__(None, None, None)
+
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'dialect': args.database_uri.split(':', 1)[0],
+            'users': args.users,
+            'items_per_user': args.items_per_user,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'bcrypt_rounds': args.bcrypt_rounds,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
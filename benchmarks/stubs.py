@@ -0,0 +1,181 @@
+"""Local stand-ins for upstream services used by the benchmarks."""
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ANALYSIS = {
+    "foods": [
+        {"name": "Rice", "type": "Grain", "volume": "150 gm", "count": "1",
+         "nutritional_info": {"calories": "195 kcal", "carbs": "42 g", "fat": "0.4 g", "protein": "4 g"}},
+        {"name": "Apple", "type": "Fruit", "volume": "120 gm", "count": "1",
+         "nutritional_info": {"calories": "62 kcal", "carbs": "16 g", "fat": "0.2 g", "protein": "0.3 g"}},
+    ]
+}
+
+
+
+def meal_image(seed, size=20 * 1024):
+    """A valid PNG of about `size` bytes, different for every `seed`.
+
+    /analyze caches its answer per distinct image, so a benchmark that wants
+    to measure the upstream path has to send new bytes each time.
+    """
+    rng = random.Random(seed)
+    side = max(1, int((size / 3) ** 0.5))
+    raw = b''.join(b'\x00' + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b''))
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        time.sleep(self.server.latency)
+        payload = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(STUB_ANALYSIS)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 800 + len(body) // 1000, "completion_tokens": 120,
+                      "total_tokens": 920 + len(body) // 1000},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOpenAIServer:
+    """Serves canned chat completions after a fixed delay to mimic model latency.
+
+    Point the app at it with OPENAI_BASE_URL=<server.base_url>.
+    """
+
+    def __init__(self, latency=0.5, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _OpenAIHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _OIDCHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        issuer = self.server.issuer
+        if self.path == '/.well-known/openid-configuration':
+            document = {
+                'issuer': issuer.issuer,
+                'jwks_uri': f"{issuer.issuer}/certs",
+                'authorization_endpoint': f"{issuer.issuer}/auth",
+                'token_endpoint': f"{issuer.issuer}/token",
+                'userinfo_endpoint': f"{issuer.issuer}/userinfo",
+                'id_token_signing_alg_values_supported': ['RS256'],
+            }
+        elif self.path == '/certs':
+            document = {'keys': [jwk for _, jwk in issuer.keys.values()]}
+        else:
+            self.send_error(404)
+            return
+        with issuer.lock:
+            issuer.hits[self.path] = issuer.hits.get(self.path, 0) + 1
+        payload = json.dumps(document).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Cache-Control', f"public, max-age={issuer.max_age}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOIDCIssuer:
+    """A local OpenID provider: discovery document, JWKS and RS256 ID tokens.
+
+    Point the app at it with GOOGLE_DISCOVERY_URL=<issuer.discovery_url>.
+    `rotate()` publishes a new signing key, and `hits` counts the requests
+    per path, so JWKS caching and refresh-on-unknown-kid can be checked.
+    """
+
+    def __init__(self, client_id, max_age=3600, host='127.0.0.1', port=0):
+        self.client_id = client_id
+        self.max_age = max_age
+        self.keys = {}  # kid -> (private key, public JWK)
+        self.hits = {}
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _OIDCHandler)
+        self._server.daemon_threads = True
+        self._server.issuer = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self.kid = None
+        self.rotate()
+
+    @property
+    def issuer(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def discovery_url(self):
+        return f"{self.issuer}/.well-known/openid-configuration"
+
+    def rotate(self):
+        """Start signing with a new key (the old ones stay published)."""
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jwt.algorithms import RSAAlgorithm
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = f"stub-{len(self.keys) + 1}"
+        jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update(kid=self.kid, alg='RS256', use='sig')
+        self.keys[self.kid] = (private_key, jwk)
+        return self.kid
+
+    def id_token(self, email, lifetime=3600, **claims):
+        import jwt
+
+        now = int(time.time())
+        payload = {
+            'iss': self.issuer, 'aud': self.client_id, 'sub': f"stub-{email}", 'iat': now, 'exp': now + lifetime,
+            'email': email, 'email_verified': True, 'given_name': 'Google', 'family_name': 'User',
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.keys[self.kid][0], algorithm='RS256', headers={'kid': self.kid})
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
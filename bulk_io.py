@@ -0,0 +1,414 @@
+#bulk_io.py
+import csv
+import heapq
+import io
+import itertools
+import json
+import queue
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: pip install pyarrow
+    pyarrow = None
+
+from app import db
+from models import FoodItem, FoodType
+import stats
+import glycemic
+from sharding import shards
+
+EXPORT_COLUMNS = ['id', 'user_id', 'name', 'food_type', 'volume', 'timestamp', 'date_uploaded',
+                  'calories', 'carbs', 'fat', 'protein']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+IMPORT_FORMATS = ('csv', 'ndjson')
+# Matches _value(), so COPY and the Python writer produce the same CSV
+_PG_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US'
+
+
+def available_export_formats():
+    """Export formats this process can produce, with their mimetypes."""
+    if pyarrow is None:
+        return {fmt: mimetype for fmt, mimetype in EXPORT_FORMATS.items() if fmt != 'parquet'}
+    return dict(EXPORT_FORMATS)
+
+_NUTRIENTS = ('calories', 'carbs', 'fat', 'protein')
+_NAME_LENGTH = FoodItem.__table__.c.name.type.length
+_FOOD_TYPE_LENGTH = FoodType.__table__.c.type.type.length
+
+
+class BulkImportError(ValueError):
+    """A row of an import could not be used; the message names the row."""
+
+
+def export_query(user_id=None, food_type=None, date_from=None, date_to=None):
+    """Food items flattened with type and nutrition, using the admin listing filters."""
+    query = db.select(
+        FoodItem.id, FoodItem.user_id, FoodItem.name, FoodType.type.label('food_type'), FoodItem.volume,
+        FoodItem.timestamp, FoodItem.date_uploaded, FoodItem.calories, FoodItem.carbs, FoodItem.fat,
+        FoodItem.protein,
+    ).join(FoodType, FoodType.id == FoodItem.food_type_id)
+    if user_id:
+        query = query.where(FoodItem.user_id == user_id)
+    if food_type:
+        query = query.where(FoodType.type == food_type)
+    if date_from:
+        query = query.where(FoodItem.timestamp >= date_from)
+    if date_to:
+        query = query.where(FoodItem.timestamp <= date_to)
+    return query.order_by(FoodItem.timestamp, FoodItem.id)
+
+
+def _routed_connection():
+    """The session's connection for food_item: the current user's shard, or the primary."""
+    return db.session.connection(bind_arguments={'mapper': FoodItem})
+
+
+def _columns(with_shard):
+    # Ids are only unique within a shard, so admin exports say where each row lives
+    return EXPORT_COLUMNS + ['shard'] if with_shard else EXPORT_COLUMNS
+
+
+def _tagged(result, key):
+    for row in result:
+        yield row, key
+
+
+def _stream_rows(query, batch_size, shard_keys=None, with_shard=False):
+    # stream_results uses a server-side cursor on Postgres, so memory stays flat
+    if not shard_keys:
+        key = shards.current()
+        result = _routed_connection().execution_options(stream_results=True, yield_per=batch_size)\
+            .execute(query)
+        for rows in result.partitions():
+            yield [tuple(row) + (key,) for row in rows] if with_shard else rows
+        return
+    # Every shard streams in (timestamp, id) order; merge them into one ordered stream
+    streams = [_tagged(shards.connection(key).execution_options(stream_results=True, yield_per=batch_size)
+                       .execute(query), key) for key in shard_keys]
+    merged = heapq.merge(*streams, key=lambda pair: (pair[0].timestamp, pair[0].id))
+    while True:
+        pairs = list(itertools.islice(merged, batch_size))
+        if not pairs:
+            break
+        yield [tuple(row) + (key,) for row, key in pairs] if with_shard else [row for row, _ in pairs]
+
+
+def _value(value):
+    return value.isoformat(timespec='microseconds') if isinstance(value, datetime) else value
+
+
+def _csv_value(value):
+    # Whole numbers the way COPY writes float8 ('52', not '52.0')
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return int(value)
+    return _value(value)
+
+
+def _csv_chunks(query, batch_size, shard_keys=None, with_shard=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')  # as COPY ends its lines
+    writer.writerow(_columns(with_shard))
+    for rows in _stream_rows(query, batch_size, shard_keys, with_shard):
+        writer.writerows([_csv_value(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(query, batch_size, shard_keys=None, with_shard=False):
+    columns = _columns(with_shard)
+    for rows in _stream_rows(query, batch_size, shard_keys, with_shard):
+        yield ''.join(json.dumps(dict(zip(columns, map(_value, row)))) + '\n' for row in rows)
+
+
+def _file_chunks(f, chunk_size=256 * 1024):
+    with f:
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _parquet_chunks(query, batch_size, shard_keys=None, with_shard=False):
+    # Parquet needs its footer written last, so row groups are spooled to a
+    # temporary file (on disk once large) and streamed when complete.
+    pa, pq = pyarrow, pyarrow.parquet
+    schema = pa.schema([
+        ('id', pa.int64()), ('user_id', pa.int64()), ('name', pa.string()), ('food_type', pa.string()),
+        ('volume', pa.float64()), ('timestamp', pa.timestamp('us')), ('date_uploaded', pa.timestamp('us')),
+        ('calories', pa.float64()), ('carbs', pa.float64()), ('fat', pa.float64()), ('protein', pa.float64()),
+    ] + ([('shard', pa.string())] if with_shard else []))
+    spool = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    with pq.ParquetWriter(spool, schema, compression='zstd') as writer:
+        for rows in _stream_rows(query, batch_size, shard_keys, with_shard):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+    yield from _file_chunks(spool)
+
+
+class _CopyPipe:
+    """File object for psycopg2's copy_expert that hands its output to a consumer thread in chunks."""
+
+    def __init__(self, chunk_size=256 * 1024):
+        self.chunks = queue.Queue(maxsize=4)
+        self.cancelled = threading.Event()
+        self._buffer = bytearray()
+        self._chunk_size = chunk_size
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise OSError("export cancelled")
+
+    def write(self, data):
+        # psycopg2 writes one row at a time
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def _pg_copy_csv_chunks(query, with_shard=False):
+    # COPY ... TO STDOUT is the fastest way out of Postgres. psycopg2 pushes the
+    # whole result into a file object, so the COPY runs in a thread writing to a
+    # small queue and chunks are yielded as they arrive.
+    connection = _routed_connection()
+    query = query.with_only_columns(*(
+        db.func.to_char(column, _PG_TIMESTAMP_FORMAT).label(column.name) if isinstance(column.type, db.DateTime)
+        else column for column in query.selected_columns), maintain_column_froms=True)
+    if with_shard:
+        query = query.add_columns(db.literal(shards.current(), db.String).label('shard'))
+    compiled = query.compile(dialect=connection.dialect)
+    raw = connection.connection.dbapi_connection
+    pipe = _CopyPipe()
+    with raw.cursor() as cursor:
+        select_sql = cursor.mogrify(str(compiled), compiled.params).decode()
+
+        def copy():
+            try:
+                cursor.copy_expert(f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", pipe)
+                pipe.flush()
+                pipe.put(None)
+            except Exception as e:
+                if not pipe.cancelled.is_set():
+                    pipe.put(e)
+
+        thread = threading.Thread(target=copy, name='export-copy', daemon=True)
+        thread.start()
+        try:
+            while True:
+                chunk = pipe.chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # The client went away or the COPY failed: stop the thread before the connection is reused
+            pipe.cancelled.set()
+            thread.join()
+
+
+def export_chunks(fmt, query, batch_size=5000, shard_keys=None, with_shard=False):
+    """Yield the export body for `fmt` chunk by chunk, merged across `shard_keys` when given.
+
+    With `with_shard` every row ends with a shard column (empty for the primary).
+    """
+    if fmt == 'csv':
+        if not shard_keys and db.session.get_bind(FoodItem).dialect.driver == 'psycopg2':
+            return _pg_copy_csv_chunks(query, with_shard)
+        return _csv_chunks(query, batch_size, shard_keys, with_shard)
+    if fmt == 'ndjson':
+        return _ndjson_chunks(query, batch_size, shard_keys, with_shard)
+    if fmt == 'parquet':
+        return _parquet_chunks(query, batch_size, shard_keys, with_shard)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def parse_rows(fmt, stream):
+    """Iterate over import rows (dicts) from a binary stream without reading it all."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+    elif fmt == 'ndjson':
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _float(value):
+    return float(value) if value not in (None, '') else None
+
+
+def _timestamp(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class FoodTypeResolver:
+    """Maps food type names to ids, creating missing ones one batch at a time."""
+
+    def __init__(self):
+        self._ids = {}
+
+    def resolve(self, names):
+        missing = set(names) - set(self._ids)
+        if not missing:
+            return self._ids
+        self._ids.update(db.session.query(FoodType.type, FoodType.id).filter(FoodType.type.in_(missing)).all())
+        missing -= set(self._ids)
+        if missing:
+            dialect = db.session.get_bind().dialect.name
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            db.session.execute(insert(FoodType.__table__).on_conflict_do_nothing(), [{'type': t} for t in missing])
+            self._ids.update(db.session.query(FoodType.type, FoodType.id).filter(FoodType.type.in_(missing)).all())
+        return self._ids
+
+
+_ITEM_COLUMNS = ('name', 'volume', 'food_type_id', 'timestamp', 'date_uploaded', 'user_id') + _NUTRIENTS
+
+
+def _insert_batch_copy(items, ids=None):
+    """Postgres: allocate ids from the sequence (unless given) and COPY the rows."""
+    raw = _routed_connection().connection.dbapi_connection
+    with raw.cursor() as cursor:
+        if ids is None:
+            cursor.execute("SELECT nextval('food_item_id_seq') FROM generate_series(1, %s)", (len(items),))
+            ids = [row[0] for row in cursor.fetchall()]
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for item_id, item in zip(ids, items):
+            writer.writerow([item_id] + ['' if item[c] is None else _value(item[c]) for c in _ITEM_COLUMNS])
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY food_item (id, {', '.join(_ITEM_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+                           buffer)
+    return ids
+
+
+def _insert_batch(items, ids=None):
+    """Other databases: multi-row INSERT, with RETURNING for the ids unless given."""
+    if ids is not None:
+        db.session.execute(db.insert(FoodItem.__table__), [dict(item, id=i) for i, item in zip(ids, items)])
+        return ids
+    return db.session.execute(
+        db.insert(FoodItem.__table__).returning(FoodItem.__table__.c.id, sort_by_parameter_order=True), items
+    ).scalars().all()
+
+
+def insert_items(items):
+    """Insert food items (dicts of _ITEM_COLUMNS) on the current shard; returns the new ids in order.
+
+    Food types the items refer to are copied to the shard first, and when
+    sharded the ids come from the allocator shared by all shards.
+    """
+    shards.replicate_food_types({item['food_type_id'] for item in items})
+    ids = shards.allocate_item_ids(len(items)) if shards.enabled else None
+    if db.session.get_bind(FoodItem).dialect.driver == 'psycopg2':
+        return _insert_batch_copy(items, ids)
+    return _insert_batch(items, ids)
+
+
+def _insert_per_shard(items):
+    """Rows of several (existing) users: one insert per shard they live on."""
+    user_shards = shards.shards_for(item['user_id'] for item in items)
+    groups = {}
+    for item in items:
+        groups.setdefault(user_shards[item['user_id']], []).append(item)
+    for key, shard_items in groups.items():
+        with shards.using(key):
+            insert_items(shard_items)
+
+
+def import_rows(rows, user_id=None, batch_size=5000):
+    """Bulk-insert food items from `rows` (dicts with EXPORT_COLUMNS keys).
+
+    With `user_id` every row belongs to that user; otherwise each row must
+    carry the user_id of an existing user. Runs in the caller's transaction. Returns the
+    number of rows imported; raises BulkImportError on a bad row.
+    """
+    insert_batch = _insert_per_shard if user_id is None and shards.enabled else insert_items
+    resolver = FoodTypeResolver()
+    now = datetime.utcnow()
+    total = 0
+    batch = []
+
+    def flush():
+        if user_id is None:
+            # An unknown user would otherwise surface as a foreign key error from the insert
+            known = shards.shards_for(row['user_id'] for row in batch)
+            for row in batch:
+                if row['user_id'] not in known:
+                    raise BulkImportError(f"row {row['line']}: unknown user_id {row['user_id']}")
+        type_ids = resolver.resolve({row['food_type'] for row in batch})
+        items = [{
+            'name': row['name'], 'volume': row['volume'], 'food_type_id': type_ids[row['food_type']],
+            'timestamp': row['timestamp'], 'date_uploaded': row['date_uploaded'], 'user_id': row['user_id'],
+            **{n: row[n] for n in _NUTRIENTS},
+        } for row in batch]
+        insert_batch(items)
+        stats.record_items(items)
+        glycemic.invalidate(items)
+        batch.clear()
+
+    for line, raw in enumerate(rows, start=1):
+        try:
+            name = (raw.get('name') or '').strip()
+            food_type = (raw.get('food_type') or raw.get('type') or '').strip()
+            if not name or not food_type:
+                raise ValueError("name and food_type are required")
+            timestamp = _timestamp(raw.get('timestamp'), now)
+            if len(name) > _NAME_LENGTH:
+                raise ValueError(f"name is longer than {_NAME_LENGTH} characters")
+            if len(food_type) > _FOOD_TYPE_LENGTH:
+                raise ValueError(f"food_type is longer than {_FOOD_TYPE_LENGTH} characters")
+            batch.append({
+                'line': line,
+                'name': name,
+                'food_type': food_type,
+                'volume': _float(raw.get('volume')),
+                'timestamp': timestamp,
+                'date_uploaded': _timestamp(raw.get('date_uploaded'), now),
+                'user_id': user_id or int(raw['user_id']),
+                **{n: _float(raw.get(n)) for n in _NUTRIENTS},
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            raise BulkImportError(f"row {line}: {e}") from e
+        if len(batch) >= batch_size:
+            total += len(batch)
+            flush()
+    if batch:
+        total += len(batch)
+        flush()
+    return total
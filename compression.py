@@ -0,0 +1,147 @@
+#compression.py
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard
+    zstandard = None
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, chunk):
+        return self._obj.process(chunk)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk)
+
+    def flush(self):
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def available_encodings():
+    """Content-codings this process can produce, keyed by name."""
+    encodings = {'gzip': _GzipStream}
+    if brotli is not None:
+        encodings['br'] = _BrotliStream
+    if zstandard is not None:
+        encodings['zstd'] = _ZstdStream
+    return encodings
+
+
+def compress_bytes(encoding, data, level):
+    stream = available_encodings()[encoding](level)
+    return stream.compress(data) + stream.finish()
+
+
+def _compress_iter(stream, chunks):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        out = stream.compress(chunk) + stream.flush()
+        if out:
+            yield out
+    yield stream.finish()
+
+
+class Compress:
+    """Compresses responses with gzip, brotli or zstd as negotiated by Accept-Encoding.
+
+    Buffered responses smaller than COMPRESS_MIN_SIZE are sent as-is.
+    Streamed responses are compressed chunk by chunk, flushing after each
+    chunk so the client keeps receiving data as it is produced.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json', 'text/plain', 'text/csv',
+                                                     'text/html', 'application/x-ndjson'])
+        # Server preference when the client accepts several codings equally
+        app.config.setdefault('COMPRESS_ALGORITHMS', ['br', 'zstd', 'gzip'])
+        app.config.setdefault('COMPRESS_LEVELS', {'gzip': 6, 'br': 4, 'zstd': 3})
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(self._after_request)
+
+    def _choose_encoding(self, config):
+        accepted = request.accept_encodings
+        encodings = available_encodings()
+        best, best_q = None, 0
+        for name in config['COMPRESS_ALGORITHMS']:
+            if name not in encodings:
+                continue
+            q = accepted.quality(name)
+            if q > best_q:
+                best, best_q = name, q
+        return best
+
+    def _after_request(self, response):
+        config = current_app.config
+
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        streamed = response.is_streamed
+        if not streamed and (response.content_length or 0) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        encoding = self._choose_encoding(config)
+        if encoding is None:
+            return response
+
+        level = config['COMPRESS_LEVELS'][encoding]
+        if streamed:
+            response.response = _compress_iter(available_encodings()[encoding](level), response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress_bytes(encoding, response.get_data(), level))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+compress = Compress()
@@ -1,6 +1,10 @@
 #config.py
 from datetime import timedelta
 import os
+from dotenv import load_dotenv
+
+# Load .env before the config classes below read the environment
+load_dotenv()
 
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI')
@@ -10,22 +14,162 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(seconds=int(os.getenv('ACCESS_TOKEN_EXPIRES', 3600)))
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(seconds=int(os.getenv('REFRESH_TOKEN_EXPIRES', 604800)))
 
+    # Create missing tables on startup (only meant for throwaway databases)
+    AUTO_CREATE_TABLES = False
+    # Register Flask-Migrate (the `flask db` commands)
+    ENABLE_MIGRATIONS = True
+
+    # Rate limiting: token buckets per user (or IP) for each endpoint class,
+    # as 'N/second|minute|hour|day' with an optional ';burst=M'
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() in ['true', '1', 't']
+    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_BUDGETS = {
+        'auth': os.getenv('RATELIMIT_AUTH', '10/minute'),
+        'analyze': os.getenv('RATELIMIT_ANALYZE', '30/hour;burst=5'),
+        'read': os.getenv('RATELIMIT_READ', '120/minute'),
+        'write': os.getenv('RATELIMIT_WRITE', '60/minute'),
+    }
+    # Reverse proxies in front of the app whose X-Forwarded-* headers are trusted;
+    # anonymous clients are rate limited by the address they report
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+    # Upstream image analyses allowed at once per process, and how long /
+    # how many extra requests may wait for a slot before getting a 429
+    ANALYZE_MAX_CONCURRENCY = int(os.getenv('ANALYZE_MAX_CONCURRENCY', 8))
+    ANALYZE_QUEUE_TIMEOUT = float(os.getenv('ANALYZE_QUEUE_TIMEOUT', 5))
+    ANALYZE_MAX_QUEUE = int(os.getenv('ANALYZE_MAX_QUEUE', 16))
+
+    # Response compression (gzip always; br/zstd when brotli/zstandard are installed)
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() in ['true', '1', 't']
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVELS = {
+        'gzip': int(os.getenv('COMPRESS_GZIP_LEVEL', 6)),
+        'br': int(os.getenv('COMPRESS_BR_LEVEL', 4)),
+        'zstd': int(os.getenv('COMPRESS_ZSTD_LEVEL', 3)),
+    }
+
+    # food_item partitioning (Postgres) and archival: `flask partitions ensure|archive`
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+    FOOD_ITEM_RETENTION_MONTHS = int(os.getenv('FOOD_ITEM_RETENTION_MONTHS', 0))  # 0 keeps everything
+    ARCHIVE_TARGET = os.getenv('ARCHIVE_TARGET', 'table')  # 'table' or 'file'
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+    # Online migrations (migrations/env.py, online_migrations.py): how long DDL
+    # may wait for a lock on Postgres ('' to wait forever), and backfill pacing
+    MIGRATION_LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '5s')
+    MIGRATION_BACKFILL_BATCH_SIZE = int(os.getenv('MIGRATION_BACKFILL_BATCH_SIZE', 5000))
+    MIGRATION_BACKFILL_PAUSE = float(os.getenv('MIGRATION_BACKFILL_PAUSE', 0.1))  # seconds between batches
+
+    # User sharding (sharding.py, `flask shards`): extra databases for the per-user
+    # tables as 'name=uri,name=uri', each added as a bind; empty keeps everything
+    # on DATABASE_URI. New users go to the SHARD_PLACEMENT_BINDS shard ('' = any)
+    # with the fewest users.
+    SHARD_DATABASE_URIS = os.getenv('SHARD_DATABASE_URIS', '')
+    SHARD_PLACEMENT_BINDS = os.getenv('SHARD_PLACEMENT_BINDS', '')
+    SHARD_MOVE_BATCH_SIZE = int(os.getenv('SHARD_MOVE_BATCH_SIZE', 1000))
+    SHARD_MOVE_GRACE = float(os.getenv('SHARD_MOVE_GRACE', 5))  # seconds for in-flight requests before copying
+    SHARD_SCATTER_WORKERS = int(os.getenv('SHARD_SCATTER_WORKERS', 8))  # threads for cross-shard admin queries
+
+    # Rows per day that the admin stats counters are spread over to avoid hot-row contention
+    STATS_COUNTER_SLOTS = int(os.getenv('STATS_COUNTER_SLOTS', 8))
+
+    # Group commit for save_food_items (write_buffer.py): requests served by one
+    # process at the same time are committed together, each acknowledged once its
+    # rows are durable. Batches close after MAX_DELAY_MS or MAX_ROWS rows.
+    WRITE_BUFFER_ENABLED = os.getenv('WRITE_BUFFER_ENABLED', 'false').lower() in ['true', '1', 't']
+    WRITE_BUFFER_MAX_DELAY_MS = float(os.getenv('WRITE_BUFFER_MAX_DELAY_MS', 2))
+    WRITE_BUFFER_MAX_ROWS = int(os.getenv('WRITE_BUFFER_MAX_ROWS', 1000))
+    WRITE_BUFFER_ACK_TIMEOUT = float(os.getenv('WRITE_BUFFER_ACK_TIMEOUT', 30))  # seconds a request waits
+
+    # On-demand request profiling (profiling.py, /auth-user/admin/profiling). Workers
+    # serving requests look for a session every IDLE_POLL_SECONDS (POLL_SECONDS while
+    # one runs) and write their stacks every FLUSH_SECONDS.
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'true').lower() in ['true', '1', 't']
+    PROFILING_MAX_DURATION = int(os.getenv('PROFILING_MAX_DURATION', 900))  # seconds
+    PROFILING_INTERVAL_MS = int(os.getenv('PROFILING_INTERVAL_MS', 5))  # default sampling interval
+    PROFILING_POLL_SECONDS = float(os.getenv('PROFILING_POLL_SECONDS', 2))
+    PROFILING_IDLE_POLL_SECONDS = float(os.getenv('PROFILING_IDLE_POLL_SECONDS', 15))
+    PROFILING_FLUSH_SECONDS = float(os.getenv('PROFILING_FLUSH_SECONDS', 10))
+    PROFILING_MAX_STACKS = int(os.getenv('PROFILING_MAX_STACKS', 20000))  # distinct stacks kept per worker
+
+    # Image analysis accounting and quotas (usage.py, /auth-user/admin/analysis-usage).
+    # Per-call rows are inserted in batches every FLUSH_SECONDS or FLUSH_ROWS rows;
+    # quota counters are re-read from the table every SYNC_SECONDS. Quotas count
+    # upstream calls and tokens per user per UTC day (0 = unlimited).
+    ANALYZE_DAILY_CALL_QUOTA = int(os.getenv('ANALYZE_DAILY_CALL_QUOTA', 0))
+    ANALYZE_DAILY_TOKEN_QUOTA = int(os.getenv('ANALYZE_DAILY_TOKEN_QUOTA', 0))
+    USAGE_FLUSH_SECONDS = float(os.getenv('USAGE_FLUSH_SECONDS', 5))
+    USAGE_FLUSH_ROWS = int(os.getenv('USAGE_FLUSH_ROWS', 500))
+    USAGE_SYNC_SECONDS = float(os.getenv('USAGE_SYNC_SECONDS', 30))
+
+    # Rows fetched per server-side cursor batch on export / inserted per batch on import
+    BULK_EXPORT_BATCH_SIZE = int(os.getenv('BULK_EXPORT_BATCH_SIZE', 5000))
+    BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', 5000))
+
+    # Content-addressed image store for /analyze uploads: `flask images gc`
+    IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'uploads/images')
+    IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+    IMAGE_THUMBNAIL_SIZE = int(os.getenv('IMAGE_THUMBNAIL_SIZE', 256))
+    IMAGE_ANALYSIS_CACHE = os.getenv('IMAGE_ANALYSIS_CACHE', 'true').lower() in ['true', '1', 't']
+    IMAGE_RETENTION_DAYS = int(os.getenv('IMAGE_RETENTION_DAYS', 30))  # for images no food item refers to
+    IMAGE_GC_INTERVAL = int(os.getenv('IMAGE_GC_INTERVAL', 3600))  # seconds; 0 disables the background sweep
+    IMAGE_ORPHAN_GRACE = int(os.getenv('IMAGE_ORPHAN_GRACE', 3600))  # seconds before a file with no row is removed
+
+    # Glycemic load: items further apart than this start a new meal
+    GLYCEMIC_MEAL_GAP_MINUTES = int(os.getenv('GLYCEMIC_MEAL_GAP_MINUTES', 30))
+    GLYCEMIC_MAX_RANGE_DAYS = int(os.getenv('GLYCEMIC_MAX_RANGE_DAYS', 3660))
+
     # Email Configuration
     MAIL_SERVER = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
     MAIL_USE_TLS = os.getenv('MAIL_USE_TLS', 'true').lower() in ['true', '1', 't']
     MAIL_USERNAME = os.getenv('MAIL_USERNAME', 'your_email@example.com')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', 'your_email_password')
+    MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
     RESET_PASSWORD_TOKEN_EXPIRES = timedelta(minutes=int(os.getenv('RESET_PASSWORD_TOKEN_EXPIRES', 30)))
 
     # Google OAuth Configuration
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", None)
     GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", None)
-    GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL")
-    GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL")
+    GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
     GOOGLE_AUTH_BASE_URL = os.getenv("GOOGLE_AUTH_BASE_URL")
     GOOGLE_TOKEN_URL = os.getenv("GOOGLE_TOKEN_URL")
     GOOGLE_USER_INFO_URL = os.getenv("GOOGLE_USER_INFO_URL")
+    # ID tokens are verified locally; discovery/JWKS are cached per Cache-Control (this TTL when absent)
+    GOOGLE_OIDC_DEFAULT_TTL = int(os.getenv("GOOGLE_OIDC_DEFAULT_TTL", 3600))
+    GOOGLE_JWKS_MIN_REFRESH = int(os.getenv("GOOGLE_JWKS_MIN_REFRESH", 60))  # seconds between unknown-kid refreshes
+    GOOGLE_ID_TOKEN_LEEWAY = int(os.getenv("GOOGLE_ID_TOKEN_LEEWAY", 60))
 
     API_KEY = os.getenv("API_KEY")
+    # Override to point the OpenAI client at a proxy or a local stub
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
     BASE_URL = os.getenv("BASE_URL")
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URI', 'sqlite:///:memory:')
+    AUTO_CREATE_TABLES = True
+    ENABLE_MIGRATIONS = False
+    # Minimum bcrypt cost so auth endpoints don't dominate test time
+    BCRYPT_LOG_ROUNDS = 4
+    MAIL_SUPPRESS_SEND = True
+    MAIL_QUEUE_RECOVER_INTERVAL = 0  # no sender thread until a test queues mail
+    # No watcher thread sharing the in-memory database's single connection with requests
+    PROFILING_ENABLED = False
+    RATELIMIT_ENABLED = False
+    API_KEY = os.getenv("API_KEY", "test-api-key")
+
+
+class ProductionConfig(Config):
+    DEBUG = False
+
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
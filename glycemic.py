@@ -0,0 +1,251 @@
+#glycemic.py
+import csv
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from models import FoodItem, FoodType, DailyGlycemicLoad, GlycemicCacheVersion
+
+GI_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'glycemic_index.csv')
+
+# Used when a food's name isn't in the reference table
+FOOD_TYPE_GI = {
+    'fruit': 45, 'grain': 65, 'vegetable': 40, 'legume': 30, 'dairy': 35,
+    'protein': 0, 'snack': 60, 'beverage': 50,
+}
+DEFAULT_GI = 55
+
+_DAY_SECONDS = 86400
+
+
+def meal_level(glycemic_load):
+    if glycemic_load >= 20:
+        return 'high'
+    return 'medium' if glycemic_load > 10 else 'low'
+
+
+def day_level(glycemic_load):
+    if glycemic_load > 120:
+        return 'high'
+    return 'medium' if glycemic_load >= 80 else 'low'
+
+
+@lru_cache(maxsize=None)
+def _reference():
+    with open(GI_TABLE_PATH, newline='') as f:
+        table = {row['name'].strip().lower(): float(row['gi']) for row in csv.DictReader(f)}
+    # Longest names first, so "brown rice" wins over "rice" at the same position
+    names = sorted(table, key=len, reverse=True)
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(n) for n in names) + r')\b')
+    return table, pattern
+
+
+@lru_cache(maxsize=8192)
+def glycemic_index(name, food_type=None):
+    """Reference GI for a logged food: exact name, singular name, a known food within the name, then its type."""
+    table, pattern = _reference()
+    key = ' '.join((name or '').lower().split())
+    for candidate in (key, key[:-1] if key.endswith('s') else None, key[:-2] if key.endswith('es') else None):
+        if candidate and candidate in table:
+            return table[candidate]
+    match = pattern.search(key)
+    if match:
+        return table[match.group(1)]
+    return FOOD_TYPE_GI.get((food_type or '').strip().lower(), DEFAULT_GI)
+
+
+def compute(rows, meal_gap_seconds):
+    """Meals and daily glycemic load for one user's food items.
+
+    `rows` are (id, name, food_type, timestamp, carbs) ordered by timestamp.
+    An item starts a new meal when it comes more than `meal_gap_seconds`
+    after the previous one or on a new (UTC) day, so each day can be
+    computed and cached on its own. Returns {date: day summary}.
+    """
+    if not rows:
+        return {}
+    ids, names, types, timestamps, carbs = zip(*rows)
+    t = np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+    carbs = np.nan_to_num(np.array(carbs, dtype=float))
+    gi = np.fromiter((glycemic_index(n, ft) for n, ft in zip(names, types)), dtype=float, count=len(rows))
+    gl = gi * carbs / 100
+    day = t // _DAY_SECONDS
+
+    starts_meal = np.ones(len(rows), dtype=bool)
+    starts_meal[1:] = (np.diff(t) > meal_gap_seconds) | (np.diff(day) != 0)
+    meal = np.cumsum(starts_meal) - 1
+    starts = np.flatnonzero(starts_meal)
+    ends = np.append(starts[1:], len(rows))
+    meal_gl = np.bincount(meal, weights=gl)
+    meal_carbs = np.bincount(meal, weights=carbs)
+    meal_day = day[starts]
+
+    # Rounded and formatted in bulk; the loop below only assembles dicts
+    item_gl = np.round(gl, 1).tolist()
+    gi, carbs = gi.tolist(), carbs.tolist()
+    meal_start = np.datetime_as_string(t[starts].astype('datetime64[s]')).tolist()
+    meal_end = np.datetime_as_string(t[ends - 1].astype('datetime64[s]')).tolist()
+    meal_levels = [meal_level(x) for x in meal_gl.tolist()]
+    meal_gl, meal_carbs = np.round(meal_gl, 1).tolist(), np.round(meal_carbs, 1).tolist()
+
+    days = {}
+    epoch = datetime(1970, 1, 1).date()
+    for m, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        date = epoch + timedelta(days=int(meal_day[m]))
+        summary = days.get(date)
+        if summary is None:
+            summary = days[date] = {'day': date.isoformat(), 'glycemic_load': 0.0, 'carbs': 0.0, 'meals': []}
+        summary['meals'].append({
+            'start': meal_start[m],
+            'end': meal_end[m],
+            'carbs': meal_carbs[m],
+            'glycemic_load': meal_gl[m],
+            'level': meal_levels[m],
+            'items': [{'id': ids[i], 'name': names[i], 'glycemic_index': gi[i], 'carbs': carbs[i],
+                       'glycemic_load': item_gl[i]} for i in range(start, end)],
+        })
+        summary['glycemic_load'] += meal_gl[m]
+        summary['carbs'] += meal_carbs[m]
+    for summary in days.values():
+        summary['glycemic_load'] = round(summary['glycemic_load'], 1)
+        summary['carbs'] = round(summary['carbs'], 1)
+        summary['level'] = day_level(summary['glycemic_load'])
+    return days
+
+
+def _load_rows(user_id, day_from, day_to):
+    return db.session.query(
+        FoodItem.id, FoodItem.name, FoodType.type, FoodItem.timestamp, FoodItem.carbs,
+    ).join(FoodType, FoodType.id == FoodItem.food_type_id)\
+        .filter(FoodItem.user_id == user_id,
+                FoodItem.timestamp >= datetime.combine(day_from, datetime.min.time()),
+                FoodItem.timestamp < datetime.combine(day_to + timedelta(days=1), datetime.min.time()))\
+        .order_by(FoodItem.timestamp, FoodItem.id).all()
+
+
+def _runs(days):
+    """Consecutive stretches [(first, last), ...] of a sorted list of dates."""
+    runs = []
+    for d in days:
+        if runs and d - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+    return runs
+
+
+def _insert(table):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def daily_glycemic_load(user_id, date_from, date_to):
+    """Day summaries (days with meals only) for [date_from, date_to].
+
+    Completed days come from the daily_glycemic_load cache; only the missing
+    stretches are loaded and computed, then cached. Today and later are always computed
+    fresh, since that is where new items land.
+    """
+    today = datetime.utcnow().date()
+    gap_minutes = current_app.config['GLYCEMIC_MEAL_GAP_MINUTES']
+    # Read before the items: if an invalidation bumps it meanwhile, what we compute isn't cached
+    version = db.session.query(GlycemicCacheVersion.version).filter(GlycemicCacheVersion.user_id == user_id).scalar()
+    # Plain (day, payload) tuples: nothing for the commit below to expire and reload
+    cached = dict(db.session.query(DailyGlycemicLoad.day, DailyGlycemicLoad.payload).filter(
+        DailyGlycemicLoad.user_id == user_id, DailyGlycemicLoad.day.between(date_from, date_to),
+        DailyGlycemicLoad.meal_gap_minutes == gap_minutes).all())
+    wanted = [date_from + timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+    missing = [d for d in wanted if d not in cached]
+
+    computed = {}
+    if missing:
+        rows = []
+        for first, last in _runs(missing):
+            rows.extend(_load_rows(user_id, first, last))
+        computed = compute(rows, gap_minutes * 60)
+        to_cache = [d for d in missing if d < today]
+        if to_cache:
+            now = datetime.utcnow()
+            _store(user_id, version, [{
+                'user_id': user_id, 'day': d,
+                'glycemic_load': computed[d]['glycemic_load'] if d in computed else 0.0,
+                'meal_count': len(computed[d]['meals']) if d in computed else 0,
+                'payload': json.dumps(computed[d]) if d in computed else None,
+                'computed_at': now,
+                'meal_gap_minutes': gap_minutes,
+            } for d in to_cache])
+
+    days = []
+    for d in wanted:
+        if d in cached:
+            if cached[d] is not None:
+                days.append(json.loads(cached[d]))
+        elif d in computed:
+            days.append(computed[d])
+    return days
+
+
+def _store(user_id, version, rows):
+    """Cache computed days, unless the user's items changed since `version` was read."""
+    versions = GlycemicCacheVersion.__table__
+    if version is None:
+        db.session.execute(_insert(versions).on_conflict_do_nothing(), {'user_id': user_id, 'version': 0})
+        version = 0
+    # Row-locks the version until commit, so an invalidation either happened before (and
+    # this matches nothing) or waits and then deletes the rows written here
+    claimed = db.session.execute(db.update(versions).values(version=versions.c.version)
+                                 .where(versions.c.user_id == user_id, versions.c.version == version)).rowcount
+    if not claimed:
+        db.session.rollback()
+        return
+    insert = _insert(DailyGlycemicLoad.__table__)
+    # Overwrites rows computed with another meal gap
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=['user_id', 'day'],
+        set_={c: insert.excluded[c] for c in ('glycemic_load', 'meal_count', 'payload', 'computed_at',
+                                               'meal_gap_minutes')}), rows)
+    db.session.commit()
+
+
+def _bump(user_ids):
+    # Sorted, so concurrent invalidations lock the version rows in the same order
+    versions = GlycemicCacheVersion.__table__
+    insert = _insert(versions)
+    db.session.execute(insert.on_conflict_do_update(index_elements=['user_id'],
+                                                    set_={'version': versions.c.version + 1}),
+                       [{'user_id': user_id, 'version': 1} for user_id in sorted(user_ids)])
+
+
+def invalidate(entries):
+    """Drop cached days touched by added or removed items (dicts with user_id and timestamp)."""
+    per_user = defaultdict(set)
+    for e in entries:
+        per_user[e['user_id']].add(e['timestamp'].date())
+    if not per_user:
+        return
+    _bump(per_user)
+    for user_id, days in per_user.items():
+        DailyGlycemicLoad.query.filter(DailyGlycemicLoad.user_id == user_id, DailyGlycemicLoad.day.in_(days))\
+            .delete(synchronize_session=False)
+
+
+def invalidate_user(user_id):
+    """Drop every cached day of one user (e.g. after their items moved shard)."""
+    _bump([user_id])
+    DailyGlycemicLoad.query.filter(DailyGlycemicLoad.user_id == user_id).delete(synchronize_session=False)
+
+
+def reset():
+    db.session.query(GlycemicCacheVersion).update({GlycemicCacheVersion.version: GlycemicCacheVersion.version + 1},
+                                                  synchronize_session=False)
+    db.session.query(DailyGlycemicLoad).delete()
@@ -0,0 +1,149 @@
+#google_oidc.py
+import threading
+import time
+
+import jwt
+import requests
+from flask import current_app
+
+DEFAULT_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+
+
+def cache_lifetime(response, default):
+    """Seconds `response` may be reused for, from Cache-Control max-age less Age."""
+    max_age = None
+    for directive in response.headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name in ('no-store', 'no-cache'):
+            return 0
+        if name == 'max-age':
+            try:
+                max_age = int(value.strip('"'))
+            except ValueError:
+                pass
+    if max_age is None:
+        return default
+    try:
+        age = int(response.headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return max(max_age - age, 0)
+
+
+class GoogleOIDC:
+    """Verifies Google ID tokens locally.
+
+    The discovery document and the JWKS it points to are fetched once and
+    kept in process for as long as their Cache-Control headers allow. A
+    token signed with a key id that is not in the cached set triggers one
+    JWKS refresh, which picks up Google's key rotation without a fetch per
+    login; such forced refreshes happen at most every GOOGLE_JWKS_MIN_REFRESH
+    seconds so tokens with made-up key ids cannot hammer Google.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._http = None
+        self._discovery = (None, 0.0)  # (document, expires_at)
+        self._keys = ({}, 0.0)  # ({kid: PyJWK}, expires_at)
+        self._forced_refresh_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GOOGLE_DISCOVERY_URL', DEFAULT_DISCOVERY_URL)
+        app.config.setdefault('GOOGLE_OIDC_DEFAULT_TTL', 3600)
+        app.config.setdefault('GOOGLE_JWKS_MIN_REFRESH', 60)
+        app.config.setdefault('GOOGLE_ID_TOKEN_LEEWAY', 60)
+        app.config.setdefault('GOOGLE_HTTP_TIMEOUT', 10.0)
+        app.extensions['google_oidc'] = self
+
+    def _get(self, url, config):
+        if self._http is None:
+            # Created on first use so gunicorn workers don't share a preloaded connection pool
+            self._http = requests.Session()
+        response = self._http.get(url, timeout=config['GOOGLE_HTTP_TIMEOUT'])
+        response.raise_for_status()
+        return response.json(), time.monotonic() + cache_lifetime(response, config['GOOGLE_OIDC_DEFAULT_TTL'])
+
+    def discovery(self):
+        """The provider's OpenID configuration, from cache when still fresh."""
+        document, expires_at = self._discovery
+        if document is not None and time.monotonic() < expires_at:
+            return document
+        config = current_app.config
+        with self._lock:
+            document, expires_at = self._discovery
+            if document is None or time.monotonic() >= expires_at:
+                self._discovery = self._get(config['GOOGLE_DISCOVERY_URL'] or DEFAULT_DISCOVERY_URL, config)
+            return self._discovery[0]
+
+    def _refresh_keys(self, jwks_uri, config):
+        jwks, expires_at = self._get(jwks_uri, config)
+        keys = {}
+        for data in jwks.get('keys', []):
+            try:
+                key = jwt.PyJWK(data)
+            except jwt.PyJWTError:
+                continue  # unsupported key type or algorithm; Google may publish others
+            keys[data.get('kid')] = key
+        self._keys = (keys, expires_at)
+
+    def signing_key(self, kid):
+        """The public key for `kid`, refreshing the cached JWKS when it is stale or lacks the kid."""
+        keys, expires_at = self._keys
+        now = time.monotonic()
+        if kid in keys and now < expires_at:
+            return keys[kid]
+        config = current_app.config
+        jwks_uri = self.discovery()['jwks_uri']
+        with self._lock:
+            keys, expires_at = self._keys
+            now = time.monotonic()
+            stale = now >= expires_at
+            forced = self._forced_refresh_at
+            unknown = kid not in keys and (forced is None or now - forced >= config['GOOGLE_JWKS_MIN_REFRESH'])
+            if stale or unknown:
+                if not stale:
+                    self._forced_refresh_at = now
+                self._refresh_keys(jwks_uri, config)
+                keys = self._keys[0]
+        if kid not in keys:
+            raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+        return keys[kid]
+
+    def verify(self, id_token):
+        """Check an ID token's signature, issuer, audience and expiry; returns its claims.
+
+        Raises jwt.InvalidTokenError for a bad token and requests.RequestException
+        when the discovery document or JWKS cannot be fetched.
+        """
+        config = current_app.config
+        header = jwt.get_unverified_header(id_token)
+        key = self.signing_key(header.get('kid'))
+        issuer = self.discovery()['issuer']
+        # Google documents both forms of its issuer
+        issuers = [issuer, issuer.removeprefix('https://')]
+        claims = jwt.decode(
+            id_token,
+            key=key,
+            algorithms=[key.algorithm_name or 'RS256'],
+            audience=config['GOOGLE_CLIENT_ID'],
+            issuer=issuers,
+            leeway=config['GOOGLE_ID_TOKEN_LEEWAY'],
+            options={'require': ['exp', 'iat', 'iss', 'aud', 'sub']},
+        )
+        if claims.get('email') and claims.get('email_verified') is False:
+            raise jwt.InvalidTokenError("Email address is not verified")
+        return claims
+
+    def clear(self):
+        """Drop the cached discovery document and keys."""
+        with self._lock:
+            self._discovery = (None, 0.0)
+            self._keys = ({}, 0.0)
+            self._forced_refresh_at = None
+
+
+google_oidc = GoogleOIDC()
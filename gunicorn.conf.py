@@ -0,0 +1,87 @@
+# gunicorn.conf.py
+# Usage: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every setting can be overridden from the environment, e.g.
+#   GUNICORN_WORKER_CLASS=gevent GUNICORN_WORKERS=4 gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+import time
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ['true', '1', 't', 'yes']
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# sync:    one request per process; simplest, but /image-information/analyze
+#          holds a whole worker while waiting on the upstream model.
+# gthread: a thread pool per process; good default for this mostly I/O-bound API.
+# gevent:  greenlets; best when many analyze calls are in flight at once
+#          (optional: `pip install gevent`, it is not in requirements.txt).
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Preloading shares the imported app between workers (copy-on-write) and
+# speeds up restarts. gevent must monkey-patch before the app is imported,
+# so it is off by default for that worker class.
+preload_app = _env_bool('GUNICORN_PRELOAD', worker_class != 'gevent')
+
+# Recycle workers periodically to bound memory growth; jitter avoids all
+# workers restarting at the same moment.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Image analysis can take tens of seconds upstream.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Connections opened in the master (preload) must not be shared by workers,
+    # on any engine: the primary and every shard bind
+    from app import db
+    from wsgi import app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # One graceful_timeout for all of the draining below, not one each
+    deadline = time.monotonic() + graceful_timeout
+
+    def left():
+        return max(0.0, deadline - time.monotonic())
+
+    # Give image analysis jobs that are still waiting on the upstream model
+    # a chance to finish before the process goes away.
+    from lifecycle import analysis_jobs
+    if analysis_jobs.count:
+        server.log.info("Draining %s in-flight analysis job(s)", analysis_jobs.count)
+        remaining = analysis_jobs.drain(left())
+        if remaining:
+            server.log.warning("Worker exiting with %s analysis job(s) unfinished", remaining)
+
+    # Write this worker's buffered image analysis usage rows (quick: one INSERT)
+    from usage import usage
+    from wsgi import app
+    with app.app_context():
+        remaining = usage.drain(left())
+    if remaining:
+        server.log.warning("Worker exiting with %s usage row(s) unwritten", remaining)
+
+    # Flush queued emails; anything left stays 'queued' in email_outbox for another worker
+    from mailer import email_queue
+    remaining = email_queue.drain(left())
+    if remaining:
+        server.log.warning("Worker exiting with %s email(s) unsent", remaining)
@@ -0,0 +1,331 @@
+#images.py
+import hashlib
+import io
+import itertools
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: pip install pillow (needed for thumbnails)
+    Image = None
+
+from app import db
+from models import StoredImage, UserImage, FoodItemImage
+from sharding import shards
+
+IMAGE_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# The only types stored and served back; anything else is refused at upload
+IMAGE_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+_SIGNATURES = ((b'\xff\xd8\xff', 'JPEG'), (b'\x89PNG\r\n\x1a\n', 'PNG'), (b'GIF87a', 'GIF'), (b'GIF89a', 'GIF'))
+
+# last_used_at is only rewritten when older than this, so repeat uploads of
+# a popular image don't turn into a row update per request
+_TOUCH_INTERVAL = timedelta(hours=1)
+
+_TMP_PREFIX = '.tmp-'
+
+
+def _insert(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def sniff_image_type(data):
+    """The mimetype of `data` judged by its content (Pillow, else magic bytes), or None if it's not an allowed image.
+
+    The client's declared type is never trusted: stored images are served
+    back with this type.
+    """
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return IMAGE_TYPES.get(img.format)
+        except Exception:
+            return None
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return IMAGE_TYPES['WEBP']
+    for signature, kind in _SIGNATURES:
+        if data.startswith(signature):
+            return IMAGE_TYPES[kind]
+    return None
+
+
+def make_thumbnail(data, size):
+    """A JPEG no larger than size x size, or None without Pillow or for undecodable data."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEGs are decoded straight at a reduced scale, which is most of the saving
+            img.draft('RGB', (size, size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            out = io.BytesIO()
+            img.save(out, 'JPEG', quality=80, optimize=True)
+            return out.getvalue()
+    except Exception:
+        return None
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ImageStore:
+    """Content-addressed store for uploaded food images.
+
+    Files are named by their SHA-256 under IMAGE_STORE_DIR, sharded two
+    levels deep (ab/cd/abcd...), so identical uploads from any user share one
+    file and one stored_image row; only the first upload of an image writes
+    to disk or creates a thumbnail. The model's analysis is cached on the
+    row. A background sweep (also `flask images gc`) drops links to deleted
+    food items and removes images nobody has used for IMAGE_RETENTION_DAYS
+    that no food item refers to.
+
+    Files are written before the upload's transaction commits, so a rolled
+    back upload leaves a file without a row. The sweep removes such files
+    once they are IMAGE_ORPHAN_GRACE seconds old; store() refreshes the
+    mtime of a file it reuses so one about to be committed is never taken.
+    """
+
+    def __init__(self, app=None):
+        self._gc_thread = None
+        self._gc_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_STORE_DIR', 'uploads/images')
+        app.config.setdefault('IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('IMAGE_THUMBNAIL_SIZE', 256)
+        app.config.setdefault('IMAGE_ANALYSIS_CACHE', True)
+        app.config.setdefault('IMAGE_RETENTION_DAYS', 30)
+        app.config.setdefault('IMAGE_GC_INTERVAL', 3600)
+        app.config.setdefault('IMAGE_ORPHAN_GRACE', 3600)
+        app.extensions['image_store'] = self
+
+    def path(self, image_id, thumbnail=False):
+        root = current_app.config['IMAGE_STORE_DIR']
+        if thumbnail:
+            return os.path.join(root, 'thumbs', image_id[:2], image_id[2:4], f"{image_id}.jpg")
+        return os.path.join(root, image_id[:2], image_id[2:4], image_id)
+
+    def store(self, data, user_id, content_type):
+        """Save an upload (deduplicated) and record that `user_id` sent it. Returns its StoredImage.
+
+        `content_type` must come from sniff_image_type(), not from the client.
+        """
+        config = current_app.config
+        image_id = hashlib.sha256(data).hexdigest()
+        now = datetime.utcnow()
+        path = self.path(image_id)
+
+        image = db.session.get(StoredImage, image_id)
+        if image is None:
+            try:
+                # Possibly left by a rolled back upload; fresh again until this one commits
+                os.utime(path)
+            except FileNotFoundError:
+                _write_atomic(path, data)
+            thumbnail = make_thumbnail(data, config['IMAGE_THUMBNAIL_SIZE'])
+            if thumbnail is not None:
+                _write_atomic(self.path(image_id, thumbnail=True), thumbnail)
+            db.session.execute(_insert(StoredImage.__table__).on_conflict_do_nothing(), {
+                'sha256': image_id, 'size_bytes': len(data), 'content_type': content_type,
+                'has_thumbnail': thumbnail is not None, 'created_at': now, 'last_used_at': now,
+            })
+            image = db.session.get(StoredImage, image_id)
+        else:
+            if now - image.last_used_at > _TOUCH_INTERVAL:
+                image.last_used_at = now
+            if not os.path.exists(path):
+                # Swept from disk while the row was being reused; put it back
+                _write_atomic(path, data)
+
+        if db.session.get(UserImage, (user_id, image_id)) is None:
+            db.session.execute(_insert(UserImage.__table__).on_conflict_do_nothing(),
+                               {'user_id': user_id, 'image_sha256': image_id, 'uploaded_at': now})
+        self.start_gc()
+        return image
+
+    def save_analysis(self, image_id, analysis):
+        db.session.query(StoredImage).filter_by(sha256=image_id).update({'analysis': analysis})
+
+    def is_visible_to(self, image_id, user):
+        """Whether `user` uploaded the image (admins see every image)."""
+        if not IMAGE_ID_RE.match(image_id or ''):
+            return False
+        if user.is_super_user():
+            return db.session.get(StoredImage, image_id) is not None
+        return db.session.get(UserImage, (user.id, image_id)) is not None
+
+    def link(self, image_id, food_item_ids):
+        """Record that the food items were logged from this image, in the caller's transaction."""
+        if food_item_ids:
+            db.session.execute(db.insert(FoodItemImage.__table__),
+                               [{'food_item_id': i, 'image_sha256': image_id} for i in food_item_ids])
+
+    def image_ids_for(self, food_item_ids):
+        """{food_item_id: image_id} for the given items, in one query."""
+        if not food_item_ids:
+            return {}
+        return dict(db.session.query(FoodItemImage.food_item_id, FoodItemImage.image_sha256)
+                    .filter(FoodItemImage.food_item_id.in_(food_item_ids)).all())
+
+    def _old_files(self, grace):
+        """(image id, path) for stored files and thumbnails older than `grace` seconds.
+
+        Temporary files of interrupted writes come with an image id of None.
+        """
+        cutoff = time.time() - grace
+        for directory, _, names in os.walk(current_app.config['IMAGE_STORE_DIR']):
+            for name in names:
+                image_id = name.removesuffix('.jpg')
+                if not (name.startswith(_TMP_PREFIX) or IMAGE_ID_RE.match(image_id)):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield (None if name.startswith(_TMP_PREFIX) else image_id), path
+
+    def sweep_files(self, grace, batch_size=500):
+        """Delete files older than `grace` seconds that no stored_image row refers to. Returns the count."""
+        removed = 0
+        files = self._old_files(grace)
+        while True:
+            batch = list(itertools.islice(files, batch_size))
+            if not batch:
+                return removed
+            ids = {image_id for image_id, _ in batch if image_id}
+            known = set(db.session.scalars(db.select(StoredImage.sha256).where(StoredImage.sha256.in_(ids))))
+            db.session.commit()
+            for image_id, path in batch:
+                if image_id not in known:
+                    try:
+                        os.unlink(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+
+    def sweep(self, retention_days, batch_size=500):
+        """Drop dangling links, images unused for `retention_days` with no food item, and orphaned files.
+
+        Returns counts.
+        """
+        links = 0
+        for key in shards.keys():
+            links += shards.connection(key).execute(db.text(
+                "DELETE FROM food_item_image "
+                "WHERE NOT EXISTS (SELECT 1 FROM food_item f WHERE f.id = food_item_image.food_item_id)"
+            )).rowcount
+        db.session.commit()
+
+        removed = 0
+        if retention_days:
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            unused = db.and_(
+                StoredImage.last_used_at < cutoff,
+                ~db.exists().where(FoodItemImage.image_sha256 == StoredImage.sha256),
+            )
+            last = ''
+            while True:
+                candidates = [row[0] for row in db.session.query(StoredImage.sha256)
+                              .filter(unused, StoredImage.sha256 > last)
+                              .order_by(StoredImage.sha256).limit(batch_size)]
+                if not candidates:
+                    break
+                last = candidates[-1]
+                if shards.enabled:
+                    # `unused` only sees links on the primary; skip images linked on a shard
+                    linked = set()
+                    for _, found in shards.scatter(lambda connection: connection.execute(
+                            db.select(FoodItemImage.image_sha256).where(FoodItemImage.image_sha256.in_(candidates))
+                    ).scalars().all(), keys=shards.binds):
+                        linked.update(found)
+                    candidates = [c for c in candidates if c not in linked]
+                # Re-checked in the DELETE so an image reused meanwhile survives
+                deleted = db.session.execute(
+                    db.delete(StoredImage).where(StoredImage.sha256.in_(candidates), unused)
+                    .returning(StoredImage.sha256)
+                ).scalars().all()
+                # Postgres cascades this; SQLite doesn't enforce foreign keys
+                db.session.query(UserImage).filter(UserImage.image_sha256.in_(deleted))\
+                    .delete(synchronize_session=False)
+                db.session.commit()
+                for image_id in deleted:
+                    for path in (self.path(image_id), self.path(image_id, thumbnail=True)):
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+                removed += len(deleted)
+        files = self.sweep_files(current_app.config['IMAGE_ORPHAN_GRACE'], batch_size)
+        return {'links_removed': links, 'images_removed': removed, 'files_removed': files}
+
+    def start_gc(self):
+        """Start this process's background sweep thread, once (no-op if IMAGE_GC_INTERVAL is 0)."""
+        app = current_app._get_current_object()
+        if not app.config['IMAGE_GC_INTERVAL'] or (self._gc_thread is not None and self._gc_thread.is_alive()):
+            return
+        with self._gc_lock:
+            if self._gc_thread is None or not self._gc_thread.is_alive():
+                self._gc_thread = threading.Thread(target=self._gc_loop, args=(app,), name='image-gc', daemon=True)
+                self._gc_thread.start()
+
+    def _gc_loop(self, app):
+        interval = app.config['IMAGE_GC_INTERVAL']
+        while True:
+            # Jittered so the workers of one deployment don't all sweep at once
+            time.sleep(interval * random.uniform(0.8, 1.2))
+            with app.app_context():
+                try:
+                    self.sweep(app.config['IMAGE_RETENTION_DAYS'])
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Image store sweep failed")
+                finally:
+                    db.session.remove()
+
+
+image_store = ImageStore()
+
+images_cli = AppGroup('images', help='Maintain the content-addressed image store.')
+
+
+@images_cli.command('gc')
+@click.option('--retention-days', type=int, default=None, help='Defaults to IMAGE_RETENTION_DAYS.')
+def gc_command(retention_days):
+    """Remove dangling image links and images past retention."""
+    if retention_days is None:
+        retention_days = current_app.config['IMAGE_RETENTION_DAYS']
+    result = image_store.sweep(retention_days)
+    click.echo(f"Removed {result['links_removed']} dangling link(s), {result['images_removed']} image(s) "
+               f"and {result['files_removed']} orphaned file(s).")
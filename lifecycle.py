@@ -0,0 +1,46 @@
+#lifecycle.py
+import threading
+import time
+from contextlib import contextmanager
+
+
+class InFlightTracker:
+    """Counts jobs currently running so a worker can wait for them on shutdown."""
+
+    def __init__(self):
+        self._count = 0
+        self._cond = threading.Condition()
+
+    @property
+    def count(self):
+        return self._count
+
+    @contextmanager
+    def track(self):
+        with self._cond:
+            self._count += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._count -= 1
+                if self._count == 0:
+                    self._cond.notify_all()
+
+    def drain(self, timeout):
+        """Block until no jobs are running or `timeout` seconds pass.
+
+        Returns the number of jobs still running (0 when fully drained).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._count
+
+
+# Image analysis requests waiting on the upstream model
+analysis_jobs = InFlightTracker()
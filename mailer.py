@@ -0,0 +1,246 @@
+#mailer.py
+import heapq
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+
+from app import db
+from models import EmailOutbox
+
+
+class EmailQueue:
+    """Outbound email queue with a background sender.
+
+    Requests call `send()`, which records the message in the email_outbox
+    table and returns immediately. A sender thread per process picks
+    messages up in batches, delivers them over one SMTP connection that is
+    kept open between batches, retries failures with exponential backoff and
+    writes the delivery status back to the outbox row.
+
+    The outbox is the source of truth. A worker owns a queued row until its
+    `next_attempt_at`, which `send()` and each retry push MAIL_QUEUE_LEASE
+    seconds past the attempt it plans. Every MAIL_QUEUE_RECOVER_INTERVAL
+    seconds, starting with the worker's first request, the sender claims
+    queued rows whose time has passed. These are messages left over by a
+    restart, a crash or a drain timeout, and each is claimed by one worker
+    with a single conditional UPDATE.
+    """
+
+    def __init__(self, app=None):
+        self._queue = queue.Queue()
+        self._retries = []  # heap of (ready_at, outbox_id)
+        self._pending = 0
+        self._next_recover = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._smtp = None
+        self._smtp_last_used = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_QUEUE_RETRY_BACKOFF', 2.0)
+        app.config.setdefault('MAIL_QUEUE_IDLE_TIMEOUT', 30.0)
+        app.config.setdefault('MAIL_QUEUE_LEASE', 300.0)
+        app.config.setdefault('MAIL_QUEUE_RECOVER_INTERVAL', 60.0)
+        app.config.setdefault('MAIL_TIMEOUT', 10.0)
+        app.extensions['email_queue'] = self
+        if app.config['MAIL_QUEUE_RECOVER_INTERVAL']:
+            # Start the sender with the worker rather than with its first email, to pick up leftovers
+            app.before_request(lambda: self._ensure_worker(current_app._get_current_object()))
+
+    def send(self, subject, recipients, body, sender=None):
+        """Record a message and hand it to the sender thread. Returns the outbox row."""
+        app = current_app._get_current_object()
+        row = EmailOutbox(
+            sender=sender or app.config.get('MAIL_DEFAULT_SENDER'),
+            recipients=", ".join(recipients),
+            subject=subject,
+            body=body,
+            status="queued",
+            attempts=0,
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=app.config['MAIL_QUEUE_LEASE']),
+        )
+        db.session.add(row)
+        db.session.commit()
+
+        with self._cond:
+            self._pending += 1
+        self._ensure_worker(app)
+        self._queue.put(row.id)
+        return row
+
+    def drain(self, timeout):
+        """Wait until every queued message is sent or has failed for good.
+
+        Returns the number of messages still pending.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._pending
+
+    def _ensure_worker(self, app):
+        # Started lazily so each gunicorn worker gets its own sender thread after fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, args=(app,), name='email-queue', daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        while True:
+            if app.config['MAIL_QUEUE_RECOVER_INTERVAL'] and time.monotonic() >= self._next_recover:
+                self._next_recover = time.monotonic() + app.config['MAIL_QUEUE_RECOVER_INTERVAL']
+                with app.app_context():
+                    try:
+                        self.recover()
+                    except Exception:
+                        app.logger.exception("Email outbox recovery failed")
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+            batch = self._next_batch(app.config)
+            if not batch:
+                continue
+            with app.app_context():
+                try:
+                    self._send_batch(app, batch)
+                except Exception:
+                    app.logger.exception("Email batch failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def recover(self, limit=1000):
+        """Claim queued outbox rows nobody is working on and queue them here. Returns how many."""
+        config = current_app.config
+        now = datetime.utcnow()
+        due = db.and_(EmailOutbox.status == "queued",
+                      db.or_(EmailOutbox.next_attempt_at.is_(None), EmailOutbox.next_attempt_at <= now))
+        candidates = db.select(EmailOutbox.id).where(due).order_by(EmailOutbox.id).limit(limit)
+        # The condition is re-checked per row, so a row is claimed by one worker only
+        ids = db.session.execute(
+            db.update(EmailOutbox)
+            .where(EmailOutbox.id.in_(candidates.scalar_subquery()), due)
+            .values(next_attempt_at=now + timedelta(seconds=config['MAIL_QUEUE_LEASE']))
+            .returning(EmailOutbox.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.session.commit()
+        if ids:
+            with self._cond:
+                self._pending += len(ids)
+            self._ensure_worker(current_app._get_current_object())
+            for outbox_id in ids:
+                self._queue.put(outbox_id)
+        return len(ids)
+
+    def _next_batch(self, config):
+        """Block until messages (new or due for retry) are available and collect a batch."""
+        batch_size = config['MAIL_QUEUE_BATCH_SIZE']
+        timeout = config['MAIL_QUEUE_IDLE_TIMEOUT']
+        if self._retries:
+            timeout = min(timeout, max(0.0, self._retries[0][0] - time.monotonic()))
+        if config['MAIL_QUEUE_RECOVER_INTERVAL']:
+            timeout = min(timeout, max(0.0, self._next_recover - time.monotonic()))
+
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now and len(batch) < batch_size:
+            batch.append(heapq.heappop(self._retries)[1])
+        while len(batch) < batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if not batch and time.monotonic() - self._smtp_last_used >= config['MAIL_QUEUE_IDLE_TIMEOUT']:
+            self._close()
+        return batch
+
+    def _send_batch(self, app, ids):
+        config = app.config
+        # Everything in the batch leaves this process's queue except what is rescheduled below. If the
+        # batch fails midway, the rows keep their lease and recover() picks them up once it runs out.
+        rescheduled = 0
+        try:
+            rows = EmailOutbox.query.filter(EmailOutbox.id.in_(ids), EmailOutbox.status == "queued").all()
+            for row in rows:
+                row.attempts += 1
+                try:
+                    self._deliver(config, row)
+                    row.status = "suppressed" if config.get('MAIL_SUPPRESS_SEND') else "sent"
+                    row.sent_at = datetime.utcnow()
+                    row.last_error = None
+                except (smtplib.SMTPException, OSError) as e:
+                    self._close()
+                    row.last_error = str(e)[:500]
+                    if row.attempts >= config['MAIL_QUEUE_MAX_ATTEMPTS']:
+                        row.status = "failed"
+                        app.logger.error("Giving up on email %s after %s attempts: %s", row.id, row.attempts, e)
+                    else:
+                        delay = config['MAIL_QUEUE_RETRY_BACKOFF'] * 2 ** (row.attempts - 1)
+                        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay + config['MAIL_QUEUE_LEASE'])
+                        heapq.heappush(self._retries, (time.monotonic() + delay, row.id))
+                        rescheduled += 1
+            db.session.commit()
+        finally:
+            with self._cond:
+                self._pending -= len(ids) - rescheduled
+                self._cond.notify_all()
+
+    def _deliver(self, config, row):
+        if config.get('MAIL_SUPPRESS_SEND'):
+            return
+        msg = Message(row.subject, sender=row.sender, recipients=row.recipients.split(", "), body=row.body)
+        reused = self._smtp is not None
+        try:
+            self._connection(config).sendmail(msg.sender, msg.send_to, msg.as_bytes())
+        except smtplib.SMTPServerDisconnected:
+            if not reused:
+                raise
+            # The server dropped the kept-alive connection; reconnect once
+            self._close()
+            self._connection(config).sendmail(msg.sender, msg.send_to, msg.as_bytes())
+        self._smtp_last_used = time.monotonic()
+
+    def _connection(self, config):
+        if self._smtp is not None:
+            return self._smtp
+
+        if config.get('MAIL_USE_SSL'):
+            smtp = smtplib.SMTP_SSL(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+        else:
+            smtp = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+        if config.get('MAIL_USE_TLS'):
+            smtp.starttls()
+        if config.get('MAIL_USERNAME') and config.get('MAIL_PASSWORD'):
+            smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        self._smtp = smtp
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+email_queue = EmailQueue()
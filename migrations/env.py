@@ -4,6 +4,7 @@ from logging.config import fileConfig
 from flask import current_app
 
 from alembic import context
+from sqlalchemy import text
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -65,9 +66,14 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        transaction_per_migration=True
     )
 
+    lock_timeout = current_app.config.get('MIGRATION_LOCK_TIMEOUT')
+    if lock_timeout and url.startswith('postgresql'):
+        context.execute(f"SET lock_timeout = '{lock_timeout}'")
+
     with context.begin_transaction():
         context.run_migrations()
 
@@ -97,9 +103,19 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # Online mode for large tables: DDL that can't get its lock within
+        # MIGRATION_LOCK_TIMEOUT fails instead of queueing every query behind
+        # it, and each migration commits on its own so a re-run resumes where
+        # it stopped (and online_migrations can step outside the transaction).
+        lock_timeout = current_app.config.get('MIGRATION_LOCK_TIMEOUT')
+        if lock_timeout and connection.dialect.name == 'postgresql':
+            connection.execute(text("SELECT set_config('lock_timeout', :value, false)"), {'value': lock_timeout})
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
+            transaction_per_migration=True,
             **conf_args
         )
 
@@ -0,0 +1,32 @@
+"""Add users.shard, the user -> database map for sharding
+
+Revision ID: 7c2d4e8a1f36
+Revises: 9b1f3e6a2d47
+Create Date: 2026-10-19 19:02:11.480215
+
+NULL means the primary database, so existing users keep their data where
+it is; `flask shards move-user` moves them. The index serves placement of
+new users (fewest users per shard).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import add_column, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d4e8a1f36'
+down_revision = '9b1f3e6a2d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column('users', sa.Column('shard', sa.String(length=50), nullable=True))
+    create_index_concurrently('idx_users_shard', 'users', ['shard'])
+
+
+def downgrade():
+    drop_index_concurrently('idx_users_shard', 'users')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('shard')
@@ -0,0 +1,30 @@
+"""Add indexes for the food item listing queries, built concurrently
+
+Revision ID: 9b1f3e6a2d47
+Revises: 5e8d2b7f1c09
+Create Date: 2026-10-19 17:21:40.118263
+
+idx_food_user_timestamp serves "a user's items by time" (the food item
+list, exports, glycemic load) without a sort; idx_nutrition_food_item_id
+serves the nutrition lookups for those items. Both are built without
+blocking writes on Postgres (see online_migrations), one partition at a
+time for food_item.
+"""
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1f3e6a2d47'
+down_revision = '5e8d2b7f1c09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index_concurrently('idx_food_user_timestamp', 'food_item', ['user_id', 'timestamp'])
+    create_index_concurrently('idx_nutrition_food_item_id', 'nutritional_information', ['food_item_id'])
+
+
+def downgrade():
+    drop_index_concurrently('idx_nutrition_food_item_id', 'nutritional_information')
+    drop_index_concurrently('idx_food_user_timestamp', 'food_item')
@@ -0,0 +1,31 @@
+"""Add id_allocator for food_item ids shared by all shards
+
+Revision ID: b7e2d9c4f158
+Revises: d8b3f6a1c472
+Create Date: 2026-10-21 09:41:05.662913
+
+Only used when sharded on SQLite; Postgres hands out ids from the
+primary's food_item_id_seq. Run `flask shards init` afterwards to move the
+allocator past the ids already used on the shards.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d9c4f158'
+down_revision = 'd8b3f6a1c472'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('id_allocator',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('next_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('id_allocator')
@@ -0,0 +1,32 @@
+"""Add email_outbox.next_attempt_at for recovering queued emails
+
+Revision ID: c5e1f7a3d920
+Revises: a6d4e8b2f913
+Create Date: 2026-10-20 10:26:31.905174
+
+Queued rows are claimed by the worker that owns them until next_attempt_at;
+after that any worker's sender may pick them up. Existing rows get NULL,
+meaning they are due now.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import add_column, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f7a3d920'
+down_revision = 'a6d4e8b2f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column('email_outbox', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    create_index_concurrently('idx_email_outbox_status_next_attempt', 'email_outbox', ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    drop_index_concurrently('idx_email_outbox_status_next_attempt', 'email_outbox')
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_column('next_attempt_at')
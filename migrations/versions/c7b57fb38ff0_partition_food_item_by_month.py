@@ -0,0 +1,138 @@
+"""Partition food_item by month and add food_item_archive
+
+Revision ID: c7b57fb38ff0
+Revises: c5058929a825
+Create Date: 2026-10-19 11:02:17.406932
+
+On Postgres food_item becomes a table range-partitioned on `timestamp`
+with one partition per month (plus a default partition). Postgres requires
+the partition key in the primary key, so the key becomes (id, timestamp)
+and the nutritional_information -> food_item foreign key is dropped; the
+application deletes nutrition rows together with their food items.
+
+Other databases (SQLite test runs) keep a plain table.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7b57fb38ff0'
+down_revision = 'c5058929a825'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def upgrade():
+    op.create_table('food_item_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('food_type', sa.String(length=50), nullable=True),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('volume', sa.Float(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('date_uploaded', sa.DateTime(), nullable=True),
+    sa.Column('calories', sa.Float(), nullable=True),
+    sa.Column('carbs', sa.Float(), nullable=True),
+    sa.Column('fat', sa.Float(), nullable=True),
+    sa.Column('protein', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('food_item_archive', schema=None) as batch_op:
+        batch_op.create_index('idx_food_archive_user_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    op.execute("UPDATE food_item SET timestamp = COALESCE(date_uploaded, CURRENT_TIMESTAMP) WHERE timestamp IS NULL")
+
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('food_item', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+        return
+
+    op.drop_constraint('nutritional_information_food_item_id_fkey', 'nutritional_information', type_='foreignkey')
+    op.execute("ALTER TABLE food_item RENAME TO food_item_unpartitioned")
+    op.execute("ALTER TABLE food_item_unpartitioned RENAME CONSTRAINT food_item_pkey TO food_item_unpartitioned_pkey")
+    op.execute("DROP INDEX idx_food_timestamp")
+    op.execute("DROP INDEX idx_food_user_id")
+    op.execute("DROP INDEX idx_food_type_id")
+    op.execute("ALTER SEQUENCE food_item_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE food_item (
+            id INTEGER NOT NULL DEFAULT nextval('food_item_id_seq'),
+            name VARCHAR(100) NOT NULL,
+            volume FLOAT,
+            food_type_id INTEGER NOT NULL REFERENCES food_type (id),
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            date_uploaded TIMESTAMP WITHOUT TIME ZONE,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    op.execute("ALTER SEQUENCE food_item_id_seq OWNED BY food_item.id")
+    op.execute("CREATE INDEX idx_food_timestamp ON food_item (timestamp)")
+    op.execute("CREATE INDEX idx_food_user_id ON food_item (user_id)")
+    op.execute("CREATE INDEX idx_food_type_id ON food_item (food_type_id)")
+    op.execute("CREATE TABLE food_item_default PARTITION OF food_item DEFAULT")
+
+    # One partition per month from the oldest row up to MONTHS_AHEAD months from now
+    op.execute(f"""
+        DO $$
+        DECLARE
+            m DATE := date_trunc('month', COALESCE((SELECT min(timestamp) FROM food_item_unpartitioned), now()));
+            last_month DATE := date_trunc('month', now()) + interval '{MONTHS_AHEAD} months';
+        BEGIN
+            WHILE m <= last_month LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF food_item FOR VALUES FROM (%L) TO (%L)',
+                               'food_item_p' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date);
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+
+    op.execute("""
+        INSERT INTO food_item (id, name, volume, food_type_id, timestamp, date_uploaded, user_id)
+        SELECT id, name, volume, food_type_id, timestamp, date_uploaded, user_id FROM food_item_unpartitioned
+    """)
+    op.execute("DROP TABLE food_item_unpartitioned")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("ALTER TABLE food_item RENAME TO food_item_partitioned")
+        op.execute("ALTER TABLE food_item_partitioned RENAME CONSTRAINT food_item_pkey TO food_item_partitioned_pkey")
+        op.execute("DROP INDEX idx_food_timestamp")
+        op.execute("DROP INDEX idx_food_user_id")
+        op.execute("DROP INDEX idx_food_type_id")
+        op.execute("ALTER SEQUENCE food_item_id_seq OWNED BY NONE")
+        op.execute("""
+            CREATE TABLE food_item (
+                id INTEGER NOT NULL DEFAULT nextval('food_item_id_seq') PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                volume FLOAT,
+                food_type_id INTEGER NOT NULL REFERENCES food_type (id),
+                timestamp TIMESTAMP WITHOUT TIME ZONE,
+                date_uploaded TIMESTAMP WITHOUT TIME ZONE,
+                user_id INTEGER NOT NULL REFERENCES users (id)
+            )
+        """)
+        op.execute("ALTER SEQUENCE food_item_id_seq OWNED BY food_item.id")
+        op.execute("""
+            INSERT INTO food_item (id, name, volume, food_type_id, timestamp, date_uploaded, user_id)
+            SELECT id, name, volume, food_type_id, timestamp, date_uploaded, user_id FROM food_item_partitioned
+        """)
+        op.execute("DROP TABLE food_item_partitioned CASCADE")
+        op.execute("CREATE INDEX idx_food_timestamp ON food_item (timestamp)")
+        op.execute("CREATE INDEX idx_food_user_id ON food_item (user_id)")
+        op.execute("CREATE INDEX idx_food_type_id ON food_item (food_type_id)")
+        op.create_foreign_key('nutritional_information_food_item_id_fkey', 'nutritional_information',
+                              'food_item', ['food_item_id'], ['id'])
+    else:
+        with op.batch_alter_table('food_item', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+
+    with op.batch_alter_table('food_item_archive', schema=None) as batch_op:
+        batch_op.drop_index('idx_food_archive_user_timestamp')
+
+    op.drop_table('food_item_archive')
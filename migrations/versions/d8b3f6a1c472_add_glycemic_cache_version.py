@@ -0,0 +1,35 @@
+"""Add glycemic_cache_version and daily_glycemic_load.meal_gap_minutes
+
+Revision ID: d8b3f6a1c472
+Revises: c5e1f7a3d920
+Create Date: 2026-10-20 14:02:47.318260
+
+Cached days from before this revision get NULL meal_gap_minutes, so they
+are recomputed and overwritten on their next request.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import add_column
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b3f6a1c472'
+down_revision = 'c5e1f7a3d920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('glycemic_cache_version',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    add_column('daily_glycemic_load', sa.Column('meal_gap_minutes', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('daily_glycemic_load', schema=None) as batch_op:
+        batch_op.drop_column('meal_gap_minutes')
+    op.drop_table('glycemic_cache_version')
@@ -0,0 +1,106 @@
+"""Store nutrition on food_item; nutritional_information becomes a view
+
+Revision ID: e4a7c1d9b362
+Revises: 7c2d4e8a1f36
+Create Date: 2026-10-19 21:14:52.730118
+
+Every food item has exactly one nutrition row, so its four columns move
+onto food_item: listings, exports and the glycemic load read one table
+instead of joining, and saves insert one row. nutritional_information is
+replaced by a read-only view with the same columns (food_item_id = id) for
+reports that still query it.
+
+The columns are added without a rewrite and backfilled in batches while
+the old code keeps writing. The final step locks nutritional_information
+against writes, copies rows added since the backfill started, then drops
+the table and creates the view. Deploy the new code with this migration:
+old workers can no longer save items once it has run. Shard databases get
+the same change (see online_migrations.on_shards).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import add_column, backfill, create_index_concurrently, on_shards
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c1d9b362'
+down_revision = '7c2d4e8a1f36'
+branch_labels = None
+depends_on = None
+
+NUTRIENTS = ('calories', 'carbs', 'fat', 'protein')
+
+# The first nutrition row of each item (the one the API used to show)
+_COPY = (f"({', '.join(NUTRIENTS)}) = (SELECT {', '.join('n.' + c for c in NUTRIENTS)} "
+         f"FROM nutritional_information n WHERE n.food_item_id = food_item.id ORDER BY n.id LIMIT 1)")
+
+
+def _tables():
+    if op.get_context().as_sql:
+        return None
+    return sa.inspect(op.get_bind())
+
+
+def _inline():
+    inspector = _tables()
+    if inspector is not None and 'nutritional_information' not in inspector.get_table_names():
+        return  # created with the inline layout (flask shards init), or already migrated
+    existing = {c['name'] for c in inspector.get_columns('food_item')} if inspector is not None else set()
+    for name in NUTRIENTS:
+        if name not in existing:
+            add_column('food_item', sa.Column(name, sa.Float(), nullable=True))
+
+    postgres = op.get_context().dialect.name == 'postgresql'
+    mark = op.get_bind().execute(sa.text("SELECT max(id) FROM nutritional_information")).scalar() \
+        if inspector is not None else None
+    backfill('food_item', _COPY,
+             where="EXISTS (SELECT 1 FROM nutritional_information n WHERE n.food_item_id = food_item.id)")
+
+    # Rows the old code added while the backfill ran; the lock keeps more from arriving
+    if postgres:
+        op.execute("LOCK TABLE nutritional_information IN SHARE ROW EXCLUSIVE MODE")
+    if mark is not None:
+        op.execute(sa.text(
+            f"UPDATE food_item SET {_COPY} WHERE EXISTS (SELECT 1 FROM nutritional_information n "
+            f"WHERE n.food_item_id = food_item.id AND n.id > :mark)"
+        ).bindparams(mark=mark))
+    op.drop_table('nutritional_information')
+    op.execute(f"CREATE VIEW nutritional_information AS "
+               f"SELECT id, id AS food_item_id, {', '.join(NUTRIENTS)} FROM food_item")
+
+
+def _split():
+    inspector = _tables()
+    if inspector is not None and 'nutritional_information' in inspector.get_table_names():
+        return
+    op.execute("DROP VIEW IF EXISTS nutritional_information")
+    postgres = op.get_context().dialect.name == 'postgresql'
+    # Postgres dropped this foreign key when food_item was partitioned (c7b57fb38ff0)
+    foreign_key = [] if postgres else [sa.ForeignKeyConstraint(['food_item_id'], ['food_item.id'])]
+    op.create_table('nutritional_information',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('food_item_id', sa.Integer(), nullable=False),
+    sa.Column('calories', sa.Float(), nullable=True),
+    sa.Column('carbs', sa.Float(), nullable=True),
+    sa.Column('fat', sa.Float(), nullable=True),
+    sa.Column('protein', sa.Float(), nullable=True),
+    *foreign_key,
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(f"INSERT INTO nutritional_information (food_item_id, {', '.join(NUTRIENTS)}) "
+               f"SELECT id, {', '.join(NUTRIENTS)} FROM food_item ORDER BY id")
+    create_index_concurrently('idx_nutrition_food_item_id', 'nutritional_information', ['food_item_id'])
+    with op.batch_alter_table('food_item', schema=None) as batch_op:
+        for name in NUTRIENTS:
+            batch_op.drop_column(name)
+
+
+def upgrade():
+    _inline()
+    on_shards(_inline)
+
+
+def downgrade():
+    on_shards(_split)
+    _split()
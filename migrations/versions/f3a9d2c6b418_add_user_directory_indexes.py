@@ -0,0 +1,47 @@
+"""Add indexes for the admin user directory, built concurrently
+
+Revision ID: f3a9d2c6b418
+Revises: b8e3f0a5c217
+Create Date: 2026-10-20 09:41:06.284517
+
+/admin/users pages through users in id order, filtered by role and by
+case-insensitive prefixes of email, first and last name.
+idx_users_role_id serves the role filter without a sort; the lower()
+indexes serve the prefix searches (with varchar_pattern_ops on Postgres so
+LIKE 'abc%' can use them whatever the collation). The per-user activity
+columns use the existing idx_food_user_timestamp.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2c6b418'
+down_revision = 'b8e3f0a5c217'
+branch_labels = None
+depends_on = None
+
+_LOWER = {
+    'idx_users_email_lower': 'email',
+    'idx_users_first_name_lower': 'first_name',
+    'idx_users_last_name_lower': 'last_name',
+}
+
+
+def _lower(column):
+    opclass = ' varchar_pattern_ops' if op.get_context().dialect.name == 'postgresql' else ''
+    return sa.text(f"lower({column}){opclass}")
+
+
+def upgrade():
+    create_index_concurrently('idx_users_role_id', 'users', ['role', 'id'])
+    for name, column in _LOWER.items():
+        create_index_concurrently(name, 'users', [_lower(column)])
+
+
+def downgrade():
+    for name in reversed(list(_LOWER)):
+        drop_index_concurrently(name, 'users')
+    drop_index_concurrently('idx_users_role_id', 'users')
@@ -15,9 +15,16 @@ class FoodItem(db.Model):
     name = db.Column(db.String(100), nullable=False)
     volume = db.Column(db.Float)
     food_type_id = db.Column(db.Integer, db.ForeignKey('food_type.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Partition key on Postgres (monthly ranges), so it can't be NULL
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     date_uploaded = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Nutrition is 1:1 with the item, so it is stored on the row itself;
+    # nutritional_information is a read-only view over these columns.
+    calories = db.Column(db.Float)
+    carbs = db.Column(db.Float)
+    fat = db.Column(db.Float)
+    protein = db.Column(db.Float)
 
     food_type = db.relationship('FoodType', backref=db.backref('food_items', lazy=True))
     user = db.relationship('User', backref=db.backref('food_items', lazy=True))
@@ -25,19 +32,32 @@ class FoodItem(db.Model):
     __table_args__ = (
         db.Index('idx_food_timestamp', 'timestamp'),
         db.Index('idx_food_user_id', 'user_id'),
-        db.Index('idx_food_type_id', 'food_type_id')
+        db.Index('idx_food_type_id', 'food_type_id'),
+        db.Index('idx_food_user_timestamp', 'user_id', 'timestamp')
     )
 
-class NutritionalInformation(db.Model):
-    __tablename__ = 'nutritional_information'
-    id = db.Column(db.Integer, primary_key=True)
-    food_item_id = db.Column(db.Integer, db.ForeignKey('food_item.id'), nullable=False)
+    @property
+    def nutrition(self):
+        return {'calories': self.calories, 'carbs': self.carbs, 'fat': self.fat, 'protein': self.protein}
+
+class FoodItemArchive(db.Model):
+    """Food items past the retention period, flattened with their nutrition."""
+    __tablename__ = 'food_item_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    food_type = db.Column(db.String(50))
+    name = db.Column(db.String(100), nullable=False)
+    volume = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    date_uploaded = db.Column(db.DateTime)
     calories = db.Column(db.Float)
     carbs = db.Column(db.Float)
     fat = db.Column(db.Float)
     protein = db.Column(db.Float)
 
-    food_item = db.relationship('FoodItem', backref=db.backref('nutrition', lazy=True))
+    __table_args__ = (
+        db.Index('idx_food_archive_user_timestamp', 'user_id', 'timestamp'),
+    )
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -48,6 +68,21 @@ class User(db.Model):
     password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(50), default="GLUCOCHECK_USER")
     is_admin = db.Column(db.Boolean, default=False)
+    # Bind holding this user's food log (see sharding.py); NULL is the primary database
+    shard = db.Column(db.String(50))
+
+    __table_args__ = (
+        db.Index('idx_users_shard', 'shard'),
+        # Admin user directory: role filter in id order, and case-insensitive prefix
+        # search (varchar_pattern_ops lets LIKE 'abc%' use the index under any collation)
+        db.Index('idx_users_role_id', 'role', 'id'),
+        db.Index('idx_users_email_lower', db.func.lower(email).label('email_lower'),
+                 postgresql_ops={'email_lower': 'varchar_pattern_ops'}),
+        db.Index('idx_users_first_name_lower', db.func.lower(first_name).label('first_name_lower'),
+                 postgresql_ops={'first_name_lower': 'varchar_pattern_ops'}),
+        db.Index('idx_users_last_name_lower', db.func.lower(last_name).label('last_name_lower'),
+                 postgresql_ops={'last_name_lower': 'varchar_pattern_ops'}),
+    )
     
     # Add helper methods for role checking
     def is_super_user(self):
@@ -65,3 +100,176 @@ class User(db.Model):
         )
         return admin
 
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(100))
+    recipients = db.Column(db.String(500), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    # A queued row belongs to the worker that queued it until then; NULL = anyone may send it now
+    next_attempt_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_email_outbox_status', 'status'),
+        db.Index('idx_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+# Incrementally maintained aggregates for the admin stats endpoint (see stats.py).
+# Counters are spread over `slot` rows so concurrent writers don't all
+# contend on one row per day; readers sum the slots.
+class DailyStats(db.Model):
+    __tablename__ = 'daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    active_users = db.Column(db.Integer, nullable=False, default=0)
+    meals = db.Column(db.Integer, nullable=False, default=0)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    calories = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+    fat = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+
+class DailyFoodTypeStats(db.Model):
+    __tablename__ = 'daily_food_type_stats'
+    day = db.Column(db.Date, primary_key=True)
+    food_type_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    items = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyFoodStats(db.Model):
+    __tablename__ = 'daily_food_stats'
+    day = db.Column(db.Date, primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    items = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyUserActivity(db.Model):
+    __tablename__ = 'daily_user_activity'
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+# Content-addressed image store (see images.py). Files live on disk under
+# IMAGE_STORE_DIR keyed by SHA-256; these tables record metadata, who
+# uploaded what, and which food items an image produced.
+class StoredImage(db.Model):
+    __tablename__ = 'stored_image'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(50))
+    has_thumbnail = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Cached model output for this exact image
+    analysis = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('idx_stored_image_last_used', 'last_used_at'),
+    )
+
+class UserImage(db.Model):
+    __tablename__ = 'user_image'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    image_sha256 = db.Column(db.String(64), db.ForeignKey('stored_image.sha256', ondelete='CASCADE'),
+                             primary_key=True)
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_user_image_sha256', 'image_sha256'),
+    )
+
+class FoodItemImage(db.Model):
+    __tablename__ = 'food_item_image'
+    # No foreign key to food_item: on Postgres it is partitioned with a
+    # composite key; links to deleted items are removed by the image GC.
+    food_item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    image_sha256 = db.Column(db.String(64), db.ForeignKey('stored_image.sha256'), nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_food_item_image_sha256', 'image_sha256'),
+    )
+
+# Next food_item id to hand out when sharded on SQLite, which has no shared
+# sequence (see Shards.allocate_item_ids); Postgres uses food_item_id_seq.
+class IdAllocator(db.Model):
+    __tablename__ = 'id_allocator'
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+
+# Per-user, per-day glycemic load cache (see glycemic.py). Rows for a day
+# are deleted whenever that user's items on that day change.
+class DailyGlycemicLoad(db.Model):
+    __tablename__ = 'daily_glycemic_load'
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    glycemic_load = db.Column(db.Float, nullable=False)
+    meal_count = db.Column(db.Integer, nullable=False)
+    # JSON day summary; NULL for a day without meals
+    payload = db.Column(db.Text)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # GLYCEMIC_MEAL_GAP_MINUTES the day was computed with; rows for another gap are stale
+    meal_gap_minutes = db.Column(db.Integer)
+
+# Bumped with every invalidation of a user's cached days, so a computation
+# that read the items before the change doesn't cache its stale result.
+class GlycemicCacheVersion(db.Model):
+    __tablename__ = 'glycemic_cache_version'
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# On-demand request profiling (see profiling.py). A session selects which
+# requests workers sample and until when; each worker keeps one result row
+# per session with its aggregated stacks in collapsed format.
+class ProfilingSession(db.Model):
+    __tablename__ = 'profiling_session'
+    id = db.Column(db.Integer, primary_key=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Comma-separated endpoint or blueprint names; NULL profiles every endpoint
+    endpoints = db.Column(db.String(500))
+    sample_rate = db.Column(db.Float, nullable=False)
+    interval_ms = db.Column(db.Integer, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    stopped_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_profiling_session_expires_at', 'expires_at'),
+    )
+
+class ProfilingResult(db.Model):
+    __tablename__ = 'profiling_result'
+    session_id = db.Column(db.Integer, db.ForeignKey('profiling_session.id', ondelete='CASCADE'), primary_key=True)
+    # host:pid of the worker process
+    worker = db.Column(db.String(100), primary_key=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    stacks = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AnalysisUsage(db.Model):
+    """One /analyze call: upstream token usage and latency, or a cache hit (usage.py)."""
+    __tablename__ = 'analysis_usage'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    image_sha256 = db.Column(db.String(64))
+    image_bytes = db.Column(db.Integer)
+    cache_hit = db.Column(db.Boolean, nullable=False, default=False)
+    # As reported by the model; NULL for cache hits and failed calls
+    model = db.Column(db.String(50))
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False, default='ok')  # 'ok' or 'error'
+
+    __table_args__ = (
+        db.Index('idx_analysis_usage_user_created', 'user_id', 'created_at'),
+        db.Index('idx_analysis_usage_created', 'created_at'),
+    )
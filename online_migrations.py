@@ -0,0 +1,306 @@
+#online_migrations.py
+"""Lock-safe schema changes for Alembic migrations on large tables.
+
+Plain `op.create_index` / `batch_alter_table` hold locks that block writes
+(or everything) for as long as an index build or table rewrite takes. The
+helpers here do the same changes on Postgres without that:
+
+* indexes are built with CREATE INDEX CONCURRENTLY outside the migration's
+  transaction, partition by partition for partitioned tables (food_item);
+* columns are added without a rewrite and made NOT NULL through a validated
+  CHECK constraint instead of a full-table scan under an exclusive lock;
+* data is backfilled in key-range batches, each committed on its own, with
+  a pause between batches and progress in the migration log.
+
+Changes to the per-user tables are repeated on each shard database with
+on_shards().
+
+Other databases (SQLite in development) get the ordinary operations. The
+online mode in migrations/env.py runs each migration in its own transaction
+with MIGRATION_LOCK_TIMEOUT set, so DDL that cannot get its lock fails fast
+instead of stalling traffic; re-running `flask db upgrade` resumes from the
+migration that failed.
+"""
+import contextlib
+import hashlib
+import logging
+import time
+
+from alembic import op
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+logger = logging.getLogger('alembic.online')
+
+
+def _is_postgres():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def _offline():
+    """Generating SQL (`flask db upgrade --sql`), so nothing can be queried."""
+    return op.get_context().as_sql
+
+
+def _own_transactions():
+    """Commit what ran so far and autocommit each statement (Postgres only; elsewhere one transaction)."""
+    if _is_postgres():
+        return op.get_context().autocommit_block()
+    return contextlib.nullcontext()
+
+
+def _quote(name):
+    return op.get_context().dialect.identifier_preparer.quote(name)
+
+
+def _scalar(sql, **params):
+    return op.get_bind().execute(text(sql), params).scalar()
+
+
+def _partitions(table):
+    """Partitions of `table`, or [] when it isn't partitioned."""
+    return list(op.get_bind().execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {'table': table}).scalars())
+
+
+def _is_partitioned(table):
+    return bool(_scalar("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)", table=table))
+
+
+def _derived_name(base, suffix):
+    """`base_suffix`, shortened with a hash to fit Postgres' 63-character identifiers."""
+    name = f"{base}_{suffix}"
+    if len(name) <= 63:
+        return name
+    return f"{name[:54]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+
+
+class _no_timeouts:
+    """Lift lock/statement timeouts for statements that are meant to wait.
+
+    CREATE INDEX CONCURRENTLY and VALIDATE CONSTRAINT wait for older
+    transactions to finish (without blocking anyone), which lock_timeout
+    would otherwise turn into a failure.
+    """
+
+    def __enter__(self):
+        bind = op.get_bind()
+        self._saved = {name: bind.execute(text(f"SHOW {name}")).scalar()
+                       for name in ('lock_timeout', 'statement_timeout')}
+        for name in self._saved:
+            bind.execute(text("SELECT set_config(:name, '0', false)"), {'name': name})
+
+    def __exit__(self, *exc):
+        bind = op.get_bind()
+        for name, value in self._saved.items():
+            bind.execute(text("SELECT set_config(:name, :value, false)"), {'name': name, 'value': value})
+
+
+def _drop_invalid_index(index_name):
+    """A failed concurrent build leaves an INVALID index behind; drop it so the build can be retried."""
+    invalid = _scalar(
+        "SELECT NOT x.indisvalid FROM pg_index x WHERE x.indexrelid = to_regclass(:name)", name=index_name)
+    if invalid:
+        logger.info("Dropping invalid index %s left by an earlier attempt", index_name)
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(index_name)}")
+
+
+def create_index_concurrently(index_name, table, columns, unique=False, where=None):
+    """Create an index without blocking writes; safe to re-run after a failure.
+
+    `columns` are column names or sa.text() expressions (e.g.
+    "lower(email) varchar_pattern_ops"); `where` an optional SQL predicate
+    for a partial index. On a partitioned table the index is created on the parent
+    only, built concurrently on each partition and attached, which is the
+    non-blocking equivalent of CREATE INDEX on the parent (partitions created
+    later get it automatically). Unique indexes on a partitioned table must
+    include the partition key.
+    """
+    if not _is_postgres() or _offline():
+        if _is_postgres():
+            logger.warning("Offline SQL for %s uses a blocking CREATE INDEX; run online to build it concurrently",
+                           index_name)
+        op.create_index(index_name, table, columns, unique=unique, if_not_exists=True,
+                        postgresql_where=text(where) if where else None,
+                        sqlite_where=text(where) if where else None)
+        return
+
+    unique_sql = 'UNIQUE ' if unique else ''
+    column_sql = ', '.join(c.text if isinstance(c, TextClause) else _quote(c) for c in columns)
+    where_sql = f" WHERE {where}" if where else ''
+    with op.get_context().autocommit_block():
+        if not _is_partitioned(table):
+            _drop_invalid_index(index_name)
+            with _no_timeouts():
+                op.execute(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {_quote(index_name)} "
+                           f"ON {_quote(table)} ({column_sql}){where_sql}")
+            return
+
+        # Catalog-only: the parent index stays invalid until every partition has one attached
+        op.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {_quote(index_name)} "
+                   f"ON ONLY {_quote(table)} ({column_sql}){where_sql}")
+        while True:
+            pending = list(op.get_bind().execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:table) AND NOT EXISTS ("
+                "  SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid "
+                "  WHERE ii.inhparent = to_regclass(:index) AND x.indrelid = c.oid) "
+                "ORDER BY c.relname"
+            ), {'table': table, 'index': index_name}).scalars())
+            if not pending:
+                break
+            for number, partition in enumerate(pending, 1):
+                child = _derived_name(partition, index_name)
+                logger.info("%s: building on %s (%d/%d)", index_name, partition, number, len(pending))
+                _drop_invalid_index(child)
+                with _no_timeouts():
+                    op.execute(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {_quote(child)} "
+                               f"ON {_quote(partition)} ({column_sql}){where_sql}")
+                op.execute(f"ALTER INDEX {_quote(index_name)} ATTACH PARTITION {_quote(child)}")
+
+
+def drop_index_concurrently(index_name, table):
+    """Drop an index without blocking writes (partitioned indexes take only a brief lock)."""
+    if not _is_postgres() or _offline():
+        op.drop_index(index_name, table_name=table, if_exists=True)
+        return
+    with op.get_context().autocommit_block():
+        partitioned = _scalar("SELECT relkind = 'I' FROM pg_class WHERE oid = to_regclass(:name)", name=index_name)
+        if partitioned:
+            # Postgres can't drop a partitioned index concurrently; this only removes catalog entries
+            op.execute(f"DROP INDEX IF EXISTS {_quote(index_name)}")
+        else:
+            with _no_timeouts():
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(index_name)}")
+
+
+def add_column(table, column):
+    """Add a column without rewriting the table.
+
+    On Postgres 11+ adding a nullable column, or one with a constant
+    server_default, only touches the catalog. A volatile default such as
+    now() would still rewrite every row, so backfill those instead. NOT NULL
+    without a default can't be added to a filled table at all: add the
+    column nullable, backfill() it, then set_not_null().
+    """
+    if not column.nullable and column.server_default is None:
+        raise ValueError(f"{table}.{column.name}: add NOT NULL columns as nullable, backfill them, "
+                         f"then call set_not_null()")
+    op.add_column(table, column)
+
+
+def set_not_null(table, column):
+    """Make a filled column NOT NULL without scanning the table under an exclusive lock.
+
+    A NOT VALID CHECK constraint is added (brief lock), validated while reads
+    and writes continue, and then lets SET NOT NULL skip its scan (Postgres
+    12+). Partitioned tables are handled partition by partition.
+    """
+    if not _is_postgres() or _offline():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, nullable=False)
+        return
+
+    targets = _partitions(table) if _is_partitioned(table) else [table]
+    with op.get_context().autocommit_block():
+        for target in targets:
+            constraint = _derived_name(target, f"{column}_not_null")
+            op.execute(f"ALTER TABLE {_quote(target)} DROP CONSTRAINT IF EXISTS {_quote(constraint)}")
+            op.execute(f"ALTER TABLE {_quote(target)} ADD CONSTRAINT {_quote(constraint)} "
+                       f"CHECK ({_quote(column)} IS NOT NULL) NOT VALID")
+            with _no_timeouts():
+                op.execute(f"ALTER TABLE {_quote(target)} VALIDATE CONSTRAINT {_quote(constraint)}")
+            op.execute(f"ALTER TABLE {_quote(target)} ALTER COLUMN {_quote(column)} SET NOT NULL")
+            op.execute(f"ALTER TABLE {_quote(target)} DROP CONSTRAINT {_quote(constraint)}")
+        if targets != [table]:
+            # Every partition is already NOT NULL, so this doesn't scan
+            op.execute(f"ALTER TABLE {_quote(table)} ALTER COLUMN {_quote(column)} SET NOT NULL")
+
+
+def backfill(table, set_sql, where=None, key='id', batch_size=None, pause=None, params=None):
+    """UPDATE `table` SET `set_sql` in batches of `key` ranges; returns the rows updated.
+
+    On Postgres each batch is its own short transaction, so row locks are
+    held briefly and vacuum can keep up; the run sleeps `pause` seconds between batches
+    (MIGRATION_BACKFILL_PAUSE) and logs progress. `where` should exclude rows
+    that are already done (e.g. "carbs IS NULL") so an interrupted backfill
+    can simply be run again. `key` must be an indexed integer column.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['MIGRATION_BACKFILL_BATCH_SIZE']
+    pause = config['MIGRATION_BACKFILL_PAUSE'] if pause is None else pause
+    params = dict(params or {})
+    filter_sql = f" AND ({where})" if where else ''
+    update = text(f"UPDATE {_quote(table)} SET {set_sql} "
+                  f"WHERE {_quote(key)} >= :_lo AND {_quote(key)} < :_hi{filter_sql}")
+
+    if _offline():
+        op.execute(text(f"UPDATE {_quote(table)} SET {set_sql}" + (f" WHERE {where}" if where else ''))
+                   .bindparams(**params))
+        return 0
+
+    with _own_transactions():
+        # Bounds of the whole key (an index lookup); `where` is applied per batch
+        bounds = op.get_bind().execute(text(
+            f"SELECT min({_quote(key)}), max({_quote(key)}) FROM {_quote(table)}")).one()
+        if bounds[0] is None:
+            logger.info("%s: nothing to backfill", table)
+            return 0
+        low, high = bounds
+        span = high - low + 1
+        updated = 0
+        started = last_report = time.monotonic()
+        for lo in range(low, high + 1, batch_size):
+            result = op.get_bind().execute(update, {**params, '_lo': lo, '_hi': lo + batch_size})
+            updated += max(result.rowcount, 0)
+            now = time.monotonic()
+            done = min(lo + batch_size, high + 1) - low
+            if now - last_report >= 5 or done == span:
+                rate = updated / max(now - started, 1e-6)
+                logger.info("%s: %d rows updated, %.0f%% of %s range, %.0f rows/s",
+                            table, updated, 100.0 * done / span, key, rate)
+                last_report = now
+            if pause and done < span:
+                time.sleep(pause)
+    return updated
+
+
+def on_shards(fn):
+    """Run `fn()` again on every shard database (SHARD_DATABASE_URIS), with `op` bound to it.
+
+    The per-user tables (shard_routing.SHARDED_TABLES) exist on each shard
+    as well as on the primary, but `flask db upgrade` only connects to the
+    primary. Migrations changing those tables call this after changing the
+    primary, so `fn` has to cope with shards created by `flask shards init`
+    that already have the new layout. Each shard runs `fn` in its own
+    transaction under MIGRATION_LOCK_TIMEOUT; the helpers above work as usual.
+    """
+    binds = current_app.config.get('SHARD_BINDS') or []
+    if not binds:
+        return
+    if _offline():
+        logger.warning("Offline SQL covers the primary only; run `flask db upgrade` online to migrate shards %s",
+                       ', '.join(binds))
+        return
+    engines = current_app.extensions['sqlalchemy'].engines
+    lock_timeout = current_app.config.get('MIGRATION_LOCK_TIMEOUT')
+    primary = op.get_context()
+    try:
+        for key in binds:
+            logger.info("Applying to shard %s", key)
+            with engines[key].connect() as connection:
+                if lock_timeout and connection.dialect.name == 'postgresql':
+                    connection.execute(text("SELECT set_config('lock_timeout', :value, false)"),
+                                       {'value': lock_timeout})
+                    connection.commit()
+                context = MigrationContext.configure(connection)
+                with Operations.context(context), context.begin_transaction():
+                    fn()
+    finally:
+        # Operations.context() leaves `op` unbound; point it back at the primary's migration
+        Operations(primary)._install_proxy()
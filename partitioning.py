@@ -0,0 +1,325 @@
+#partitioning.py
+import csv
+import gzip
+import os
+import re
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+
+PARTITION_RE = re.compile(r'^food_item_p(\d{4})_(\d{2})$')
+
+_ARCHIVE_COLUMNS = ['id', 'user_id', 'food_type', 'name', 'volume', 'timestamp', 'date_uploaded',
+                    'calories', 'carbs', 'fat', 'protein']
+
+# Food items joined with their type, flattened for the archive
+_ARCHIVE_SELECT = """
+    SELECT f.id, f.user_id, t.type AS food_type, f.name, f.volume, f.timestamp, f.date_uploaded,
+           f.calories, f.carbs, f.fat, f.protein
+    FROM {source} f
+    LEFT JOIN food_type t ON t.id = f.food_type_id
+"""
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"food_item_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned():
+    """True when food_item is a partitioned Postgres table."""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(db.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'food_item'::regclass)"
+    )).scalar()
+
+
+def existing_partitions():
+    """Monthly partitions of food_item as {month: table name}."""
+    rows = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'food_item'::regclass"
+    ))
+    partitions = {}
+    for (name,) in rows:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _columns(table):
+    return db.session.execute(db.text(
+        "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute "
+        "WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped"
+    ), {'table': table}).scalar()
+
+
+def _create_partition(month):
+    """Create the partition for `month`, moving in rows that already landed in the default partition.
+
+    CREATE TABLE ... PARTITION OF fails once the default partition holds rows
+    of the new range. The rows are then copied into a standalone table and
+    deleted from the default partition before the table is attached, all in
+    one transaction with inserts into the default partition blocked; reads
+    and writes of other months carry on. Returns the number of rows moved.
+    """
+    name = partition_name(month)
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    in_range = f"timestamp >= '{start}' AND timestamp < '{end}'"
+    lock_timeout = current_app.config.get('MIGRATION_LOCK_TIMEOUT')
+    if lock_timeout:
+        db.session.execute(db.text("SELECT set_config('lock_timeout', :value, true)"), {'value': lock_timeout})
+    db.session.execute(db.text("LOCK TABLE food_item_default IN SHARE ROW EXCLUSIVE MODE"))
+    if not db.session.execute(db.text(f"SELECT EXISTS (SELECT 1 FROM food_item_default WHERE {in_range})")).scalar():
+        db.session.execute(db.text(
+            f"CREATE TABLE {name} PARTITION OF food_item FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return 0
+    columns = _columns('food_item')
+    db.session.execute(db.text(f"CREATE TABLE {name} (LIKE food_item INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = db.session.execute(db.text(
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM food_item_default WHERE {in_range}"
+    )).rowcount
+    db.session.execute(db.text(f"DELETE FROM food_item_default WHERE {in_range}"))
+    # Lets the attach skip scanning the new table
+    db.session.execute(db.text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_range CHECK (timestamp IS NOT NULL AND {in_range})"
+    ))
+    db.session.execute(db.text(f"ALTER TABLE food_item ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    db.session.execute(db.text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+    return moved
+
+
+def ensure_partitions(months_ahead, today=None):
+    """Create monthly partitions from this month up to `months_ahead` months out.
+
+    Rows of a new month already in the default partition are moved into it.
+    Returns {partition name: rows moved} for the partitions created. No-op
+    unless food_item is partitioned.
+    """
+    if not is_partitioned():
+        return {}
+    current = month_start(today or datetime.utcnow())
+    existing = existing_partitions()
+    created = {}
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month in existing:
+            continue
+        # One transaction per month, so the default partition is locked only while its rows move
+        created[partition_name(month)] = _create_partition(month)
+        db.session.commit()
+    return created
+
+
+def detached_partitions():
+    """Monthly food_item tables left detached by an interrupted archive run, as {month: table name}."""
+    rows = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_class c WHERE c.relkind = 'r' AND NOT c.relispartition "
+        "AND c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = 'food_item'::regclass)"
+    ))
+    partitions = {}
+    for (name,) in rows:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _unique_path(path):
+    # Never overwrite the file of an earlier run: its rows may already be gone from food_item
+    stem, n = path[:-len('.csv.gz')], 1
+    while os.path.exists(path):
+        n += 1
+        path = f"{stem}.{n}.csv.gz"
+    return path
+
+
+def _archive_rows(source, target, archive_path):
+    select = _ARCHIVE_SELECT.format(source=source)
+    if target == 'table':
+        result = db.session.execute(db.text(
+            f"INSERT INTO food_item_archive ({', '.join(_ARCHIVE_COLUMNS)}) {select}"
+        ))
+        return result.rowcount
+
+    os.makedirs(os.path.dirname(archive_path) or '.', exist_ok=True)
+    count = 0
+    rows = db.session.execute(db.text(select).execution_options(stream_results=True, yield_per=5000))
+    with gzip.open(archive_path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(_ARCHIVE_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _archive_month(name, month, target, archive_path):
+    """Copy every row of partition `name` to the archive, replacing what an earlier pass copied."""
+    if target == 'table':
+        # The partition holds all of food_item for its month, so the month's archive rows are exactly its rows
+        db.session.execute(db.text(
+            "DELETE FROM food_item_archive WHERE timestamp >= :month AND timestamp < :next_month"
+        ), {'month': month, 'next_month': add_months(month, 1)})
+    return _archive_rows(name, target, archive_path)
+
+
+def _fingerprint(name):
+    # Changes with any insert, update or delete in the table; one scan, no sort
+    return tuple(db.session.execute(db.text(
+        f"SELECT count(*), coalesce(sum(hashtext(f::text)::bigint), 0) FROM {name} f"
+    )).one())
+
+
+def _detach(name):
+    """Detach `name` from food_item in a transaction of its own, holding the parent's lock only for the DDL.
+
+    DETACH ... CONCURRENTLY is not allowed while food_item has a default
+    partition, so this is a plain detach bounded by MIGRATION_LOCK_TIMEOUT.
+    """
+    lock_timeout = current_app.config.get('MIGRATION_LOCK_TIMEOUT')
+    if lock_timeout:
+        db.session.execute(db.text("SELECT set_config('lock_timeout', :value, true)"), {'value': lock_timeout})
+    db.session.execute(db.text(f"ALTER TABLE food_item DETACH PARTITION {name}"))
+    db.session.commit()
+
+
+def _archive_batched(source, cutoff_ts, target, archive_path, batch_size):
+    """Archive rows of `source` logged before `cutoff_ts` and delete them, `batch_size` per transaction.
+
+    Each batch is copied and deleted by id in the same transaction, so rows
+    written meanwhile are neither lost nor archived twice in the table.
+    """
+    f = None
+    archived = 0
+    try:
+        while True:
+            ids = [row[0] for row in db.session.execute(db.text(
+                f"SELECT id FROM {source} WHERE timestamp < :cutoff ORDER BY id LIMIT :limit"
+            ), {'cutoff': cutoff_ts, 'limit': batch_size})]
+            if not ids:
+                break
+            batch = _ARCHIVE_SELECT.format(source=source) + " WHERE f.id IN :ids"
+            if target == 'table':
+                # Rows archived by an interrupted earlier run are skipped
+                db.session.execute(db.text(
+                    f"INSERT INTO food_item_archive ({', '.join(_ARCHIVE_COLUMNS)}) {batch} ON CONFLICT (id) DO NOTHING"
+                ).bindparams(db.bindparam('ids', expanding=True)), {'ids': ids})
+            else:
+                if f is None:
+                    os.makedirs(os.path.dirname(archive_path) or '.', exist_ok=True)
+                    f = gzip.open(archive_path, 'wt', newline='')
+                    writer = csv.writer(f)
+                    writer.writerow(_ARCHIVE_COLUMNS)
+                writer.writerows(db.session.execute(
+                    db.text(batch).bindparams(db.bindparam('ids', expanding=True)), {'ids': ids}))
+            db.session.execute(db.text(f"DELETE FROM {source} WHERE id IN :ids")
+                               .bindparams(db.bindparam('ids', expanding=True)), {'ids': ids})
+            db.session.commit()
+            archived += len(ids)
+    finally:
+        if f is not None:
+            f.close()
+    return archived
+
+
+def archive_before(cutoff, target='table', archive_dir='archive', batch_size=10000):
+    """Move food items logged before `cutoff` (a month start) out of food_item.
+
+    Rows go to the food_item_archive table (target='table') or to gzipped
+    CSV files under `archive_dir` (target='file'), together with their type
+    and nutrition. On partitioned Postgres each old monthly partition is
+    copied while still attached, detached in a short transaction of its
+    own, re-copied from the detached table if it changed in between, and
+    dropped; old rows in the default partition, and everything elsewhere,
+    are copied and then deleted in batches. Safe to re-run after an
+    interruption. Returns {label: rows archived}.
+    """
+    archived = {}
+    cutoff_ts = datetime(cutoff.year, cutoff.month, 1)
+    if is_partitioned():
+        # Tables a previous run detached but didn't get to drop
+        for month, name in sorted(detached_partitions().items()):
+            if month < cutoff:
+                path = os.path.join(archive_dir, f"{name}.csv.gz")
+                archived[name] = _archive_month(name, month, target, path)
+                db.session.execute(db.text(f"DROP TABLE {name}"))
+                db.session.commit()
+
+        for month, name in sorted(existing_partitions().items()):
+            if month >= cutoff:
+                continue
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            # Copy while attached: readers and writers of food_item are not blocked. The
+            # fingerprint is taken in the copy's snapshot to spot rows changed before the detach.
+            db.session.commit()
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+            archived[name] = _archive_month(name, month, target, path)
+            copied = _fingerprint(name)
+            db.session.commit()
+
+            _detach(name)
+            if _fingerprint(name) != copied:
+                archived[name] = _archive_month(name, month, target, path)
+            db.session.execute(db.text(f"DROP TABLE {name}"))
+            db.session.commit()
+
+        path = _unique_path(os.path.join(archive_dir, f"food_item_default_before_{cutoff.isoformat()}.csv.gz"))
+        count = _archive_batched('food_item_default', cutoff_ts, target, path, batch_size)
+        if count:
+            archived['food_item_default'] = count
+        return archived
+
+    # Unpartitioned fallback (SQLite, or Postgres before the partitioning migration)
+    path = _unique_path(os.path.join(archive_dir, f"food_item_before_{cutoff.isoformat()}.csv.gz"))
+    archived['food_item'] = _archive_batched('food_item', cutoff_ts, target, path, batch_size)
+    return archived
+
+
+partitions_cli = AppGroup('partitions', help='Manage food_item partitions and archival.')
+
+
+@partitions_cli.command('ensure')
+@click.option('--months-ahead', type=int, default=None, help='Defaults to PARTITION_MONTHS_AHEAD.')
+def ensure_command(months_ahead):
+    """Create upcoming monthly food_item partitions."""
+    if months_ahead is None:
+        months_ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    created = ensure_partitions(months_ahead)
+    for name, moved in created.items():
+        if moved:
+            click.echo(f"{name}: moved {moved} row(s) out of food_item_default")
+    click.echo(f"Created {len(created)} partition(s): {', '.join(created) or '-'}")
+
+
+@partitions_cli.command('archive')
+@click.option('--retention-months', type=int, default=None, help='Defaults to FOOD_ITEM_RETENTION_MONTHS.')
+@click.option('--target', type=click.Choice(['table', 'file']), default=None, help='Defaults to ARCHIVE_TARGET.')
+@click.option('--archive-dir', default=None, help='Defaults to ARCHIVE_DIR.')
+def archive_command(retention_months, target, archive_dir):
+    """Archive food items older than the retention period."""
+    config = current_app.config
+    retention_months = config['FOOD_ITEM_RETENTION_MONTHS'] if retention_months is None else retention_months
+    if not retention_months:
+        click.echo("Retention is disabled (0 months); nothing to archive.")
+        return
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months)
+    archived = archive_before(cutoff, target or config['ARCHIVE_TARGET'], archive_dir or config['ARCHIVE_DIR'])
+    for label, count in archived.items():
+        click.echo(f"{label}: {count} row(s) archived")
+    click.echo(f"Archived {sum(archived.values())} row(s) logged before {cutoff.isoformat()}")
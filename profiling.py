@@ -0,0 +1,366 @@
+#profiling.py
+import marshal
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Flask, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db
+from models import ProfilingSession, ProfilingResult
+
+# Where a request's own frames start; the server and WSGI layers above it are left out
+_DISPATCH = Flask.full_dispatch_request.__code__
+
+_SQL_TABLES = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+("?[\w.]+"?)', re.I)
+
+
+def _http_urllib3(frame_locals):
+    pool = frame_locals.get('self')
+    return f"[http] {frame_locals.get('method')} {getattr(pool, 'host', '?')}"
+
+
+def _http_httpx(frame_locals):
+    outgoing = frame_locals.get('request')
+    return f"[http] {outgoing.method} {outgoing.url.host}" if outgoing is not None else "[http] ?"
+
+
+# Frames of upstream HTTP calls (requests/Google via urllib3, OpenAI via httpx),
+# labelled with method and host by an extra frame under them
+_UPSTREAM_FRAMES = {
+    (os.path.join('urllib3', 'connectionpool.py'), 'urlopen'): _http_urllib3,
+    (os.path.join('httpx', '_client.py'), 'send'): _http_httpx,
+}
+
+
+class _Active:
+    """This process's view of the running profiling session."""
+
+    def __init__(self, session):
+        self.id = session.id
+        self.endpoints = frozenset(session.endpoints.split(',')) if session.endpoints else None
+        self.sample_rate = session.sample_rate
+        self.interval = session.interval_ms / 1000.0
+        self.expires = session.expires_at
+
+    def wants(self, endpoint, blueprint):
+        if self.endpoints is not None and endpoint not in self.endpoints and blueprint not in self.endpoints:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+class RequestProfiler:
+    """On-demand sampling profiler for live requests, driven from the admin API.
+
+    An admin starts a session (profiling_session) for a fraction of
+    requests, optionally limited to some endpoints or blueprints, for a
+    bounded time. A worker that is serving requests looks for a session
+    every PROFILING_IDLE_POLL_SECONDS (every PROFILING_POLL_SECONDS while one
+    runs; an idle worker doesn't query at all), and on finding one starts a
+    sampler thread that records the stack of each selected request
+    every PROFILING_INTERVAL_MS, plus the SQL statement or upstream HTTP call
+    it is waiting on. Aggregated stacks are written to profiling_result
+    every PROFILING_FLUSH_SECONDS and can be downloaded merged over all
+    workers as collapsed stacks (flamegraph.pl, speedscope) or a pstats
+    file. Without a session a request costs one attribute read. Samples
+    come from sys._current_frames(), so sync and gthread workers are
+    supported; gevent workers record nothing.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._switch = threading.Lock()  # refresh() runs from the watcher and from admin requests
+        self._pid = None
+        self._active = None
+        self._threads = {}
+        self._sql = {}
+        self._labels = {}
+        self._sql_labels = {}
+        self._max_stacks = 20000
+        self._served = 0  # requests since the watcher last looked for a session
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', True)
+        app.config.setdefault('PROFILING_MAX_DURATION', 900)
+        app.config.setdefault('PROFILING_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILING_POLL_SECONDS', 2)
+        app.config.setdefault('PROFILING_IDLE_POLL_SECONDS', 15)
+        app.config.setdefault('PROFILING_FLUSH_SECONDS', 10)
+        app.config.setdefault('PROFILING_MAX_STACKS', 20000)
+        app.extensions['profiler'] = self
+        if app.config['PROFILING_ENABLED']:
+            app.before_request(self._before_request)
+            app.teardown_request(self._teardown_request)
+
+    def _reset(self):
+        self._session_id = None
+        self._stacks = Counter()
+        self._requests = 0
+        self._samples = 0
+
+    @property
+    def worker(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    # Request hooks
+
+    def _before_request(self):
+        if self._pid != os.getpid():
+            self._start(current_app._get_current_object())
+        self._served += 1
+        active = self._active
+        if active is None or not active.wants(request.endpoint, request.blueprint):
+            return
+        self._threads[threading.get_ident()] = f"{request.method} {request.endpoint}"
+
+    def _teardown_request(self, exc):
+        if self._threads and self._threads.pop(threading.get_ident(), None) is not None:
+            self._requests += 1
+
+    # Session state
+
+    def _start(self, app):
+        # Per process: each gunicorn worker polls and samples on its own threads
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._active = None
+            self._threads.clear()
+            self._reset()
+            threading.Thread(target=self._watch, args=(app,), name='profiler-watch', daemon=True).start()
+
+    def _watch(self, app):
+        poll = app.config['PROFILING_POLL_SECONDS']
+        idle_poll = max(poll, app.config['PROFILING_IDLE_POLL_SECONDS'])
+        flush_every = app.config['PROFILING_FLUSH_SECONDS']
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(poll if self._session_id is not None else idle_poll)
+            if self._session_id is None and not self._served:
+                continue  # nothing to profile here, so no need to ask
+            self._served = 0
+            with app.app_context():
+                try:
+                    self.refresh()
+                    if self._session_id is not None and time.monotonic() - last_flush >= flush_every:
+                        self.flush()
+                        last_flush = time.monotonic()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Profiler poll failed")
+                finally:
+                    db.session.remove()
+
+    def refresh(self):
+        """Pick up a started, stopped or expired session now rather than at the next poll."""
+        with self._switch:
+            self._refresh()
+
+    def _refresh(self):
+        running = ProfilingSession.query.filter(
+            ProfilingSession.stopped_at.is_(None), ProfilingSession.expires_at > datetime.utcnow()
+        ).order_by(ProfilingSession.id.desc()).first()
+        current = self._active
+        if running is not None and current is not None and running.id == current.id:
+            return
+        if self._session_id is not None:
+            # Stopped, expired (the sampler already let go) or replaced: write the final counts
+            self._active = None
+            self._threads.clear()
+            self._unlisten()
+            self.flush()
+            with self._lock:
+                self._reset()
+        if running is not None:
+            with self._lock:
+                self._reset()
+                self._session_id = running.id
+                self._max_stacks = current_app.config['PROFILING_MAX_STACKS']
+            self._active = _Active(running)
+            self._listen()
+            threading.Thread(target=self._sample, args=(self._active,), name='profiler-sample',
+                             daemon=True).start()
+
+    def flush(self, session_id=None):
+        """Write this process's aggregated stacks for its current session (if it is `session_id`)."""
+        with self._lock:
+            if self._session_id is None or session_id not in (None, self._session_id):
+                return
+            session_id, stacks = self._session_id, dict(self._stacks)
+            requests, samples = self._requests, self._samples
+        db.session.merge(ProfilingResult(
+            session_id=session_id, worker=self.worker, requests=requests, samples=samples,
+            stacks=''.join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.items()),
+            updated_at=datetime.utcnow(),
+        ))
+        db.session.commit()
+
+    # Sampling
+
+    def _listen(self):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _unlisten(self):
+        for name, fn in (('before_cursor_execute', self._before_cursor_execute),
+                         ('after_cursor_execute', self._after_cursor_execute)):
+            if event.contains(Engine, name, fn):
+                event.remove(Engine, name, fn)
+        self._sql.clear()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        ident = threading.get_ident()
+        if ident in self._threads:
+            self._sql[ident] = statement
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._sql.pop(threading.get_ident(), None)
+
+    def _sample(self, active):
+        while self._active is active:
+            if datetime.utcnow() >= active.expires:
+                self._active = None
+                self._threads.clear()
+                break
+            time.sleep(active.interval)
+            frames = sys._current_frames()
+            for ident, root in list(self._threads.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = self._stack(root, frame, self._sql.get(ident))
+                with self._lock:
+                    if stack not in self._stacks and len(self._stacks) >= self._max_stacks:
+                        stack = (root, '[truncated]')
+                    self._stacks[stack] += 1
+                    self._samples += 1
+            del frames
+
+    def _stack(self, root, frame, statement):
+        labels = [self._sql_label(statement)] if statement else []
+        while frame is not None:
+            code = frame.f_code
+            upstream = _UPSTREAM_FRAMES.get((os.path.join(*code.co_filename.split(os.sep)[-2:]), code.co_name))
+            if upstream is not None:
+                try:
+                    labels.append(upstream(frame.f_locals))
+                except Exception:
+                    labels.append("[http] ?")
+            labels.append(self._label(code))
+            if code is _DISPATCH:
+                break
+            frame = frame.f_back
+        labels.append(root)
+        return tuple(reversed(labels))
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+                if path.startswith(prefix + os.sep):
+                    path = path[len(prefix) + 1:]
+                    break
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self._labels[code] = f"{name} ({path}:{code.co_firstlineno})".replace(';', ',')
+        return label
+
+    def _sql_label(self, statement):
+        label = self._sql_labels.get(statement)
+        if label is None:
+            verb = statement.split(None, 1)[0].upper() if statement.strip() else '?'
+            tables = list(dict.fromkeys(t.strip('"') for t in _SQL_TABLES.findall(statement)))
+            label = f"[sql] {verb} {', '.join(tables[:4])}".strip()
+            if len(self._sql_labels) < 10000:
+                self._sql_labels[statement] = label
+        return label
+
+
+def collapsed(session_id, endpoint=None):
+    """Collapsed stacks ("frame;frame;... count" lines) of a session, merged over all workers."""
+    merged = Counter()
+    for (stacks,) in db.session.query(ProfilingResult.stacks).filter_by(session_id=session_id):
+        for line in (stacks or '').splitlines():
+            stack, _, count = line.rpartition(' ')
+            if endpoint and stack.split(';', 1)[0].split(' ', 1)[-1] != endpoint:
+                continue
+            merged[stack] += int(count)
+    return ''.join(f"{stack} {count}\n" for stack, count in merged.most_common())
+
+
+_FRAME = re.compile(r'^(?P<name>.*) \((?P<file>.*):(?P<line>\d+)\)$')
+
+
+def _pstats_key(label):
+    match = _FRAME.match(label)
+    if match:
+        return match['file'], int(match['line']), match['name']
+    return '~', 0, label  # request roots, [sql] and [http] frames, like pstats' built-ins
+
+
+def pstats_bytes(collapsed_text, interval):
+    """Convert collapsed stacks to a pstats file (load with pstats.Stats or snakeviz).
+
+    Sample counts stand in for call counts; times are samples x `interval` seconds.
+    """
+    stats = {}
+
+    def entry(key):
+        if key not in stats:
+            stats[key] = [0, 0, 0.0, 0.0, {}]
+        return stats[key]
+
+    for line in collapsed_text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        count = int(count)
+        elapsed = count * interval
+        keys = [_pstats_key(label) for label in stack.split(';')]
+        leaf = entry(keys[-1])
+        leaf[2] += elapsed
+        for key in set(keys):
+            record = entry(key)
+            record[0] += count
+            record[1] += count
+            record[3] += elapsed
+        for caller, callee in set(zip(keys, keys[1:])):
+            edges = entry(callee)[4]
+            nc, cc, tt, ct = edges.get(caller, (0, 0, 0.0, 0.0))
+            edges[caller] = (nc + count, cc + count, tt + (elapsed if callee == keys[-1] else 0.0), ct + elapsed)
+    return marshal.dumps({key: tuple(value) for key, value in stats.items()})
+
+
+def session_summary(session):
+    totals = db.session.query(
+        db.func.count(ProfilingResult.worker), db.func.coalesce(db.func.sum(ProfilingResult.requests), 0),
+        db.func.coalesce(db.func.sum(ProfilingResult.samples), 0),
+    ).filter(ProfilingResult.session_id == session.id).one()
+    now = datetime.utcnow()
+    return {
+        'id': session.id,
+        'created_by': session.created_by,
+        'endpoints': session.endpoints.split(',') if session.endpoints else None,
+        'sample_rate': session.sample_rate,
+        'interval_ms': session.interval_ms,
+        'started_at': session.started_at.isoformat(),
+        'expires_at': session.expires_at.isoformat(),
+        'stopped_at': session.stopped_at.isoformat() if session.stopped_at else None,
+        'active': session.stopped_at is None and session.expires_at > now,
+        'workers': totals[0],
+        'requests': int(totals[1]),
+        'samples': int(totals[2]),
+    }
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,200 @@
+#ratelimit.py
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_budget(budget):
+    """Parse '10/minute' or '10/minute;burst=20' into (refill rate per second, capacity)."""
+    spec, _, extra = budget.partition(';')
+    count, _, period = spec.strip().partition('/')
+    count = float(count)
+    capacity = count
+    if extra.strip().startswith('burst='):
+        capacity = float(extra.strip()[len('burst='):])
+    return count / _PERIODS[period.strip()], capacity
+
+
+class MemoryStorage:
+    """Token buckets held in this process."""
+
+    def __init__(self, max_keys=100000):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def consume(self, key, rate, capacity):
+        """Take one token. Returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self._buckets) > self._max_keys:
+                self._evict(now)
+        return allowed, retry_after
+
+    def _evict(self, now):
+        # Forget the least recently touched half; a forgotten key starts full,
+        # which only ever errs on the side of allowing the request.
+        by_age = sorted(self._buckets.items(), key=lambda item: item[1][1])
+        for key, _ in by_age[:len(by_age) // 2]:
+            del self._buckets[key]
+
+
+_REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisStorage:
+    """Token buckets shared between processes/hosts through a Redis-compatible server."""
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+        self._prefix = prefix
+
+    def consume(self, key, rate, capacity):
+        allowed, retry_after = self._script(keys=[self._prefix + key], args=[rate, capacity])
+        return bool(allowed), float(retry_after)
+
+
+def _too_many_requests(retry_after, message="Too many requests"):
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class RateLimiter:
+    """Per-client token-bucket limits with a separate budget per endpoint class.
+
+    Clients are keyed by the authenticated user id (set on `g.current_user`
+    by token_required/admin_required) or, for anonymous endpoints, by IP.
+    Budgets come from RATELIMIT_BUDGETS, e.g. {'auth': '10/minute'}.
+    Storage is in-process unless RATELIMIT_STORAGE_URL points at Redis.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+        app.config.setdefault('RATELIMIT_BUDGETS', {})
+
+        url = app.config['RATELIMIT_STORAGE_URL']
+        if url.startswith('memory://'):
+            storage = MemoryStorage()
+        elif url.startswith(('redis://', 'rediss://', 'unix://')):
+            storage = RedisStorage(url)
+        else:
+            raise ValueError(f"Unsupported RATELIMIT_STORAGE_URL: {url}")
+
+        app.extensions['rate_limiter'] = {
+            'enabled': app.config['RATELIMIT_ENABLED'],
+            'storage': storage,
+            'budgets': {name: parse_budget(b) for name, b in app.config['RATELIMIT_BUDGETS'].items()},
+        }
+
+    def limit(self, endpoint_class):
+        """Decorator applying the `endpoint_class` budget to a view."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                state = current_app.extensions['rate_limiter']
+                budget = state['budgets'].get(endpoint_class)
+                if not state['enabled'] or budget is None:
+                    return f(*args, **kwargs)
+
+                user = g.get('current_user')
+                client = f"u{user.id}" if user is not None else f"ip{request.remote_addr}"
+                try:
+                    allowed, retry_after = state['storage'].consume(f"{endpoint_class}:{client}", *budget)
+                except Exception:
+                    # Never take the API down because the limiter backend is unavailable
+                    current_app.logger.exception("Rate limiter storage error")
+                    return f(*args, **kwargs)
+                if not allowed:
+                    return _too_many_requests(retry_after)
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+
+class ConcurrencyLimiter:
+    """Caps how many calls of a view run at once in this process.
+
+    Excess calls wait up to `queue_timeout` seconds for a slot (at most
+    `max_queue` of them); beyond that they are shed with 429 + Retry-After.
+    """
+
+    def __init__(self, max_concurrent_key, queue_timeout_key, max_queue_key):
+        self._keys = (max_concurrent_key, queue_timeout_key, max_queue_key)
+        self._semaphore = None
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            max_concurrent, queue_timeout, max_queue = (current_app.config[k] for k in self._keys)
+            if self._semaphore is None:
+                with self._lock:
+                    if self._semaphore is None:
+                        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+            if not self._semaphore.acquire(blocking=False):
+                with self._lock:
+                    if self._waiting >= max_queue:
+                        return _too_many_requests(queue_timeout, "Server busy, try again later")
+                    self._waiting += 1
+                try:
+                    acquired = self._semaphore.acquire(timeout=queue_timeout)
+                finally:
+                    with self._lock:
+                        self._waiting -= 1
+                if not acquired:
+                    return _too_many_requests(queue_timeout, "Server busy, try again later")
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._semaphore.release()
+        return decorated_function
+
+
+limiter = RateLimiter()
+
+# Image analysis holds a worker thread for the whole upstream call
+analyze_concurrency = ConcurrencyLimiter('ANALYZE_MAX_CONCURRENCY', 'ANALYZE_QUEUE_TIMEOUT', 'ANALYZE_MAX_QUEUE')
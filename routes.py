@@ -1,17 +1,27 @@
 import base64
-from flask import Blueprint,redirect, url_for, session, request, jsonify
-from openai import OpenAI
-import app
-from models import User, FoodItem, FoodType, NutritionalInformation
+from flask import Blueprint,redirect, url_for, session, request, jsonify, current_app, g, Response, stream_with_context, send_file
+from models import User, FoodItem, FoodType, StoredImage, FoodItemImage, ProfilingSession
 from datetime import datetime, timedelta
-from flask_bcrypt import Bcrypt
 import jwt
 from functools import wraps
-from app import db, oauth 
-from config import Config
+from app import db, bcrypt, get_openai_client
+from mailer import email_queue
+from ratelimit import limiter, analyze_concurrency
+from lifecycle import analysis_jobs
+import stats
+import glycemic
+import bulk_io
+from images import IMAGE_TYPES, image_store, sniff_image_type
+from sharding import shards
+from write_buffer import write_buffer
+import profiling
+from profiling import profiler
+from usage import usage
 import re
-from flask_mail import Mail, Message
 from requests_oauthlib import OAuth2Session
+import requests
+from google_oidc import google_oidc
+import math
 import os
 
 
@@ -23,26 +33,15 @@ food_type_blueprint = Blueprint('food-type', __name__)
 nutritional_info_blueprint = Blueprint('nutritional-information', __name__)
 food_image_info_blueprint = Blueprint('image-information', __name__)
 
-bcrypt = Bcrypt()
-
 # Token blacklist
 token_blacklist = set()
 
-mail = Mail()
-
-client = OpenAI(api_key=Config.API_KEY)
-
-# OAuth configuration
-google_auth_base_url = Config.GOOGLE_AUTH_BASE_URL
-google_token_url = Config.GOOGLE_TOKEN_URL
-google_user_info_url = Config.GOOGLE_USER_INFO_URL
-
 def get_google_oauth_session(state=None, token=None):
     """Create an OAuth2 session with Google."""
     return OAuth2Session(
-        client_id=Config.GOOGLE_CLIENT_ID,
+        client_id=current_app.config['GOOGLE_CLIENT_ID'],
         redirect_uri=url_for('google_oauth.google_authorized', _external=True),
-        scope=['email', 'profile'],
+        scope=['openid', 'email', 'profile'],
         state=state,
         token=token
     )
@@ -51,18 +50,19 @@ def get_google_oauth_session(state=None, token=None):
 def google_login():
     """Initiate Google OAuth login."""
     google = get_google_oauth_session()
-    authorization_url, state = google.authorization_url(google_auth_base_url, access_type="offline", prompt="consent")
+    authorization_url, state = google.authorization_url(current_app.config['GOOGLE_AUTH_BASE_URL'], access_type="offline", prompt="consent")
     session['oauth_state'] = state
     return redirect(authorization_url)
 
 @google_auth_blueprint.route('/google/authorized')
+@limiter.limit('auth')
 def google_authorized():
     """Handle callback from Google OAuth."""
     google = get_google_oauth_session(state=session.get('oauth_state'))
     try:
         token = google.fetch_token(
-            google_token_url,
-            client_secret = Config.GOOGLE_CLIENT_SECRET,
+            current_app.config['GOOGLE_TOKEN_URL'],
+            client_secret = current_app.config['GOOGLE_CLIENT_SECRET'],
             authorization_response=request.url
         )
     except Exception as e:
@@ -71,9 +71,20 @@ def google_authorized():
     # Save token in session
     session['google_token'] = token
 
-    # Fetch user info
-    google = get_google_oauth_session(token=token)
-    user_info = google.get(google_user_info_url).json()
+    # With the openid scope the token response carries a signed ID token, which is
+    # verified locally; the userinfo call is only a fallback.
+    user_info = None
+    if token.get('id_token'):
+        try:
+            user_info = google_oidc.verify(token['id_token'])
+        except jwt.InvalidTokenError as e:
+            return jsonify({"error": "Google login failed", "details": f"Invalid ID token: {e}"}), 401
+        except requests.RequestException as e:
+            current_app.logger.warning("Google signing keys unavailable, using userinfo: %s", e)
+
+    if user_info is None:
+        google = get_google_oauth_session(token=token)
+        user_info = google.get(current_app.config['GOOGLE_USER_INFO_URL']).json()
     email = user_info.get('email')
     first_name = user_info.get('given_name', '')
     last_name = user_info.get('family_name', '')
@@ -127,7 +138,7 @@ def token_required(f):
             return jsonify({'message': 'Token has been revoked!'}), 401
 
         try:
-            data = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
             current_user = User.query.get(data['id'])
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 404
@@ -136,19 +147,21 @@ def token_required(f):
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Invalid token!'}), 403
 
+        g.current_user = current_user
+        shards.route(current_user.shard)
         return f(current_user, *args, **kwargs)
     return decorated_function
 
 def generate_tokens(user):
     access_token = jwt.encode({
         'id': user.id,
-        'exp': datetime.utcnow() + Config.JWT_ACCESS_TOKEN_EXPIRES
-    }, Config.SECRET_KEY, algorithm="HS256")
+        'exp': datetime.utcnow() + current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
     refresh_token = jwt.encode({
         'id': user.id,
-        'exp': datetime.utcnow() + Config.JWT_REFRESH_TOKEN_EXPIRES
-    }, Config.JWT_REFRESH_SECRET_KEY, algorithm="HS256")
+        'exp': datetime.utcnow() + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+    }, current_app.config['JWT_REFRESH_SECRET_KEY'], algorithm="HS256")
 
     return access_token, refresh_token
 
@@ -179,17 +192,19 @@ def admin_required(f):
             return jsonify({'message': 'Token is missing!'}), 403
 
         try:
-            data = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
             current_user = User.query.get(data['id'])
             if not current_user or not current_user.is_super_user():
                 return jsonify({'message': 'Admin privileges required!'}), 403
         except:
             return jsonify({'message': 'Invalid token!'}), 403
 
+        g.current_user = current_user
         return f(current_user, *args, **kwargs)
     return decorated_function
 
 @jwt_auth_blueprint.route('/register', methods=['POST'])
+@limiter.limit('auth')
 def register():
     data = request.json
     if not data or not all(field in data for field in ['first_name', 'last_name', 'email', 'password']):
@@ -239,6 +254,7 @@ def register():
         return jsonify({"error": "Registration failed", "details": str(e)}), 500
 
 @jwt_auth_blueprint.route('/login', methods=['POST'])
+@limiter.limit('auth')
 def login():
     try:
         data = request.json or {}
@@ -264,7 +280,7 @@ def login():
             'role': user.role,
             'is_admin': user.is_admin,
             'exp': datetime.utcnow() + timedelta(hours=24)
-        }, Config.SECRET_KEY, algorithm="HS256")
+        }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
         return jsonify({
             "token": token,
@@ -288,6 +304,7 @@ def logout(current_user):
     return jsonify({'message': 'Successfully logged out'}), 200
 
 @jwt_auth_blueprint.route('/refresh', methods=['POST'])
+@limiter.limit('auth')
 def refresh():
     data = request.json
     if not data or not data.get('refresh_token'):
@@ -298,7 +315,7 @@ def refresh():
         if token in token_blacklist:
             return jsonify({'message': 'Refresh token has been revoked!'}), 401
 
-        data = jwt.decode(token, Config.JWT_REFRESH_SECRET_KEY, algorithms=["HS256"])
+        data = jwt.decode(token, current_app.config['JWT_REFRESH_SECRET_KEY'], algorithms=["HS256"])
         user = User.query.get(data['id'])
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -311,6 +328,7 @@ def refresh():
         return jsonify({'error': 'Invalid refresh token'}), 403
     
 @jwt_auth_blueprint.route('/forgot-password', methods=['POST'])
+@limiter.limit('auth')
 def forgot_password():
     data = request.json
     if not data or not data.get('email'):
@@ -323,30 +341,29 @@ def forgot_password():
     # Generate a password reset token
     reset_token = jwt.encode({
         'id': user.id,
-        'exp': datetime.utcnow() + Config.RESET_PASSWORD_TOKEN_EXPIRES
-    }, Config.SECRET_KEY, algorithm="HS256")
+        'exp': datetime.utcnow() + current_app.config['RESET_PASSWORD_TOKEN_EXPIRES']
+    }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
-    base_url = os.getenv("BASE_URL")
-    reset_link = f"{Config.BASE_URL}/reset-password/{reset_token}"
-    msg = Message(
+    reset_link = f"{current_app.config['BASE_URL']}/reset-password/{reset_token}"
+    # Delivered by the background sender; don't hold the request on SMTP
+    email_queue.send(
         "Password Reset Request",
-        sender="your_email@example.com",
-        recipients=[user.email]
+        recipients=[user.email],
+        body=f"Click the link to reset your password: {reset_link}"
     )
-    msg.body = f"Click the link to reset your password: {reset_link}"
-    mail.send(msg)
 
     return jsonify({"message": "Password reset email sent"}), 200
 
 
 @jwt_auth_blueprint.route('/reset-password/<token>', methods=['POST'])
+@limiter.limit('auth')
 def reset_password(token):
     data = request.json
     if not data or not data.get('password'):
         return jsonify({"error": "Password is required"}), 400
 
     try:
-        payload = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
         user = User.query.get(payload['id'])
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -364,6 +381,7 @@ def reset_password(token):
 
 @jwt_auth_blueprint.route('/profile/reset-password', methods=['POST'])
 @token_required
+@limiter.limit('auth')
 def reset_password_from_profile(current_user):
     data = request.json
     if not data or not all(field in data for field in ['current_password', 'new_password']):
@@ -380,39 +398,59 @@ def reset_password_from_profile(current_user):
 
 @food_item_blueprint.route('/food-items', methods=['POST'])
 @token_required
+@limiter.limit('write')
 def save_food_items(current_user):
     data = request.json
     if not data or 'foods' not in data:
         return jsonify({"error": "No food data provided"}), 400
+    # X-Image-Id from /analyze, linking the saved items to the photo they came from
+    image_id = data.get('image_id')
+    if image_id and not image_store.is_visible_to(image_id, current_user):
+        return jsonify({"error": "Unknown image_id"}), 400
 
     try:
+        # Items saved together share a timestamp; the stats count them as one meal
+        now = datetime.utcnow()
+        if write_buffer.enabled:
+            # Committed together with other requests' items; returns once ours are durable
+            try:
+                write_buffer.save(current_user.id, data['foods'], now, image_id)
+            except TimeoutError:
+                # Still queued: a retry could save them twice
+                return jsonify({"message": "Food items accepted; they are not confirmed yet, "
+                                           "so check the list before sending them again"}), 202
+            return jsonify({"message": "Food items saved successfully"}), 201
+
+        food_items = []
         for food in data['foods']:
             food_type = FoodType.query.filter_by(type=food['type']).first()
             if not food_type:
                 food_type = FoodType(type=food['type'])
                 db.session.add(food_type)
                 db.session.flush()
+            shards.replicate_food_types({food_type.id})
 
             new_food_item = FoodItem(
                 name=food['name'],
                 volume=food.get('volume'),
                 food_type_id=food_type.id,
-                timestamp=datetime.utcnow(),
-                date_uploaded=datetime.utcnow(),
-                user_id=current_user.id
-            )
-            db.session.add(new_food_item)
-            db.session.flush()
-
-            nutrition = NutritionalInformation(
-                food_item_id=new_food_item.id,
+                timestamp=now,
+                date_uploaded=now,
+                user_id=current_user.id,
                 calories=food.get('calories'),
                 carbs=food.get('carbs'),
                 fat=food.get('fat'),
                 protein=food.get('protein')
             )
-            db.session.add(nutrition)
+            db.session.add(new_food_item)
+            food_items.append(new_food_item)
 
+        entries = [stats.entry(food_item) for food_item in food_items]
+        stats.record_items(entries)
+        glycemic.invalidate(entries)
+        if image_id:
+            db.session.flush()
+            image_store.link(image_id, [food_item.id for food_item in food_items])
         db.session.commit()
         return jsonify({"message": "Food items saved successfully"}), 201
 
@@ -422,9 +460,11 @@ def save_food_items(current_user):
 
 @food_item_blueprint.route('/food-items', methods=['GET'])
 @token_required
+@limiter.limit('read')
 def get_food_items(current_user):
     try:
         food_items = FoodItem.query.filter_by(user_id=current_user.id).order_by(FoodItem.timestamp.desc()).all()
+        image_ids = image_store.image_ids_for([food.id for food in food_items])
         result = [{
             'id': food.id,
             'name': food.name,
@@ -432,12 +472,8 @@ def get_food_items(current_user):
             'food_type': food.food_type.type,
             'timestamp': food.timestamp,
             'date_uploaded': food.date_uploaded,
-            'nutrition': {
-                'calories': food.nutrition[0].calories if food.nutrition else None,
-                'carbs': food.nutrition[0].carbs if food.nutrition else None,
-                'fat': food.nutrition[0].fat if food.nutrition else None,
-                'protein': food.nutrition[0].protein if food.nutrition else None
-            }
+            'image_id': image_ids.get(food.id),
+            'nutrition': food.nutrition
         } for food in food_items]
 
         return jsonify(result), 200
@@ -445,10 +481,74 @@ def get_food_items(current_user):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _export_response(query, filename, shard_keys=None, with_shard=False):
+    """Stream `query` in the format named by ?format= (csv by default), merged from `shard_keys` if given."""
+    fmt = request.args.get('format', 'csv')
+    formats = bulk_io.available_export_formats()
+    if fmt not in formats:
+        return jsonify({"error": f"format must be one of: {', '.join(formats)}"}), 400
+    chunks = bulk_io.export_chunks(fmt, query, current_app.config['BULK_EXPORT_BATCH_SIZE'], shard_keys=shard_keys,
+                                   with_shard=with_shard)
+    response = Response(stream_with_context(chunks), mimetype=formats[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+def _import_request(user_id=None):
+    """Bulk-import the request body (CSV or NDJSON, per ?format= or Content-Type)."""
+    fmt = request.args.get('format') or ('ndjson' if request.mimetype == 'application/x-ndjson' else 'csv')
+    if fmt not in bulk_io.IMPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(bulk_io.IMPORT_FORMATS)}"}), 400
+    try:
+        rows = bulk_io.parse_rows(fmt, request.stream)
+        imported = bulk_io.import_rows(rows, user_id=user_id,
+                                       batch_size=current_app.config['BULK_IMPORT_BATCH_SIZE'])
+        db.session.commit()
+        return jsonify({"message": "Food items imported successfully", "imported": imported}), 201
+    except (bulk_io.BulkImportError, UnicodeDecodeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+def _parse_food_item_filters():
+    """The admin food item filters (user_id, food_type, date_from, date_to) from the query string.
+
+    Dates are compared as timestamps (not strings) so Postgres can prune
+    partitions. Raises ValueError for dates that are not ISO 8601.
+    """
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    return {
+        'user_id': request.args.get('user_id', type=int),
+        'food_type': request.args.get('food_type'),
+        'date_from': datetime.fromisoformat(date_from) if date_from else None,
+        'date_to': datetime.fromisoformat(date_to) if date_to else None,
+    }
+
+@food_item_blueprint.route('/food-items/export', methods=['GET'])
+@token_required
+@limiter.limit('read')
+def export_food_items(current_user):
+    """Stream the current user's food log as CSV, NDJSON or Parquet."""
+    try:
+        filters = _parse_food_item_filters()
+    except ValueError:
+        return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+    filters['user_id'] = current_user.id
+    return _export_response(bulk_io.export_query(**filters), 'food-items')
+
+@food_item_blueprint.route('/food-items/import', methods=['POST'])
+@token_required
+@limiter.limit('write')
+def import_food_items(current_user):
+    """Import food items (as exported) into the current user's log; user_id columns are ignored."""
+    return _import_request(user_id=current_user.id)
+
 @food_item_blueprint.route('/food-items', methods=['DELETE'])
 def delete_all_data():
     """
-    Delete all data from the database (FoodType, FoodItem, NutritionalInformation)
+    Delete all data from the database (FoodType, FoodItem)
     ---
     responses:
       200:
@@ -457,31 +557,35 @@ def delete_all_data():
         description: Error occurred while deleting data
     """
     try:
-        # Start by deleting nutritional information
-        db.session.query(NutritionalInformation).delete()
-
-        # Then delete food items
-        db.session.query(FoodItem).delete()
+        for shard in shards.keys():
+            with shards.using(shard):
+                # Start by deleting food items (with their nutrition)
+                db.session.query(FoodItem).delete()
 
         # Finally, delete food types
+        shards.delete_replicas()
         db.session.query(FoodType).delete()
 
+        stats.reset()
+        glycemic.reset()
+
         # Commit the changes to the database
         db.session.commit()
 
         # Log the action
-        app.logger.info('All data deleted successfully')
+        current_app.logger.info('All data deleted successfully')
 
         return jsonify({"message": "All data has been deleted successfully"}), 200
 
     except Exception as e:
         # Rollback any changes if an error occurs
         db.session.rollback()
-        app.logger.error('Error deleting all data: %s', str(e), exc_info=True)
+        current_app.logger.error('Error deleting all data: %s', str(e), exc_info=True)
         return jsonify({"error": str(e)}), 500
     
 @food_item_blueprint.route('/food-items/<int:food_item_id>', methods=['DELETE'])
 @token_required
+@limiter.limit('write')
 def delete_food_item(current_user, food_item_id):
     try:
         # First, check if the food item exists and belongs to the current user
@@ -490,9 +594,12 @@ def delete_food_item(current_user, food_item_id):
         if not food_item:
             return jsonify({"error": "Food item not found or does not belong to you"}), 404
             
-        NutritionalInformation.query.filter_by(food_item_id=food_item_id).delete()
+        entry = stats.entry(food_item)
+        glycemic.invalidate([entry])
+        FoodItemImage.query.filter_by(food_item_id=food_item_id).delete()
 
         db.session.delete(food_item)
+        stats.remove_items([entry])
         db.session.commit()
         
         return jsonify({
@@ -504,54 +611,106 @@ def delete_food_item(current_user, food_item_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+@nutritional_info_blueprint.route('/glycemic-load', methods=['GET'])
+@token_required
+@limiter.limit('read')
+def get_glycemic_load(current_user):
+    """Estimated glycemic load per meal and per day (default: the last 30 days)."""
+    try:
+        today = datetime.utcnow().date()
+        date_to = request.args.get('date_to')
+        date_to = datetime.fromisoformat(date_to).date() if date_to else today
+        date_from = request.args.get('date_from')
+        date_from = datetime.fromisoformat(date_from).date() if date_from else date_to - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+    if date_from > date_to or (date_to - date_from).days >= current_app.config['GLYCEMIC_MAX_RANGE_DAYS']:
+        return jsonify({'error': 'Invalid or too long date range'}), 400
+
+    try:
+        days = glycemic.daily_glycemic_load(current_user.id, date_from, date_to)
+        total = sum(day['glycemic_load'] for day in days)
+        return jsonify({
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'meal_gap_minutes': current_app.config['GLYCEMIC_MEAL_GAP_MINUTES'],
+            'total_glycemic_load': round(total, 1),
+            'average_daily_glycemic_load': round(total / len(days), 1) if days else None,
+            'days': days,
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def encode_image(data):
+    return base64.b64encode(data).decode('utf-8')
 
 @food_image_info_blueprint.route('/analyze', methods=['POST'])
 @token_required
-def analyze_image():
+@limiter.limit('analyze')
+@analyze_concurrency
+def analyze_image(current_user):
     try:
         if 'image' not in request.files:
             return jsonify({"error": "No image provided"}), 400
-        if not os.path.exists("uploads"):
-            os.makedirs("uploads")
 
-        # Save the uploaded image file
         image_file = request.files['image']
-        image_path = os.path.join("uploads", image_file.filename)
-        image_file.save(image_path)
-
-        # Open and show the image
-        # img = Image.open(image_path)
-        # img.show()
+        image_data = image_file.read(current_app.config['IMAGE_MAX_BYTES'] + 1)
+        if len(image_data) > current_app.config['IMAGE_MAX_BYTES']:
+            return jsonify({"error": "Image is too large"}), 413
+
+        # Judged by content; a file declared as an image may be anything
+        mimetype = sniff_image_type(image_data)
+        if mimetype is None:
+            return jsonify({"error": "Unsupported image type; send a JPEG, PNG, WebP or GIF"}), 415
+
+        # Stored once per distinct image, whoever uploads it
+        image = image_store.store(image_data, current_user.id, mimetype)
+        image_id, cached = image.sha256, image.analysis
+        db.session.commit()
+        headers = {'X-Image-Id': image_id}
+        if cached is not None and current_app.config['IMAGE_ANALYSIS_CACHE']:
+            usage.record(current_user.id, image_id, len(image_data), cache_hit=True)
+            headers['X-Analysis-Cache'] = 'hit'
+            return jsonify(cached), 200, headers
+        headers['X-Analysis-Cache'] = 'miss'
+
+        # Cached analyses stay available; only new upstream calls count against the quota
+        retry_after = usage.quota_exceeded(current_user)
+        if retry_after is not None:
+            response = jsonify({"error": "Daily image analysis quota exceeded"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return response
 
         # Encode the image in base64
-        encoded_image = encode_image(image_path)
+        encoded_image = encode_image(image_data)
         og_prompt = "List the names and types of food in this image and provide their corresponding volume and nutritional information. Provide output in json format with a key 'foods' that holds the list of food objects, the fields are: name, type, volume (put unit in ml or gm beside it depending on context), count (set default value to '1'; if item is countable, show total number of items; else, if uncountable, like rice, keep default value), nutritional_info (including calories, carbs, fat and protein - mention the units). Mention each food type only once."
 
         # Send the request to OpenAI API
-        response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={ "type": "json_object" },
-        temperature = 0, 
-        seed = 5,
-        messages=[
-            {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": og_prompt},
+        client = get_openai_client()
+        with analysis_jobs.track(), usage.upstream_call(current_user.id, image_id, len(image_data)) as call:
+            response = call.response = client.chat.completions.create(
+            model="gpt-4o",
+            response_format={ "type": "json_object" },
+            temperature = 0, 
+            seed = 5,
+            messages=[
                 {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{encoded_image}",
-               },
-                },
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": og_prompt},
+                    {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mimetype};base64,{encoded_image}",
+                   },
+                    },
+                ],
+                }
             ],
-            }
-        ],
-        #   max_tokens=20,
-        )
+            #   max_tokens=20,
+            )
 
         # # Return the response from OpenAI
         # return jsonify(response.choices[0].message.content)
@@ -560,51 +719,158 @@ def analyze_image():
             result = response.choices[0].message.content
             if result is not None:
                 # print(response.choices[0].message.content)
-                return jsonify(response.choices[0].message.content)
+                image_store.save_analysis(image_id, result)
+                db.session.commit()
+                return jsonify(response.choices[0].message.content), 200, headers
             else:
                 return("No content found in the response.")
         else:
             return("Unexpected response format. Please try again.")
 
     except Exception as e:
+        db.session.rollback()
         print(f"Error: {e}")
         return jsonify({"error": "An error occurred on the server."}), 500
 
+def _send_stored_image(image_id, current_user, thumbnail):
+    if not image_store.is_visible_to(image_id, current_user):
+        return jsonify({"error": "Image not found"}), 404
+    image = db.session.get(StoredImage, image_id)
+    if thumbnail and not image.has_thumbnail:
+        return jsonify({"error": "No thumbnail for this image"}), 404
+    path = image_store.path(image_id, thumbnail=thumbnail)
+    if not os.path.exists(path):
+        return jsonify({"error": "Image not found"}), 404
+    if thumbnail:
+        mimetype = 'image/jpeg'
+    elif image.content_type in IMAGE_TYPES.values():
+        mimetype = image.content_type
+    else:
+        mimetype = 'application/octet-stream'  # stored before uploads were sniffed
+    # Content-addressed, so the bytes behind a URL never change
+    response = send_file(os.path.abspath(path), mimetype=mimetype, etag=image_id, conditional=True,
+                         max_age=365 * 24 * 3600)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@food_image_info_blueprint.route('/images/<image_id>', methods=['GET'])
+@token_required
+@limiter.limit('read')
+def get_image(current_user, image_id):
+    """The original upload (only for users who uploaded it, and admins)."""
+    return _send_stored_image(image_id, current_user, thumbnail=False)
+
+@food_image_info_blueprint.route('/images/<image_id>/thumbnail', methods=['GET'])
+@token_required
+@limiter.limit('read')
+def get_image_thumbnail(current_user, image_id):
+    """A small JPEG of the upload for list views."""
+    return _send_stored_image(image_id, current_user, thumbnail=True)
+
+def _like_prefix(value):
+    """Case-insensitive LIKE pattern for values starting with `value` (escaped with backslash)."""
+    return value.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def _user_activity(user_ids, since):
+    """Per user in `user_ids` (ids or a select of them): item count, last-logged timestamp, carbs since `since`.
+
+    Two grouped scans in one statement, both on idx_food_user_timestamp: the
+    totals read only the index, and only the recent rows' carbs come from the
+    table.
+    """
+    totals = db.select(FoodItem.user_id, db.func.count().label('item_count'),
+                       db.func.max(FoodItem.timestamp).label('last_logged_at'))\
+        .where(FoodItem.user_id.in_(user_ids)).group_by(FoodItem.user_id).subquery()
+    recent = db.select(FoodItem.user_id, db.func.sum(FoodItem.carbs).label('carbs_7d'))\
+        .where(FoodItem.user_id.in_(user_ids), FoodItem.timestamp >= since).group_by(FoodItem.user_id).subquery()
+    return db.select(totals.c.user_id, totals.c.item_count, totals.c.last_logged_at, recent.c.carbs_7d)\
+        .outerjoin(recent, recent.c.user_id == totals.c.user_id)
+
 @jwt_auth_blueprint.route('/admin/users', methods=['GET'])
 @admin_required
+@limiter.limit('read')
 def get_all_users(current_user):
+    """Users by id, `limit` at a time after `after`, with their activity.
+
+    Filters: `email` and `name` (case-insensitive prefixes; every word of
+    `name` must start the first or last name) and `role`. Pass the response's
+    `next_after` as `after` for the next page.
+    """
     try:
-        users = User.query.all()
+        after = request.args.get('after', 0, type=int)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        since = datetime.utcnow() - timedelta(days=7)
+
+        page = db.select(User.id, User.email, User.first_name, User.last_name, User.role, User.is_admin)\
+            .where(User.id > after)
+        if request.args.get('email'):
+            page = page.where(db.func.lower(User.email).like(_like_prefix(request.args['email']), escape='\\'))
+        for word in request.args.get('name', '').split():
+            pattern = _like_prefix(word)
+            page = page.where(db.or_(db.func.lower(User.first_name).like(pattern, escape='\\'),
+                                     db.func.lower(User.last_name).like(pattern, escape='\\')))
+        if request.args.get('role'):
+            page = page.where(User.role == request.args['role'])
+        page = page.order_by(User.id).limit(limit + 1)
+
+        if shards.enabled:
+            # Users are on the primary, their food items on each user's shard
+            users = db.session.execute(page).all()
+            user_shards = shards.shards_for([user.id for user in users])
+            ids = list(user_shards)
+            activity = {}
+            for key, rows in shards.scatter(lambda connection: connection.execute(_user_activity(ids, since)).all(),
+                                            keys=set(user_shards.values())):
+                activity.update((row.user_id, row) for row in rows if user_shards[row.user_id] == key)
+            rows = [(user, activity.get(user.id)) for user in users]
+        else:
+            page = page.cte('page')
+            activity = _user_activity(db.select(page.c.id), since).subquery()
+            rows = [(row, row if row.item_count is not None else None) for row in db.session.execute(
+                db.select(page, activity.c.item_count, activity.c.last_logged_at, activity.c.carbs_7d)
+                .outerjoin(activity, activity.c.user_id == page.c.id).order_by(page.c.id)
+            )]
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
         users_list = [{
             'id': user.id,
             'email': user.email,
             'first_name': user.first_name,
             'last_name': user.last_name,
             'role': user.role,
-            'is_admin': user.is_admin
-        } for user in users]
-        return jsonify({'users': users_list}), 200
+            'is_admin': user.is_admin,
+            'item_count': activity.item_count if activity else 0,
+            'last_logged_at': activity.last_logged_at if activity else None,
+            'carbs_7d': (activity.carbs_7d or 0) if activity else 0
+        } for user, activity in rows]
+        return jsonify({
+            'users': users_list,
+            'has_next': has_next,
+            'next_after': users_list[-1]['id'] if has_next else None
+        }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @jwt_auth_blueprint.route('/admin/users/<int:user_id>/food-items', methods=['GET'])
 @admin_required
+@limiter.limit('read')
 def get_user_food_items(current_user, user_id):
     try:
+        shards.route_user(user_id)
         food_items = FoodItem.query.filter_by(user_id=user_id).all()
         result = [{
             'id': food.id,
+            'shard': shards.current(),
             'name': food.name,
             'volume': food.volume,
             'food_type': food.food_type.type,
             'timestamp': food.timestamp,
             'date_uploaded': food.date_uploaded,
-            'nutrition': {
-                'calories': food.nutrition[0].calories if food.nutrition else None,
-                'carbs': food.nutrition[0].carbs if food.nutrition else None,
-                'fat': food.nutrition[0].fat if food.nutrition else None,
-                'protein': food.nutrition[0].protein if food.nutrition else None
-            }
+            'nutrition': food.nutrition
         } for food in food_items]
         return jsonify(result), 200
     except Exception as e:
@@ -612,6 +878,7 @@ def get_user_food_items(current_user, user_id):
 
 @jwt_auth_blueprint.route('/admin/make-admin/<int:user_id>', methods=['POST'])
 @admin_required
+@limiter.limit('write')
 def make_admin(current_user, user_id):
     try:
         user = User.query.get(user_id)
@@ -635,13 +902,14 @@ def verify_admin_token(token):
         if not token.startswith('Bearer '):
             return False
         token = token.split(' ')[1]
-        data = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
         current_user = User.query.get(data['id'])
         return current_user and current_user.is_super_user()
     except:
         return False
 
 @jwt_auth_blueprint.route('/setup-admin', methods=['POST'])
+@limiter.limit('auth')
 def setup_initial_admin():
     try:
         # Check if admin already exists
@@ -680,6 +948,7 @@ def setup_initial_admin():
 
 @jwt_auth_blueprint.route('/admin/all-food-items', methods=['GET'])
 @admin_required
+@limiter.limit('read')
 def get_all_users_food_items(current_user):
     try:
         # Get pagination parameters
@@ -687,31 +956,32 @@ def get_all_users_food_items(current_user):
         per_page = request.args.get('per_page', 10, type=int)
         
         # Get filter parameters
-        user_id = request.args.get('user_id', type=int)
-        food_type = request.args.get('food_type')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        try:
+            filters = _parse_food_item_filters()
+        except ValueError:
+            return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+
+        if shards.enabled:
+            return jsonify(_scattered_food_items_page(filters, page, per_page)), 200
 
         # Base query
         query = FoodItem.query\
             .join(User)\
             .join(FoodType)\
-            .outerjoin(NutritionalInformation)\
             .options(
                 db.joinedload(FoodItem.user),
-                db.joinedload(FoodItem.food_type),
-                db.joinedload(FoodItem.nutrition)
+                db.joinedload(FoodItem.food_type)
             )
 
         # Apply filters
-        if user_id:
-            query = query.filter(FoodItem.user_id == user_id)
-        if food_type:
-            query = query.filter(FoodType.type == food_type)
-        if date_from:
-            query = query.filter(FoodItem.timestamp >= date_from)
-        if date_to:
-            query = query.filter(FoodItem.timestamp <= date_to)
+        if filters['user_id']:
+            query = query.filter(FoodItem.user_id == filters['user_id'])
+        if filters['food_type']:
+            query = query.filter(FoodType.type == filters['food_type'])
+        if filters['date_from']:
+            query = query.filter(FoodItem.timestamp >= filters['date_from'])
+        if filters['date_to']:
+            query = query.filter(FoodItem.timestamp <= filters['date_to'])
 
         # Execute paginated query
         paginated_items = query.order_by(FoodItem.timestamp.desc())\
@@ -719,6 +989,7 @@ def get_all_users_food_items(current_user):
 
         result = [{
             'food_id': food.id,
+            'shard': None,
             'name': food.name,
             'volume': food.volume,
             'timestamp': food.timestamp,
@@ -728,12 +999,7 @@ def get_all_users_food_items(current_user):
                 'name': f"{food.user.first_name} {food.user.last_name}"
             },
             'food_type': food.food_type.type,
-            'nutrition': {
-                'calories': food.nutrition[0].calories if food.nutrition else None,
-                'carbs': food.nutrition[0].carbs if food.nutrition else None,
-                'fat': food.nutrition[0].fat if food.nutrition else None,
-                'protein': food.nutrition[0].protein if food.nutrition else None
-            }
+            'nutrition': food.nutrition
         } for food in paginated_items.items]
 
         return jsonify({
@@ -747,3 +1013,204 @@ def get_all_users_food_items(current_user):
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def _scattered_food_items_page(filters, page, per_page):
+    """/admin/all-food-items when sharded: the page is merged from every shard (or the filtered user's)."""
+    page, per_page = max(page, 1), max(per_page, 1)
+    keys = [shards.shard_for(filters['user_id'])] if filters['user_id'] else None
+    query = bulk_io.export_query(**filters).order_by(None).order_by(FoodItem.timestamp.desc(), FoodItem.id.desc())
+    rows, total = shards.scatter_page(query, lambda row: (row.timestamp, row.id), (page - 1) * per_page, per_page,
+                                      keys=keys, reverse=True)
+    users = {user.id: user for user in User.query.filter(User.id.in_({row.user_id for _, row in rows}))}
+    pages = -(-total // per_page)
+    return {
+        'total_items': total,
+        'current_page': page,
+        'total_pages': pages,
+        'has_next': page < pages,
+        'has_prev': page > 1,
+        'food_items': [{
+            'food_id': row.id,
+            'shard': shard,
+            'name': row.name,
+            'volume': row.volume,
+            'timestamp': row.timestamp,
+            'user': {
+                'id': row.user_id,
+                'email': users[row.user_id].email,
+                'name': f"{users[row.user_id].first_name} {users[row.user_id].last_name}"
+            } if row.user_id in users else {'id': row.user_id, 'email': None, 'name': None},
+            'food_type': row.food_type,
+            'nutrition': {n: getattr(row, n) for n in ('calories', 'carbs', 'fat', 'protein')}
+        } for shard, row in rows]
+    }
+
+@jwt_auth_blueprint.route('/admin/stats', methods=['GET'])
+@admin_required
+@limiter.limit('read')
+def get_admin_stats(current_user):
+    """Usage statistics over a date range (default: the last 30 days), served from aggregate tables."""
+    try:
+        today = datetime.utcnow().date()
+        date_to = request.args.get('date_to')
+        date_to = datetime.fromisoformat(date_to).date() if date_to else today
+        date_from = request.args.get('date_from')
+        date_from = datetime.fromisoformat(date_from).date() if date_from else date_to - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+    top = min(request.args.get('top', 10, type=int), 100)
+
+    try:
+        return jsonify(stats.summary(date_from, date_to, top)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jwt_auth_blueprint.route('/admin/analysis-usage', methods=['GET'])
+@admin_required
+@limiter.limit('read')
+def get_analysis_usage(current_user):
+    """Image analysis calls, tokens, latency and cache hits over a date range (default: the last 30 days)."""
+    try:
+        today = datetime.utcnow().date()
+        date_to = request.args.get('date_to')
+        date_to = datetime.fromisoformat(date_to).date() if date_to else today
+        date_from = request.args.get('date_from')
+        date_from = datetime.fromisoformat(date_from).date() if date_from else date_to - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+    if date_from > date_to:
+        return jsonify({'error': 'date_from must not be after date_to'}), 400
+    top = min(request.args.get('top', 10, type=int), 100)
+
+    try:
+        return jsonify(usage.report(date_from, date_to, top)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@jwt_auth_blueprint.route('/admin/food-items/export', methods=['GET'])
+@admin_required
+@limiter.limit('read')
+def export_all_users_food_items(current_user):
+    """Stream every user's food log, with the same filters as /admin/all-food-items."""
+    try:
+        filters = _parse_food_item_filters()
+    except ValueError:
+        return jsonify({'error': 'date_from/date_to must be ISO 8601 dates'}), 400
+    if filters['user_id']:
+        shards.route_user(filters['user_id'])
+        return _export_response(bulk_io.export_query(**filters), 'all-food-items', with_shard=True)
+    return _export_response(bulk_io.export_query(**filters), 'all-food-items',
+                            shard_keys=shards.keys() if shards.enabled else None, with_shard=True)
+
+@jwt_auth_blueprint.route('/admin/food-items/import', methods=['POST'])
+@admin_required
+@limiter.limit('write')
+def import_all_users_food_items(current_user):
+    """Import food items for any users; every row must carry a user_id."""
+    return _import_request()
+
+@jwt_auth_blueprint.route('/admin/profiling', methods=['POST'])
+@admin_required
+@limiter.limit('write')
+def start_profiling(current_user):
+    """Sample a fraction of live requests, optionally only some endpoints or blueprints, for `duration` seconds."""
+    if not current_app.config['PROFILING_ENABLED']:
+        return jsonify({'error': 'Profiling is disabled (PROFILING_ENABLED)'}), 409
+    data = request.get_json(silent=True) or {}
+    try:
+        duration = int(data.get('duration', 60))
+        sample_rate = float(data.get('sample_rate', 0.1))
+        interval_ms = int(data.get('interval_ms', current_app.config['PROFILING_INTERVAL_MS']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'duration, sample_rate and interval_ms must be numbers'}), 400
+    max_duration = current_app.config['PROFILING_MAX_DURATION']
+    if not 1 <= duration <= max_duration:
+        return jsonify({'error': f'duration must be between 1 and {max_duration} seconds'}), 400
+    if not 0 < sample_rate <= 1:
+        return jsonify({'error': 'sample_rate must be in (0, 1]'}), 400
+    if not 1 <= interval_ms <= 1000:
+        return jsonify({'error': 'interval_ms must be between 1 and 1000'}), 400
+    endpoints = data.get('endpoints') or None
+    if endpoints is not None:
+        if isinstance(endpoints, str):
+            endpoints = [endpoints]
+        unknown = [e for e in endpoints
+                   if not isinstance(e, str) or (e not in current_app.view_functions and e not in current_app.blueprints)]
+        if unknown:
+            return jsonify({'error': f"Unknown endpoints or blueprints: {', '.join(map(str, unknown))}"}), 400
+
+    try:
+        now = datetime.utcnow()
+        if ProfilingSession.query.filter(ProfilingSession.stopped_at.is_(None),
+                                         ProfilingSession.expires_at > now).first():
+            return jsonify({'error': 'A profiling session is already running'}), 409
+        profiling_session = ProfilingSession(created_by=current_user.id, sample_rate=sample_rate, interval_ms=interval_ms,
+                                             endpoints=','.join(endpoints) if endpoints else None,
+                                             started_at=now, expires_at=now + timedelta(seconds=duration))
+        db.session.add(profiling_session)
+        db.session.commit()
+        profiler.refresh()  # this worker starts now; the others at their next poll
+        return jsonify(profiling.session_summary(profiling_session)), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@jwt_auth_blueprint.route('/admin/profiling', methods=['GET'])
+@admin_required
+@limiter.limit('read')
+def list_profiling_sessions(current_user):
+    """Recent profiling sessions with the requests and samples collected so far."""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    try:
+        sessions = ProfilingSession.query.order_by(ProfilingSession.id.desc()).limit(limit).all()
+        return jsonify({'sessions': [profiling.session_summary(s) for s in sessions]}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jwt_auth_blueprint.route('/admin/profiling/<int:session_id>/stop', methods=['POST'])
+@admin_required
+@limiter.limit('write')
+def stop_profiling(current_user, session_id):
+    profiling_session = ProfilingSession.query.get(session_id)
+    if not profiling_session:
+        return jsonify({'error': 'Profiling session not found'}), 404
+    try:
+        if profiling_session.stopped_at is None:
+            profiling_session.stopped_at = datetime.utcnow()
+            db.session.commit()
+        profiler.refresh()
+        return jsonify(profiling.session_summary(profiling_session)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@jwt_auth_blueprint.route('/admin/profiling/<int:session_id>/profile', methods=['GET'])
+@admin_required
+@limiter.limit('read')
+def download_profile(current_user, session_id):
+    """Aggregated stacks of a session as collapsed stacks (?format=collapsed) or a pstats file (?format=pstats).
+
+    Other workers' samples arrive every PROFILING_FLUSH_SECONDS while the session runs.
+    """
+    fmt = request.args.get('format', 'collapsed')
+    if fmt not in ('collapsed', 'pstats'):
+        return jsonify({'error': 'format must be one of: collapsed, pstats'}), 400
+    profiling_session = ProfilingSession.query.get(session_id)
+    if not profiling_session:
+        return jsonify({'error': 'Profiling session not found'}), 404
+    try:
+        profiler.flush(session_id)
+        stacks = profiling.collapsed(session_id, endpoint=request.args.get('endpoint'))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    if fmt == 'pstats':
+        response = Response(profiling.pstats_bytes(stacks, profiling_session.interval_ms / 1000.0),
+                            mimetype='application/octet-stream')
+        filename = f'profile-{session_id}.prof'
+    else:
+        response = Response(stacks, mimetype='text/plain')
+        filename = f'profile-{session_id}.collapsed'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,57 @@
+#shard_routing.py
+"""Statement routing for the user-sharded tables (see sharding.py).
+
+Nothing here imports the app or the models, so app.py can build `db` with
+RoutingSession before either exists.
+"""
+import contextlib
+import contextvars
+
+import sqlalchemy as sa
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.util import find_tables
+
+# Per-user tables, stored on the user's shard. Everything else lives on the
+# primary database; food_type is also copied to each shard for joins.
+SHARDED_TABLES = frozenset({'food_item', 'food_item_image'})
+
+_UNSET = object()
+_override = contextvars.ContextVar('shard_override', default=_UNSET)
+
+
+def current_shard():
+    """Bind key sharded tables go to now: a using_shard() block, else the request's user (g.shard), else None."""
+    key = _override.get()
+    if key is not _UNSET:
+        return key
+    return g.get('shard') if has_app_context() else None
+
+
+@contextlib.contextmanager
+def using_shard(key):
+    """Route sharded tables to bind `key` (None: the primary database) inside the block."""
+    token = _override.set(key)
+    try:
+        yield
+    finally:
+        _override.reset(token)
+
+
+def _touches_sharded(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(table.name in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+    return False
+
+
+class RoutingSession(Session):
+    """Session that sends statements on SHARDED_TABLES to current_shard()'s engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            key = current_shard()
+            if key is not None and _touches_sharded(mapper, clause):
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
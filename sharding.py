@@ -0,0 +1,434 @@
+#sharding.py
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app, g
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app import db
+from models import User, FoodItem, FoodType, FoodItemImage, IdAllocator
+from shard_routing import SHARDED_TABLES, RoutingSession, current_shard, using_shard
+import glycemic
+
+_CURRENT = object()
+
+
+def parse_shard_uris(value):
+    """'name=uri,name=uri' (or a dict) -> {name: uri}, in order."""
+    if isinstance(value, dict):
+        return dict(value)
+    shards = {}
+    for part in filter(None, (p.strip() for p in (value or '').split(','))):
+        name, sep, uri = part.partition('=')
+        if not sep or not name.strip() or not uri.strip():
+            raise ValueError(f"SHARD_DATABASE_URIS entries must look like name=uri, got {part!r}")
+        shards[name.strip()] = uri.strip()
+    return shards
+
+
+def _insert(table, engine):
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _item_key(row):
+    return row['timestamp'], row['name'], row['food_type_id'], row['volume']
+
+
+def _shard_metadata():
+    """The sharded tables plus food_type, without foreign keys to tables that stay on the primary."""
+    metadata = db.MetaData()
+    tables = [db.metadata.tables[name].to_metadata(metadata) for name in sorted(SHARDED_TABLES | {'food_type'})]
+    for table in tables:
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in metadata.tables:
+                table.constraints.discard(constraint)
+                for element in constraint.elements:
+                    element.parent.foreign_keys.discard(element)
+                    table.foreign_keys.discard(element)
+    return metadata
+
+
+class Shards:
+    """Routes per-user tables to one of several databases by user.
+
+    SHARD_DATABASE_URIS names extra databases ('name=uri,...'), each added
+    as a Flask-SQLAlchemy bind. users.shard is the shard map: the bind
+    holding that user's food_item and food_item_image rows, or NULL for
+    the primary database (where data from before sharding stays until
+    moved). New users are placed on the SHARD_PLACEMENT_BINDS shard with
+    the fewest users. Requests are routed by the authenticated user
+    (g.shard, see RoutingSession); admin queries across users scatter to
+    every shard and merge. food_type stays on the primary and is copied to
+    a shard before items referring to it land there. Food item ids come
+    from one allocator on the primary, so they are unique across shards
+    and survive a move. Without SHARD_DATABASE_URIS everything uses the
+    primary.
+    """
+
+    def __init__(self, app=None):
+        # (bind, food_type_id) known to be committed on that shard
+        self._replicated = set()
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the shard binds; must run before db.init_app()."""
+        app.config.setdefault('SHARD_DATABASE_URIS', '')
+        app.config.setdefault('SHARD_PLACEMENT_BINDS', '')
+        app.config.setdefault('SHARD_MOVE_BATCH_SIZE', 1000)
+        app.config.setdefault('SHARD_MOVE_GRACE', 5.0)
+        app.config.setdefault('SHARD_SCATTER_WORKERS', 8)
+        uris = parse_shard_uris(app.config['SHARD_DATABASE_URIS'])
+        placement = [b.strip() for b in app.config['SHARD_PLACEMENT_BINDS'].split(',') if b.strip()] or list(uris)
+        unknown = set(placement) - set(uris)
+        if unknown:
+            raise ValueError(f"SHARD_PLACEMENT_BINDS names unknown shards: {', '.join(sorted(unknown))}")
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update(uris)
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.config['SHARD_BINDS'] = list(uris)
+        app.config['SHARD_PLACEMENT'] = placement
+        app.extensions['shards'] = self
+
+    @property
+    def enabled(self):
+        return bool(current_app.config['SHARD_BINDS'])
+
+    @property
+    def binds(self):
+        return current_app.config['SHARD_BINDS']
+
+    def keys(self):
+        """Every bind that can hold user data: the primary (None) and each shard."""
+        return [None] + self.binds
+
+    def engine(self, key):
+        return db.engines[key]
+
+    using = staticmethod(using_shard)
+    current = staticmethod(current_shard)
+
+    def route(self, key):
+        """Route the rest of this request's sharded queries to `key`."""
+        g.shard = key
+
+    def shard_for(self, user_id):
+        return db.session.query(User.shard).filter(User.id == user_id).scalar()
+
+    def route_user(self, user_id):
+        """Route the rest of this request to `user_id`'s shard (admin endpoints about one user)."""
+        if self.enabled:
+            self.route(self.shard_for(user_id))
+
+    def shards_for(self, user_ids):
+        """{user_id: shard} for the users that exist."""
+        return dict(db.session.query(User.id, User.shard).filter(User.id.in_(set(user_ids))).all())
+
+    def connection(self, key):
+        """The session's connection to bind `key` (part of its transaction)."""
+        return db.session.connection(bind_arguments={'bind': self.engine(key)})
+
+    def place(self, connection, pending=None):
+        """Shard for a new user: the placement shard with the fewest users (counting `pending` placements)."""
+        placement = current_app.config['SHARD_PLACEMENT']
+        counts = Counter(dict(connection.execute(
+            db.select(User.shard, db.func.count()).where(User.shard.in_(placement)).group_by(User.shard)
+        ).all()))
+        counts.update(pending or {})
+        return min(placement, key=lambda key: (counts[key], placement.index(key)))
+
+    def replicate_food_types(self, type_ids, key=_CURRENT):
+        """Copy food types from the primary to shard `key` (default: the current one) unless already there."""
+        key = current_shard() if key is _CURRENT else key
+        if key is None or not type_ids:
+            return
+        missing = {i for i in type_ids if (key, i) not in self._replicated}
+        if not missing:
+            return
+        engine = self.engine(key)
+        pending = db.session.info.setdefault('replicated_food_types', set())
+        present = set(db.session.execute(db.select(FoodType.id).where(FoodType.id.in_(missing)),
+                                         bind_arguments={'bind': engine}).scalars())
+        self._replicated.update((key, i) for i in present if (key, i) not in pending)
+        missing -= present
+        if missing:
+            rows = db.session.execute(db.select(FoodType.id, FoodType.type).where(FoodType.id.in_(missing))).all()
+            db.session.execute(_insert(FoodType.__table__, engine).on_conflict_do_nothing(),
+                               [{'id': i, 'type': t} for i, t in rows], bind_arguments={'bind': engine})
+            # Only trusted once committed (see _promote_replicated)
+            pending.update((key, i) for i, _ in rows)
+
+    def delete_replicas(self):
+        """Remove the food_type copies from every shard (after their items are gone)."""
+        for key in self.binds:
+            db.session.execute(db.delete(FoodType.__table__), bind_arguments={'bind': self.engine(key)})
+        self._replicated.clear()
+
+    def allocate_item_ids(self, count):
+        """`count` new food_item ids, unique across every shard.
+
+        On Postgres they come from the primary's food_item_id_seq (outside
+        any transaction, like nextval always is). Elsewhere an id_allocator
+        row on the primary is advanced in the session's transaction.
+        """
+        if not count:
+            return []
+        engine = self.engine(None)
+        if engine.dialect.name == 'postgresql':
+            with engine.connect() as connection:
+                return connection.execute(db.text("SELECT nextval('food_item_id_seq') FROM generate_series(1, :n)"),
+                                          {'n': count}).scalars().all()
+        table = IdAllocator.__table__
+        advance = db.update(table).where(table.c.name == 'food_item')\
+            .values(next_id=table.c.next_id + count).returning(table.c.next_id)
+        end = db.session.execute(advance, bind_arguments={'bind': engine}).scalar()
+        if end is None:
+            self.sync_item_ids()
+            end = db.session.execute(advance, bind_arguments={'bind': engine}).scalar()
+        return list(range(end - count, end))
+
+    def sync_item_ids(self):
+        """Move the id allocator past the highest food_item id on any shard (ids from before sharding)."""
+        highest = max((result or 0) for _, result in self.scatter(
+            lambda connection: connection.execute(db.select(db.func.max(FoodItem.__table__.c.id))).scalar()))
+        engine = self.engine(None)
+        if engine.dialect.name == 'postgresql':
+            db.session.execute(db.text(
+                "SELECT setval('food_item_id_seq', greatest(:highest, (SELECT last_value FROM food_item_id_seq)))"
+            ), {'highest': max(highest, 1)}, bind_arguments={'bind': engine})
+            return
+        table = IdAllocator.__table__
+        statement = _insert(table, engine).values(name='food_item', next_id=highest + 1)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['name'], set_={'next_id': db.func.max(table.c.next_id, statement.excluded.next_id)}
+        ), bind_arguments={'bind': engine})
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=current_app.config['SHARD_SCATTER_WORKERS'],
+                                                        thread_name_prefix='shard-scatter')
+        return self._executor
+
+    def scatter(self, fn, keys=None):
+        """Call fn(connection) on every shard (or `keys`) in parallel; returns [(key, result)] in order.
+
+        Each call gets its own read connection, outside the session's
+        transaction, so it doesn't see the session's uncommitted writes.
+        """
+        keys = self.keys() if keys is None else list(keys)
+        engines = [self.engine(key) for key in keys]
+
+        def run(engine):
+            with engine.connect() as connection:
+                return fn(connection)
+
+        if len(engines) == 1:
+            return [(keys[0], run(engines[0]))]
+        return list(zip(keys, self._pool().map(run, engines)))
+
+    def scatter_page(self, query, order_key, offset, limit, keys=None, reverse=False):
+        """One page of `query` across shards, as ([(shard, row)], total).
+
+        Each shard returns its first offset + limit rows in `query`'s order
+        (which `order_key` must reproduce) and its count; the sorted lists
+        are merged and the page sliced out, so deep pages cost more. Rows
+        come with their shard, since ids are only unique within one.
+        """
+        page = query.limit(offset + limit)
+        count = db.select(db.func.count()).select_from(query.order_by(None).subquery())
+        results = self.scatter(
+            lambda connection: (connection.execute(page).all(), connection.execute(count).scalar()), keys)
+        merged = heapq.merge(*([(key, row) for row in rows] for key, (rows, _) in results),
+                             key=lambda pair: order_key(pair[1]), reverse=reverse)
+        return list(itertools.islice(merged, offset, offset + limit)), sum(total for _, (_, total) in results)
+
+    def create_tables(self):
+        """Create the sharded tables (and food_type) on every shard that lacks them, and copy food types."""
+        if not self.enabled:
+            return
+        metadata = _shard_metadata()
+        type_ids = set(db.session.execute(db.select(FoodType.id)).scalars())
+        for key in self.binds:
+            metadata.create_all(self.engine(key))
+            self.replicate_food_types(type_ids, key)
+        self.sync_item_ids()
+        db.session.commit()
+
+    def move_user(self, user_id, target, source=_CURRENT, batch_size=None, grace=None):
+        """Move a user's food log to bind `target` (None: the primary); returns the number of items moved.
+
+        users.shard is switched first, so new writes go to the target; after
+        `grace` seconds (for requests still routed to the source) the items
+        are copied in id batches, each committed on the target before it is
+        deleted from the source. Items keep their ids, except one whose id
+        the target already uses for another item (possible only for items
+        from before ids were allocated centrally), which gets a new id. Rows
+        an interrupted run already copied are recognised and not copied
+        again; to resume, pass the old shard as `source`.
+        """
+        config = current_app.config
+        batch_size = batch_size or config['SHARD_MOVE_BATCH_SIZE']
+        grace = config['SHARD_MOVE_GRACE'] if grace is None else grace
+        if target is not None and target not in self.binds:
+            raise ValueError(f"Unknown shard: {target}")
+        user = db.session.get(User, user_id)
+        if user is None:
+            raise ValueError(f"Unknown user: {user_id}")
+        if source is _CURRENT:
+            source = user.shard
+        elif source is not None and source not in self.binds:
+            raise ValueError(f"Unknown shard: {source}")
+        if source == target:
+            return 0
+
+        if user.shard != target:
+            user.shard = target
+            db.session.commit()
+            time.sleep(grace)
+
+        items, links = FoodItem.__table__, FoodItemImage.__table__
+        src, dst = self.engine(source), self.engine(target)
+
+        def on(engine, statement, params=None):
+            return db.session.execute(statement, params, bind_arguments={'bind': engine})
+
+        moved = 0
+        # Target rows already matched to a source row by this run (copied or found copied)
+        matched = Counter()
+        while True:
+            batch = on(src, db.select(items).where(items.c.user_id == user_id)
+                       .order_by(items.c.id).limit(batch_size)).mappings().all()
+            if not batch:
+                break
+            ids = [row['id'] for row in batch]
+            link_rows = on(src, db.select(links).where(links.c.food_item_id.in_(ids))).mappings().all()
+
+            # Left on the target by a run that stopped before deleting from the source
+            copied = Counter(_item_key(row) for row in on(dst, db.select(
+                items.c.timestamp, items.c.name, items.c.food_type_id, items.c.volume
+            ).where(items.c.user_id == user_id,
+                    items.c.timestamp.between(min(r['timestamp'] for r in batch),
+                                              max(r['timestamp'] for r in batch)))).mappings()) - matched
+            to_copy = []
+            for row in batch:
+                if copied[_item_key(row)]:
+                    copied[_item_key(row)] -= 1
+                else:
+                    to_copy.append(row)
+            matched.update(_item_key(row) for row in batch)
+
+            if to_copy:
+                self.replicate_food_types({row['food_type_id'] for row in to_copy}, target)
+                taken = set(on(dst, db.select(items.c.id).where(
+                    items.c.id.in_([row['id'] for row in to_copy]))).scalars())
+                fresh = iter(self.allocate_item_ids(len(taken)))
+                id_map = {row['id']: next(fresh) if row['id'] in taken else row['id'] for row in to_copy}
+                on(dst, db.insert(items), [dict(row, id=id_map[row['id']]) for row in to_copy])
+                moved_links = [dict(row, food_item_id=id_map[row['food_item_id']])
+                               for row in link_rows if row['food_item_id'] in id_map]
+                if moved_links:
+                    on(dst, db.insert(links), moved_links)
+            db.session.commit()
+
+            on(src, db.delete(links).where(links.c.food_item_id.in_(ids)))
+            on(src, db.delete(items).where(items.c.id.in_(ids), items.c.user_id == user_id))
+            db.session.commit()
+            moved += len(to_copy)
+            current_app.logger.info("Moving user %s to %s: %d item(s) moved", user_id, target or 'default', moved)
+
+        # Days may have been cached while only part of the log had arrived
+        glycemic.invalidate_user(user_id)
+        db.session.commit()
+        return moved
+
+
+shards = Shards()
+
+
+@event.listens_for(User, 'before_insert')
+def _place_user(mapper, connection, user):
+    if user.shard is None and shards.enabled:
+        # Users inserted by the same flush aren't in the table yet
+        pending = object_session(user).info.setdefault('shard_placements', Counter())
+        user.shard = shards.place(connection, pending)
+        pending[user.shard] += 1
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _allocate_item_ids(session, flush_context, instances):
+    if not shards.enabled:
+        return
+    # A shard's own autoincrement would repeat ids used on other shards
+    new = [obj for obj in session.new if isinstance(obj, FoodItem) and obj.id is None]
+    for obj, item_id in zip(new, shards.allocate_item_ids(len(new))):
+        obj.id = item_id
+
+
+@event.listens_for(RoutingSession, 'after_flush_postexec')
+def _forget_placements(session, flush_context):
+    session.info.pop('shard_placements', None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _promote_replicated(session):
+    shards._replicated.update(session.info.pop('replicated_food_types', ()))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_replicated(session):
+    session.info.pop('replicated_food_types', None)
+
+
+def _bind_name(value):
+    return None if value in (None, '', 'default') else value
+
+
+shards_cli = AppGroup('shards', help='Manage user shards.')
+
+
+@shards_cli.command('init')
+def init_command():
+    """Create the per-user tables on every shard and copy the food types."""
+    if not shards.enabled:
+        click.echo("Sharding is disabled (SHARD_DATABASE_URIS is empty).")
+        return
+    shards.create_tables()
+    click.echo(f"Initialised {len(shards.binds)} shard(s): {', '.join(shards.binds)}")
+
+
+@shards_cli.command('status')
+def status_command():
+    """Users and food items per shard."""
+    users = dict(db.session.query(User.shard, db.func.count()).group_by(User.shard).all())
+    items = dict(shards.scatter(
+        lambda connection: connection.execute(db.select(db.func.count()).select_from(FoodItem.__table__)).scalar()))
+    for key in shards.keys():
+        click.echo(f"{key or 'default'}: {users.get(key, 0)} user(s), {items[key]} food item(s)")
+
+
+@shards_cli.command('move-user')
+@click.argument('user_id', type=int)
+@click.argument('target')
+@click.option('--from', 'source', default=None, help="Shard to drain when resuming an interrupted move.")
+@click.option('--batch-size', type=int, default=None, help='Defaults to SHARD_MOVE_BATCH_SIZE.')
+@click.option('--grace', type=float, default=None, help='Defaults to SHARD_MOVE_GRACE (seconds).')
+def move_user_command(user_id, target, source, batch_size, grace):
+    """Move USER_ID's food log to TARGET (a shard name, or 'default' for the primary)."""
+    source = _CURRENT if source is None else _bind_name(source)
+    moved = shards.move_user(user_id, _bind_name(target), source=source, batch_size=batch_size, grace=grace)
+    click.echo(f"Moved {moved} food item(s) of user {user_id} to {target}.")
@@ -0,0 +1,277 @@
+#stats.py
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from sharding import shards
+from models import DailyStats, DailyFoodTypeStats, DailyFoodStats, DailyUserActivity, FoodItem, FoodType
+
+_NUTRIENTS = ('calories', 'carbs', 'fat', 'protein')
+_COUNTERS = ('active_users', 'meals', 'items') + _NUTRIENTS
+_LOOKUP_BATCH = 500
+
+
+def entry(food_item):
+    """Describe a food item for record_items/remove_items."""
+    return {
+        'user_id': food_item.user_id,
+        'timestamp': food_item.timestamp,
+        'food_type_id': food_item.food_type_id,
+        'name': food_item.name,
+        **{nutrient: getattr(food_item, nutrient) for nutrient in _NUTRIENTS},
+    }
+
+
+def _insert(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Aggregate upserts are not implemented for {dialect}")
+    return insert(table)
+
+
+def _increment(model, rows, counters):
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key],
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+    )
+    db.session.execute(stmt, rows)
+
+
+def _by_shard(user_ids):
+    """{shard: user ids} for the databases the users' food items live on."""
+    if not shards.enabled:
+        return {None: set(user_ids)}
+    groups = defaultdict(set)
+    for user_id, key in shards.shards_for(user_ids).items():
+        groups[key].add(user_id)
+    return groups
+
+
+def _meal_sizes(meals):
+    """{(user_id, timestamp): items now in food_item} for the given meals; missing when none are left."""
+    sizes = {}
+    for key, user_ids in _by_shard({user_id for user_id, _ in meals}).items():
+        keys = [meal for meal in meals if meal[0] in user_ids]
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            rows = shards.connection(key).execute(
+                db.select(FoodItem.user_id, FoodItem.timestamp, db.func.count())
+                .where(db.tuple_(FoodItem.user_id, FoodItem.timestamp).in_(keys[start:start + _LOOKUP_BATCH]))
+                .group_by(FoodItem.user_id, FoodItem.timestamp)
+            )
+            sizes.update(((user_id, timestamp), n) for user_id, timestamp, n in rows)
+    return sizes
+
+
+def _active_days(user_days):
+    """The (day, user_id) pairs on which the user still has food items."""
+    active = set()
+    for key, user_ids in _by_shard({user_id for _, user_id in user_days}).items():
+        connection = shards.connection(key)
+        for day, user_id in user_days:
+            if user_id in user_ids and connection.execute(db.select(db.exists().where(
+                    FoodItem.user_id == user_id,
+                    FoodItem.timestamp >= datetime.combine(day, datetime.min.time()),
+                    FoodItem.timestamp < datetime.combine(day + timedelta(days=1), datetime.min.time()),
+            ))).scalar():
+                active.add((day, user_id))
+    return active
+
+
+def _apply(entries, sign):
+    slots = current_app.config['STATS_COUNTER_SLOTS']
+    per_day = defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+    per_type = defaultdict(int)
+    per_food = defaultdict(int)
+    meals = defaultdict(int)
+
+    for e in entries:
+        day = e['timestamp'].date()
+        slot = e['user_id'] % slots
+        totals = per_day[(day, slot)]
+        totals['items'] += sign
+        for nutrient in _NUTRIENTS:
+            totals[nutrient] += sign * (e[nutrient] or 0)
+        per_type[(day, e['food_type_id'], slot)] += sign
+        per_food[(day, e['name'].strip().lower(), slot)] += sign
+        meals[(e['user_id'], e['timestamp'])] += 1
+
+    # Items logged together (same user and timestamp) form one meal. It is counted when
+    # these entries are all of its items, and taken back when none of its items are left.
+    # The session's pending items have to be in food_item for that.
+    db.session.flush()
+    sizes = _meal_sizes(list(meals))
+    user_days = set()
+    for (user_id, timestamp), n in meals.items():
+        if sizes.get((user_id, timestamp), 0) == (n if sign > 0 else 0):
+            per_day[(timestamp.date(), user_id % slots)]['meals'] += sign
+            user_days.add((timestamp.date(), user_id))
+
+    if sign > 0:
+        # A user counts as active on a day the first time they log something
+        for day, user_id in user_days:
+            stmt = _insert(DailyUserActivity.__table__).on_conflict_do_nothing()
+            if db.session.execute(stmt, {'day': day, 'user_id': user_id}).rowcount:
+                per_day[(day, user_id % slots)]['active_users'] += 1
+    else:
+        # ...and stops counting when their last item of the day is gone
+        for day, user_id in user_days - _active_days(user_days):
+            if db.session.query(DailyUserActivity).filter_by(day=day, user_id=user_id).delete():
+                per_day[(day, user_id % slots)]['active_users'] -= 1
+
+    _increment(DailyStats, [
+        dict(day=day, slot=slot, **totals) for (day, slot), totals in per_day.items()
+    ], _COUNTERS)
+    _increment(DailyFoodTypeStats, [
+        {'day': day, 'food_type_id': type_id, 'slot': slot, 'items': n} for (day, type_id, slot), n in per_type.items()
+    ], ('items',))
+    _increment(DailyFoodStats, [
+        {'day': day, 'name': name, 'slot': slot, 'items': n} for (day, name, slot), n in per_food.items()
+    ], ('items',))
+
+
+def record_items(entries):
+    """Add newly logged food items to the aggregates, in the caller's transaction.
+
+    Call once the items are added to food_item (flushed or not).
+    """
+    _apply(entries, 1)
+
+
+def remove_items(entries):
+    """Take deleted food items back out of the aggregates, in the caller's transaction.
+
+    Call once the items are deleted from food_item (flushed or not).
+    """
+    _apply(entries, -1)
+
+
+def reset():
+    for model in (DailyStats, DailyFoodTypeStats, DailyFoodStats, DailyUserActivity):
+        db.session.query(model).delete()
+
+
+def summary(date_from, date_to, top=10):
+    """Admin dashboard figures for days in [date_from, date_to], read only from the aggregates."""
+    def in_range(model):
+        return model.day.between(date_from, date_to)
+
+    days = db.session.query(
+        DailyStats.day,
+        db.func.sum(DailyStats.active_users),
+        db.func.sum(DailyStats.meals),
+        db.func.sum(DailyStats.items),
+    ).filter(in_range(DailyStats)).group_by(DailyStats.day).order_by(DailyStats.day).all()
+
+    totals = db.session.query(
+        db.func.sum(DailyStats.meals), *(db.func.sum(getattr(DailyStats, n)) for n in _NUTRIENTS)
+    ).filter(in_range(DailyStats)).one()
+    meals = totals[0] or 0
+
+    types = db.session.query(FoodType.type, db.func.sum(DailyFoodTypeStats.items).label('items'))\
+        .join(FoodType, FoodType.id == DailyFoodTypeStats.food_type_id)\
+        .filter(in_range(DailyFoodTypeStats))\
+        .group_by(FoodType.type)\
+        .having(db.func.sum(DailyFoodTypeStats.items) > 0)\
+        .order_by(db.desc('items')).all()
+
+    foods = db.session.query(DailyFoodStats.name, db.func.sum(DailyFoodStats.items).label('items'))\
+        .filter(in_range(DailyFoodStats))\
+        .group_by(DailyFoodStats.name)\
+        .having(db.func.sum(DailyFoodStats.items) > 0)\
+        .order_by(db.desc('items')).limit(top).all()
+
+    return {
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'active_users_per_day': [
+            {'day': day.isoformat(), 'active_users': int(users), 'meals': int(day_meals), 'items': int(items)}
+            for day, users, day_meals, items in days
+        ],
+        'items_per_food_type': [{'food_type': t, 'items': int(n)} for t, n in types],
+        'average_nutrition_per_meal': {
+            n: (totals[i + 1] or 0) / meals if meals else None for i, n in enumerate(_NUTRIENTS)
+        },
+        'total_meals': int(meals),
+        'top_foods': [{'name': name, 'items': int(n)} for name, n in foods],
+    }
+
+
+def _day(value):
+    # SQLite hands back date() results as text
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _rebuild_queries(dialect):
+    """(model, columns, SELECT) computing each aggregate table from one database's food_item."""
+    day = "date(f.timestamp)" if dialect == 'sqlite' else "CAST(f.timestamp AS DATE)"
+    slots = int(current_app.config['STATS_COUNTER_SLOTS'])
+    return [
+        (DailyUserActivity, ('day', 'user_id'), f"""
+            SELECT DISTINCT {day}, f.user_id FROM food_item f
+        """),
+        (DailyStats, ('day', 'slot', 'active_users', 'meals', 'items') + _NUTRIENTS, f"""
+            SELECT day, slot, COUNT(DISTINCT user_id), COUNT(*), SUM(items),
+                   SUM(calories), SUM(carbs), SUM(fat), SUM(protein)
+            FROM (
+                SELECT {day} AS day, f.user_id % {slots} AS slot, f.user_id, f.timestamp, COUNT(*) AS items,
+                       SUM(COALESCE(f.calories, 0)) AS calories, SUM(COALESCE(f.carbs, 0)) AS carbs,
+                       SUM(COALESCE(f.fat, 0)) AS fat, SUM(COALESCE(f.protein, 0)) AS protein
+                FROM food_item f
+                GROUP BY {day}, f.user_id, f.timestamp
+            ) meals
+            GROUP BY day, slot
+        """),
+        (DailyFoodTypeStats, ('day', 'food_type_id', 'slot', 'items'), f"""
+            SELECT {day}, f.food_type_id, f.user_id % {slots}, COUNT(*)
+            FROM food_item f GROUP BY {day}, f.food_type_id, f.user_id % {slots}
+        """),
+        (DailyFoodStats, ('day', 'name', 'slot', 'items'), f"""
+            SELECT {day}, LOWER(TRIM(f.name)), f.user_id % {slots}, COUNT(*)
+            FROM food_item f GROUP BY {day}, LOWER(TRIM(f.name)), f.user_id % {slots}
+        """),
+    ]
+
+
+def rebuild():
+    """Recompute every aggregate from food_item (for backfills or after manual data fixes)."""
+    reset()
+    if not shards.enabled:
+        for model, columns, select in _rebuild_queries(db.session.get_bind().dialect.name):
+            db.session.execute(db.text(f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) {select}"))
+        db.session.commit()
+        return
+
+    # Sharded: aggregate on each shard and add the (small) results up on the primary.
+    # A user's items are all on one shard, so per-shard distinct user counts just add.
+    for key in shards.keys():
+        connection = shards.connection(key)
+        for model, columns, select in _rebuild_queries(connection.dialect.name):
+            rows = [dict(zip(columns, row), day=_day(row[0])) for row in connection.execute(db.text(select))]
+            if model is DailyUserActivity:
+                if rows:
+                    db.session.execute(_insert(model.__table__).on_conflict_do_nothing(), rows)
+            else:
+                _increment(model, rows, [c for c in columns if c in _COUNTERS])
+    db.session.commit()
+
+
+stats_cli = AppGroup('stats', help='Maintain the admin statistics aggregates.')
+
+
+@stats_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the statistics aggregates from food_item."""
+    rebuild()
+    click.echo("Statistics aggregates rebuilt.")
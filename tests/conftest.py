@@ -0,0 +1,52 @@
+import pytest
+from flask import current_app
+
+from app import create_app, db
+from config import TestingConfig
+from sharding import shards
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build a testing app on its own SQLite file, with config overrides.
+
+    A file rather than :memory: so background threads get their own connections.
+    """
+    apps = []
+
+    def make(**overrides):
+        overrides.setdefault('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / f'app{len(apps)}.db'}")
+        app = create_app(type('Config', (TestingConfig,), overrides))
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+    # init_app registers a metadata per bind on the shared `db`; the next app may not have those binds
+    for key in [k for k in db.metadatas if k is not None]:
+        del db.metadatas[key]
+    # Food types known to be on a shard refer to this test's databases
+    shards._replicated.clear()
+
+
+@pytest.fixture
+def make_user():
+    """Create a user in the current app context and return (user, Authorization header)."""
+    from models import User
+    from routes import generate_tokens
+
+    def make(email='user@test.io', admin=False):
+        if admin:
+            user = User.create_admin_user(email, 'unused', 'Test', 'Admin')
+        else:
+            user = User(first_name='Test', last_name='User', email=email, password='unused')
+        db.session.add(user)
+        db.session.commit()
+        with current_app.test_request_context():
+            token, _ = generate_tokens(user)
+        return user, {'Authorization': f'Bearer {token}'}
+
+    return make
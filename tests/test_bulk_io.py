@@ -0,0 +1,65 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import bulk_io
+from app import db
+from models import FoodItem, FoodType
+
+
+def test_admin_import_rejects_unknown_user(make_app, make_user):
+    app = make_app()
+    with app.app_context():
+        user, _ = make_user()
+        _, admin_headers = make_user('admin@test.io', admin=True)
+        body = ('user_id,name,food_type,carbs\n'
+                f'{user.id},Apple,Fruit,14\n'
+                '9999,Rice,Grain,42\n')
+        response = app.test_client().post('/auth-user/admin/food-items/import', data=body,
+                                          content_type='text/csv', headers=admin_headers)
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'row 2: unknown user_id 9999'
+        assert FoodItem.query.count() == 0
+
+
+def test_import_rejects_over_length_values(make_app, make_user):
+    app = make_app()
+    with app.app_context():
+        _, headers = make_user()
+        body = ('name,food_type,carbs\n'
+                'Apple,Fruit,14\n'
+                f"{'x' * 101},Grain,42\n")
+        response = app.test_client().post('/food-items/food-items/import', data=body, content_type='text/csv',
+                                          headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'row 2: name is longer than 100 characters'
+        assert FoodItem.query.count() == 0
+
+
+@pytest.mark.skipif(not os.getenv('TEST_POSTGRES_URI'), reason='set TEST_POSTGRES_URI to test COPY exports')
+def test_copy_export_matches_python_csv(make_app, make_user):
+    app = make_app(SQLALCHEMY_DATABASE_URI=os.environ['TEST_POSTGRES_URI'])
+    with app.app_context():
+        try:
+            user, _ = make_user()
+            food_type = FoodType(type='Fruit')
+            db.session.add(food_type)
+            db.session.flush()
+            bulk_io.insert_items([
+                {'name': 'Apple, red', 'volume': 100.0, 'food_type_id': food_type.id, 'user_id': user.id,
+                 'timestamp': datetime(2026, 1, 1, 12), 'date_uploaded': datetime(2026, 1, 1, 12, 0, 1, 250),
+                 'calories': 52.0, 'carbs': 13.8, 'fat': 0.2, 'protein': None},
+                {'name': 'Pear "Conference"', 'volume': None, 'food_type_id': food_type.id, 'user_id': user.id,
+                 'timestamp': datetime(2026, 1, 2, 8, 30, 15, 123456), 'date_uploaded': None,
+                 'calories': 57.5, 'carbs': 15.0, 'fat': 0.1, 'protein': 0.4},
+            ])
+            db.session.commit()
+            query = bulk_io.export_query(user_id=user.id)
+            copied = b''.join(bulk_io._pg_copy_csv_chunks(query)).decode()
+            written = ''.join(bulk_io._csv_chunks(query, batch_size=1))
+            assert copied == written
+            assert '2026-01-01T12:00:01.000250' in copied
+        finally:
+            db.session.rollback()
+            db.drop_all()
@@ -0,0 +1,87 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from flask import Response, jsonify
+
+import compression
+
+BIG = [{'name': f'Apple {n}', 'carbs': 14} for n in range(200)]
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(COMPRESS_MIN_SIZE=1024)
+    produced = []
+    app.produced = produced
+
+    @app.route('/test/big')
+    def big():
+        return jsonify(BIG)
+
+    @app.route('/test/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/test/stream')
+    def stream():
+        def rows():
+            for n in range(3):
+                produced.append(n)
+                yield f'{{"row": {n}}}\n'
+        return Response(rows(), mimetype='application/x-ndjson')
+
+    return app
+
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip', 'gzip'),
+    ('gzip, deflate', 'gzip'),
+    ('*', 'gzip'),
+    ('identity', None),
+    ('gzip;q=0', None),
+    ('', None),
+])
+def test_encoding_is_negotiated(app, accept, expected):
+    response = app.test_client().get('/test/big', headers={'Accept-Encoding': accept})
+    assert response.headers.get('Content-Encoding') == expected
+    assert 'Accept-Encoding' in response.vary
+    body = gzip.decompress(response.data) if expected else response.data
+    assert json.loads(body) == BIG
+
+
+def test_server_preference_breaks_ties(app, monkeypatch):
+    # A stand-in second coding, so the choice doesn't depend on brotli being installed
+    monkeypatch.setattr(compression, 'available_encodings',
+                        lambda: {'gzip': compression._GzipStream, 'br': compression._GzipStream})
+    client = app.test_client()
+    assert client.get('/test/big', headers={'Accept-Encoding': 'gzip, br'}).headers['Content-Encoding'] == 'br'
+    assert client.get('/test/big', headers={'Accept-Encoding': 'br;q=0.5, gzip'}).headers['Content-Encoding'] == 'gzip'
+
+
+def test_responses_below_min_size_are_not_compressed(app):
+    client = app.test_client()
+    small = client.get('/test/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert 'Accept-Encoding' in small.vary
+    assert small.get_json() == {'ok': True}
+
+    app.config['COMPRESS_MIN_SIZE'] = 10
+    assert client.get('/test/small', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+
+
+def test_streamed_response_is_flushed_per_chunk(app):
+    response = app.test_client().get('/test/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+    decompressor = zlib.decompressobj(31)
+    received, progress = '', []
+    for piece in response.response:
+        received += decompressor.decompress(piece).decode()
+        progress.append((len(app.produced), received.count('\n')))
+    assert decompressor.eof
+    # Each row could be read as soon as it was produced, before the next one was
+    assert progress[:3] == [(1, 1), (2, 2), (3, 3)]
+    assert received == ''.join(f'{{"row": {n}}}\n' for n in range(3))
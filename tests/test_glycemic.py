@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import current_app
+
+import glycemic
+from app import db
+from models import DailyGlycemicLoad, FoodItem, FoodType
+
+
+@pytest.fixture
+def user_id(make_app, make_user):
+    app = make_app()
+    with app.app_context():
+        user, _ = make_user()
+        yield user.id
+
+
+def _log(user_id, *timestamps):
+    food_type = FoodType.query.filter_by(type='Grain').first() or FoodType(type='Grain')
+    db.session.add(food_type)
+    db.session.flush()
+    items = [FoodItem(name='Rice', food_type_id=food_type.id, user_id=user_id, timestamp=t, date_uploaded=t, carbs=40)
+             for t in timestamps]
+    db.session.add_all(items)
+    glycemic.invalidate([{'user_id': user_id, 'timestamp': t} for t in timestamps])
+    db.session.commit()
+
+
+def _cached_days(user_id):
+    return DailyGlycemicLoad.query.filter_by(user_id=user_id).count()
+
+
+def test_day_changed_during_computation_is_not_cached(user_id, monkeypatch):
+    day = datetime.utcnow().date() - timedelta(days=2)
+    noon = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+    _log(user_id, noon)
+    load_rows = glycemic._load_rows
+
+    def load_then_change(*args):
+        rows = load_rows(*args)
+        _log(user_id, noon + timedelta(hours=3))  # lands after the rows were read
+        return rows
+
+    monkeypatch.setattr(glycemic, '_load_rows', load_then_change)
+    assert len(glycemic.daily_glycemic_load(user_id, day, day)[0]['meals']) == 1
+    assert _cached_days(user_id) == 0
+
+    monkeypatch.setattr(glycemic, '_load_rows', load_rows)
+    assert len(glycemic.daily_glycemic_load(user_id, day, day)[0]['meals']) == 2
+    assert _cached_days(user_id) == 1
+
+
+def test_cache_follows_meal_gap(user_id):
+    day = datetime.utcnow().date() - timedelta(days=2)
+    noon = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+    _log(user_id, noon, noon + timedelta(minutes=20))
+    config = current_app.config
+
+    config['GLYCEMIC_MEAL_GAP_MINUTES'] = 30
+    assert len(glycemic.daily_glycemic_load(user_id, day, day)[0]['meals']) == 1
+    config['GLYCEMIC_MEAL_GAP_MINUTES'] = 10
+    assert len(glycemic.daily_glycemic_load(user_id, day, day)[0]['meals']) == 2
+    assert _cached_days(user_id) == 1
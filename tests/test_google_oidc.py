@@ -0,0 +1,126 @@
+import types
+
+import jwt
+import pytest
+import requests
+
+import google_oidc
+import routes
+from benchmarks.stubs import StubOIDCIssuer
+
+CLIENT_ID = 'glucocheck-test'
+MIN_REFRESH = 60
+
+
+@pytest.fixture
+def issuer():
+    with StubOIDCIssuer(CLIENT_ID, max_age=300) as issuer:
+        yield issuer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the cache expiry reads, advanced by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(google_oidc, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def app(make_app, issuer, clock):
+    google_oidc.google_oidc.clear()
+    app = make_app(GOOGLE_CLIENT_ID=CLIENT_ID, GOOGLE_DISCOVERY_URL=issuer.discovery_url,
+                   GOOGLE_JWKS_MIN_REFRESH=MIN_REFRESH)
+    with app.app_context():
+        yield app
+    google_oidc.google_oidc.clear()
+
+
+def _verify(token):
+    return google_oidc.google_oidc.verify(token)
+
+
+def _signed(issuer, kid):
+    """A token from `issuer` signed with its current key but naming `kid` in the header."""
+    payload = jwt.decode(issuer.id_token('alice@test.io'), options={'verify_signature': False})
+    return jwt.encode(payload, issuer.keys[issuer.kid][0], algorithm='RS256', headers={'kid': kid})
+
+
+def test_valid_token_is_accepted(app, issuer):
+    claims = _verify(issuer.id_token('alice@test.io'))
+    assert claims['email'] == 'alice@test.io'
+
+
+@pytest.mark.parametrize('claims, error', [
+    ({'aud': 'someone-else'}, jwt.InvalidAudienceError),
+    ({'iss': 'https://accounts.example.com'}, jwt.InvalidIssuerError),
+    ({'lifetime': -3600}, jwt.ExpiredSignatureError),
+    ({'email_verified': False}, jwt.InvalidTokenError),
+])
+def test_bad_claims_are_rejected(app, issuer, claims, error):
+    with pytest.raises(error):
+        _verify(issuer.id_token('alice@test.io', **claims))
+
+
+def test_bad_signature_is_rejected(app, issuer):
+    first = issuer.kid
+    issuer.rotate()
+    with pytest.raises(jwt.InvalidSignatureError):
+        _verify(_signed(issuer, first))
+
+
+def test_unknown_kid_refreshes_once_per_interval(app, issuer, clock):
+    _verify(issuer.id_token('alice@test.io'))
+    assert issuer.hits['/certs'] == 1
+
+    # A rotated key is picked up by one refresh
+    issuer.rotate()
+    _verify(issuer.id_token('alice@test.io'))
+    assert issuer.hits['/certs'] == 2
+
+    # Made-up key ids don't refetch until the interval has passed
+    for _ in range(3):
+        with pytest.raises(jwt.InvalidTokenError, match='Unknown signing key'):
+            _verify(_signed(issuer, 'made-up'))
+    assert issuer.hits['/certs'] == 2
+
+    clock[0] += MIN_REFRESH
+    with pytest.raises(jwt.InvalidTokenError, match='Unknown signing key'):
+        _verify(_signed(issuer, 'made-up'))
+    assert issuer.hits['/certs'] == 3
+
+
+def test_cache_control_max_age_is_honored(app, issuer, clock):
+    for _ in range(3):
+        _verify(issuer.id_token('alice@test.io'))
+    assert issuer.hits == {'/.well-known/openid-configuration': 1, '/certs': 1}
+
+    clock[0] += issuer.max_age - 1
+    _verify(issuer.id_token('alice@test.io'))
+    assert issuer.hits['/certs'] == 1
+
+    clock[0] += 1
+    _verify(issuer.id_token('alice@test.io'))
+    assert issuer.hits == {'/.well-known/openid-configuration': 2, '/certs': 2}
+
+
+def test_userinfo_is_used_when_keys_are_unavailable(app, issuer, make_user, monkeypatch):
+    make_user('bob@test.io')
+    app.config['GOOGLE_DISCOVERY_URL'] = f"{issuer.issuer}/missing"
+    with pytest.raises(requests.RequestException):
+        _verify(issuer.id_token('alice@test.io'))
+
+    class FakeOAuthSession:
+        def __init__(self, state=None, token=None):
+            pass
+
+        def fetch_token(self, *args, **kwargs):
+            return {'access_token': 'access', 'id_token': issuer.id_token('alice@test.io')}
+
+        def get(self, url):
+            return types.SimpleNamespace(json=lambda: {'email': 'bob@test.io', 'given_name': 'Bob'})
+
+    monkeypatch.setattr(routes, 'get_google_oauth_session', FakeOAuthSession)
+    response = app.test_client().get('/google-auth/google/authorized?code=x&state=y')
+    assert response.status_code == 200
+    assert response.get_json()['user']['email'] == 'bob@test.io'
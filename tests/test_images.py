@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import db
+from benchmarks.stubs import STUB_ANALYSIS, meal_image
+from images import image_store
+
+
+class FakeOpenAIClient:
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content=json.dumps(STUB_ANALYSIS))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model='gpt-4o',
+                               usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+
+@pytest.fixture
+def client(make_app, make_user, tmp_path):
+    app = make_app(IMAGE_STORE_DIR=str(tmp_path / 'images'))
+    app.extensions['openai_client'] = FakeOpenAIClient()
+    with app.app_context():
+        _, headers = make_user()
+        yield app.test_client(), headers
+
+
+def _analyze(client, headers, data, mimetype):
+    return client.post('/image-information/analyze', headers=headers, content_type='multipart/form-data',
+                       data={'image': (io.BytesIO(data), 'upload', mimetype)})
+
+
+def test_non_image_upload_is_refused(client):
+    client, headers = client
+    response = _analyze(client, headers, b'<html><script>alert(1)</script></html>', 'text/html')
+    assert response.status_code == 415
+
+
+def test_image_served_with_sniffed_type_and_nosniff(client):
+    client, headers = client
+    image = meal_image('served', size=2048)
+    # Declared as HTML; stored and served as what it is
+    response = _analyze(client, headers, image, 'text/html')
+    assert response.status_code == 200
+    assert response.headers['X-Analysis-Cache'] == 'miss'
+
+    served = client.get(f"/image-information/images/{response.headers['X-Image-Id']}", headers=headers)
+    assert served.status_code == 200
+    assert served.mimetype == 'image/png'
+    assert served.headers['X-Content-Type-Options'] == 'nosniff'
+    assert served.data == image
+
+
+def test_repeat_upload_is_a_cache_hit(client):
+    client, headers = client
+    image = meal_image('repeat', size=2048)
+    assert _analyze(client, headers, image, 'image/png').headers['X-Analysis-Cache'] == 'miss'
+    assert _analyze(client, headers, image, 'image/png').headers['X-Analysis-Cache'] == 'hit'
+    assert _analyze(client, headers, meal_image('other', size=2048), 'image/png').headers['X-Analysis-Cache'] == 'miss'
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_gc_removes_files_of_uncommitted_uploads(make_app, make_user, tmp_path):
+    app = make_app(IMAGE_STORE_DIR=str(tmp_path / 'images'), IMAGE_GC_INTERVAL=0)
+    with app.app_context():
+        user, _ = make_user()
+        kept = image_store.store(meal_image('kept'), user.id, 'image/png').sha256
+        db.session.commit()
+        orphan = image_store.store(meal_image('orphan'), user.id, 'image/png').sha256
+        db.session.rollback()
+        retried = image_store.store(meal_image('retried'), user.id, 'image/png').sha256
+        db.session.rollback()
+        for image_id in (kept, orphan, retried):
+            assert os.path.exists(image_store.path(image_id))
+
+        # Still within the grace period
+        assert image_store.sweep(retention_days=0)['files_removed'] == 0
+
+        for image_id in (kept, orphan, retried):
+            _age(image_store.path(image_id), 7200)
+        # Uploaded again and not yet committed while the sweep runs
+        image_store.store(meal_image('retried'), user.id, 'image/png')
+        result = app.test_cli_runner().invoke(args=['images', 'gc'])
+        assert result.exit_code == 0, result.output
+        assert '1 orphaned file(s)' in result.output
+        db.session.commit()
+        assert not os.path.exists(image_store.path(orphan))
+        assert os.path.exists(image_store.path(kept))
+        assert os.path.exists(image_store.path(retried))
@@ -0,0 +1,112 @@
+import socket
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import db
+from mailer import EmailQueue
+from models import EmailOutbox
+
+
+class Recorder:
+    """aiosmtpd handler keeping what it accepted; `reject` answers the next DATA commands with a failure."""
+
+    def __init__(self):
+        self.messages = []
+        self.reject = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            return self.reject.pop(0)
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    handler = Recorder()
+    controller = Controller(handler, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def mail_app(make_app, smtp):
+    app = make_app(MAIL_SUPPRESS_SEND=False, MAIL_SERVER=smtp.hostname, MAIL_PORT=smtp.port, MAIL_USE_TLS=False,
+                   MAIL_USE_SSL=False, MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_DEFAULT_SENDER='noreply@test.io',
+                   MAIL_QUEUE_RETRY_BACKOFF=0.05, MAIL_QUEUE_MAX_ATTEMPTS=3, MAIL_QUEUE_IDLE_TIMEOUT=0.5)
+    outbox = EmailQueue(app)
+    with app.app_context():
+        yield app, outbox
+
+
+def _statuses():
+    db.session.expire_all()
+    return {row.subject: (row.status, row.attempts) for row in EmailOutbox.query}
+
+
+def test_send_delivers_over_one_connection(mail_app, smtp):
+    app, outbox = mail_app
+    for n in range(3):
+        outbox.send(f"Reset {n}", ['user@test.io'], 'body')
+    assert outbox.drain(10) == 0
+    assert len(smtp.handler.messages) == 3
+    assert smtp.handler.messages[0].rcpt_tos == ['user@test.io']
+    assert _statuses() == {f"Reset {n}": ('sent', 1) for n in range(3)}
+
+
+def test_failed_delivery_is_retried(mail_app, smtp):
+    app, outbox = mail_app
+    smtp.handler.reject = ['451 Try again later']
+    outbox.send('Reset', ['user@test.io'], 'body')
+    assert outbox.drain(10) == 0
+    assert _statuses() == {'Reset': ('sent', 2)}
+    assert len(smtp.handler.messages) == 1
+
+
+def test_gives_up_after_max_attempts(mail_app, smtp):
+    app, outbox = mail_app
+    smtp.handler.reject = ['550 No such user'] * 3
+    outbox.send('Reset', ['nobody@test.io'], 'body')
+    assert outbox.drain(10) == 0
+    assert _statuses() == {'Reset': ('failed', 3)}
+    assert smtp.handler.messages == []
+
+
+def test_recover_sends_rows_left_queued(mail_app, smtp):
+    app, outbox = mail_app
+    # Left over by a worker that died, and one another worker still owns
+    db.session.add(EmailOutbox(recipients='a@test.io', subject='Orphan', body='b', status='queued', attempts=0))
+    db.session.add(EmailOutbox(recipients='b@test.io', subject='Owned', body='b', status='queued', attempts=0,
+                               next_attempt_at=datetime.utcnow() + timedelta(minutes=5)))
+    db.session.commit()
+
+    assert outbox.recover() == 1
+    assert EmailQueue(app).recover() == 0  # already claimed
+    assert outbox.drain(10) == 0
+    assert _statuses() == {'Orphan': ('sent', 1), 'Owned': ('queued', 0)}
+    assert [m.rcpt_tos for m in smtp.handler.messages] == [['a@test.io']]
+
+
+def test_unexpected_error_does_not_stall_drain(mail_app, smtp, monkeypatch):
+    app, outbox = mail_app
+
+    def broken(config, row):
+        raise RuntimeError('template bug')
+    monkeypatch.setattr(outbox, '_deliver', broken)
+    outbox.send('Reset', ['user@test.io'], 'body')
+
+    started = time.monotonic()
+    assert outbox.drain(5) == 0
+    assert time.monotonic() - started < 2
+    # Still queued under this worker's lease, for recover() to retry later
+    assert _statuses() == {'Reset': ('queued', 0)}
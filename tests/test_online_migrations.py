@@ -0,0 +1,116 @@
+import pytest
+import sqlalchemy as sa
+from alembic import op
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+
+import online_migrations
+from app import db
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    app = make_app(SHARD_DATABASE_URIS=f"a=sqlite:///{tmp_path / 'a.db'}", MIGRATION_BACKFILL_PAUSE=0)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def migrate(app):
+    """Run `fn` as a migration on the primary, with `op` bound to it, and commit."""
+    def run(fn):
+        with db.engine.connect() as connection:
+            context = MigrationContext.configure(connection)
+            with Operations.context(context):
+                result = fn()
+            connection.commit()
+        return result
+    return run
+
+
+def _sql(sql, key=None):
+    with db.engines[key].connect() as connection:
+        return connection.execute(sa.text(sql)).all()
+
+
+def _indexes(table, key=None):
+    return {index['name'] for index in sa.inspect(db.engines[key]).get_indexes(table)}
+
+
+def _columns(table, key=None):
+    return {column['name']: column for column in sa.inspect(db.engines[key]).get_columns(table)}
+
+
+@pytest.fixture
+def readings(migrate):
+    def create():
+        op.create_table('reading', sa.Column('id', sa.Integer, primary_key=True), sa.Column('value', sa.Float))
+        op.bulk_insert(sa.table('reading', sa.column('id'), sa.column('value')),
+                       [{'id': i, 'value': i / 2} for i in range(1, 41) if i % 7])
+    migrate(create)
+
+
+def test_add_column_refuses_not_null_without_default(readings, migrate):
+    with pytest.raises(ValueError, match='set_not_null'):
+        migrate(lambda: online_migrations.add_column('reading', sa.Column('unit', sa.String(10), nullable=False)))
+    migrate(lambda: online_migrations.add_column('reading', sa.Column('unit', sa.String(10))))
+    migrate(lambda: online_migrations.add_column(
+        'reading', sa.Column('source', sa.String(10), nullable=False, server_default='manual')))
+    assert _sql("SELECT DISTINCT unit, source FROM reading") == [(None, 'manual')]
+
+
+def test_backfill_in_batches_and_resumable(readings, migrate, caplog):
+    migrate(lambda: online_migrations.add_column('reading', sa.Column('doubled', sa.Float)))
+    caplog.set_level('INFO', logger='alembic.online')
+    updated = migrate(lambda: online_migrations.backfill('reading', 'doubled = value * :factor',
+                                                         where='doubled IS NULL', batch_size=8,
+                                                         params={'factor': 2}))
+    assert updated == 35
+    assert _sql("SELECT count(*) FROM reading WHERE doubled IS NULL OR doubled != value * 2") == [(0,)]
+    assert '100% of id range' in caplog.text
+    # Already done rows are skipped when run again
+    assert migrate(lambda: online_migrations.backfill('reading', 'doubled = 0', where='doubled IS NULL')) == 0
+
+
+def test_backfill_of_empty_table(migrate):
+    migrate(lambda: op.create_table('empty', sa.Column('id', sa.Integer, primary_key=True), sa.Column('v', sa.Integer)))
+    assert migrate(lambda: online_migrations.backfill('empty', 'v = 1')) == 0
+
+
+def test_set_not_null(readings, migrate):
+    migrate(lambda: online_migrations.add_column('reading', sa.Column('unit', sa.String(10))))
+    migrate(lambda: online_migrations.backfill('reading', "unit = 'g'", where='unit IS NULL'))
+    migrate(lambda: online_migrations.set_not_null('reading', 'unit'))
+    assert not _columns('reading')['unit']['nullable']
+    with pytest.raises(sa.exc.IntegrityError):
+        with db.engine.begin() as connection:
+            connection.execute(sa.text("INSERT INTO reading (id, value) VALUES (100, 1)"))
+
+
+def test_index_helpers_are_idempotent(readings, migrate):
+    for _ in range(2):
+        migrate(lambda: online_migrations.create_index_concurrently('idx_reading_value', 'reading', ['value']))
+        migrate(lambda: online_migrations.create_index_concurrently(
+            'idx_reading_big', 'reading', [sa.text('value DESC')], where='value > 10'))
+    assert _indexes('reading') == {'idx_reading_value', 'idx_reading_big'}
+    [(definition,)] = _sql("SELECT sql FROM sqlite_master WHERE name = 'idx_reading_big'")
+    assert definition.endswith('WHERE value > 10')
+
+    for _ in range(2):
+        migrate(lambda: online_migrations.drop_index_concurrently('idx_reading_value', 'reading'))
+    assert _indexes('reading') == {'idx_reading_big'}
+
+
+def test_on_shards_repeats_the_change_and_rebinds_op(migrate):
+    def create():
+        op.create_table('per_user', sa.Column('id', sa.Integer, primary_key=True))
+
+    def change():
+        create()
+        online_migrations.on_shards(create)
+        # `op` is bound to the primary again
+        online_migrations.add_column('per_user', sa.Column('note', sa.Text))
+
+    migrate(change)
+    assert set(_columns('per_user')) == {'id', 'note'}
+    assert set(_columns('per_user', 'a')) == {'id'}
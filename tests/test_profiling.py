@@ -0,0 +1,103 @@
+import marshal
+import os
+import time
+
+import pytest
+from flask import jsonify
+
+from app import db
+from profiling import profiler
+
+
+@pytest.fixture
+def app(make_app, make_user):
+    app = make_app(PROFILING_ENABLED=True)
+
+    @app.route('/test/slow')
+    def slow_view():
+        time.sleep(0.05)
+        db.session.execute(db.text(
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 200000) SELECT count(*) FROM c"
+        ))
+        return jsonify({'ok': True})
+
+    @app.route('/test/other')
+    def other_view():
+        time.sleep(0.05)
+        return jsonify({'ok': True})
+
+    # Sessions are picked up through refresh() by the admin endpoints; no watcher thread
+    profiler._pid = os.getpid()
+    with app.app_context():
+        _, app.admin_headers = make_user('admin@test.io', admin=True)
+        yield app
+        profiler._active = None
+        profiler._threads.clear()
+        profiler._unlisten()
+        profiler._reset()
+    profiler._pid = None
+
+
+def _start(client, headers, **body):
+    return client.post('/auth-user/admin/profiling', headers=headers,
+                       json=dict({'duration': 30, 'sample_rate': 1, 'interval_ms': 2}, **body))
+
+
+def test_session_lifecycle(app):
+    client, headers = app.test_client(), app.admin_headers
+    response = _start(client, headers, endpoints=['slow_view'])
+    assert response.status_code == 201
+    session_id = response.get_json()['id']
+    assert response.get_json()['active']
+    assert _start(client, headers).status_code == 409
+
+    for _ in range(3):
+        client.get('/test/slow')
+        client.get('/test/other')
+
+    stacks = client.get(f'/auth-user/admin/profiling/{session_id}/profile', headers=headers).get_data(as_text=True)
+    roots = {line.split(';', 1)[0] for line in stacks.splitlines()}
+    assert roots == {'GET slow_view'}
+    assert 'slow_view (' in stacks
+    assert '[sql] WITH c' in stacks
+
+    pstats = client.get(f'/auth-user/admin/profiling/{session_id}/profile?format=pstats', headers=headers)
+    assert ('~', 0, 'GET slow_view') in marshal.loads(pstats.data)
+
+    stopped = client.post(f'/auth-user/admin/profiling/{session_id}/stop', headers=headers).get_json()
+    assert not stopped['active'] and stopped['stopped_at']
+    assert stopped['requests'] == 3 and stopped['samples'] > 0 and stopped['workers'] == 1
+
+    # Nothing more is recorded once stopped, and a new session may start
+    client.get('/test/slow')
+    listed = client.get('/auth-user/admin/profiling', headers=headers).get_json()['sessions']
+    assert [(s['id'], s['requests']) for s in listed] == [(session_id, 3)]
+    assert _start(client, headers).status_code == 201
+
+
+def test_expired_session_stops_sampling(app):
+    client, headers = app.test_client(), app.admin_headers
+    session_id = _start(client, headers, duration=1).get_json()['id']
+    client.get('/test/other')
+    time.sleep(1.2)
+    assert profiler._active is None
+    client.get('/test/other')
+
+    listed = client.get('/auth-user/admin/profiling', headers=headers).get_json()['sessions']
+    assert not listed[0]['active']
+    assert _start(client, headers).status_code == 201
+    # The expired session's counts were written when the next one replaced it
+    summary = client.get('/auth-user/admin/profiling', headers=headers).get_json()['sessions'][1]
+    assert summary['id'] == session_id and summary['requests'] == 1
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'duration': 0}, 'duration must be between 1 and'),
+    ({'sample_rate': 0}, 'sample_rate must be in'),
+    ({'interval_ms': 5000}, 'interval_ms must be between'),
+    ({'endpoints': ['no_such_view']}, 'Unknown endpoints or blueprints: no_such_view'),
+])
+def test_invalid_sessions_are_refused(app, body, error):
+    response = _start(app.test_client(), app.admin_headers, **body)
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
@@ -0,0 +1,102 @@
+import threading
+import time
+import types
+
+import pytest
+
+import ratelimit
+
+
+def _refresh(client, **headers):
+    # An anonymous 'auth' endpoint that answers 400 without a body
+    return client.post('/auth-user/refresh', json={}, headers=headers).status_code
+
+
+@pytest.mark.parametrize('proxies, separate', [(1, True), (0, False)])
+def test_anonymous_clients_are_keyed_by_forwarded_address_behind_trusted_proxies(make_app, proxies, separate):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_BUDGETS={'auth': '1/minute'}, TRUSTED_PROXY_COUNT=proxies)
+    client = app.test_client()
+    assert _refresh(client, **{'X-Forwarded-For': '203.0.113.1'}) == 400
+    assert _refresh(client, **{'X-Forwarded-For': '203.0.113.2'}) == (400 if separate else 429)
+    assert _refresh(client, **{'X-Forwarded-For': '203.0.113.1'}) == 429
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    storage = ratelimit.MemoryStorage()
+    rate, capacity = ratelimit.parse_budget('60/minute;burst=2')
+    assert (rate, capacity) == (1.0, 2.0)
+
+    assert storage.consume('k', rate, capacity) == (True, 0.0)
+    assert storage.consume('k', rate, capacity) == (True, 0.0)
+    assert storage.consume('k', rate, capacity) == (False, 1.0)
+    now[0] += 0.5
+    assert storage.consume('k', rate, capacity) == (False, 0.5)
+    now[0] += 0.5
+    assert storage.consume('k', rate, capacity) == (True, 0.0)
+    # Never refills past the burst size
+    now[0] += 60
+    assert [storage.consume('k', rate, capacity)[0] for _ in range(3)] == [True, True, False]
+    # Other clients have their own bucket
+    assert storage.consume('other', rate, capacity) == (True, 0.0)
+
+
+def test_over_budget_requests_get_429_with_retry_after(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_BUDGETS={'auth': '2/minute'})
+    client = app.test_client()
+    assert [_refresh(client) for _ in range(2)] == [400, 400]
+    response = client.post('/auth-user/refresh', json={})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_concurrency_cap_queues_then_sheds(make_app):
+    app = make_app(TEST_MAX_CONCURRENT=1, TEST_QUEUE_TIMEOUT=0.5, TEST_MAX_QUEUE=1)
+    limiter = ratelimit.ConcurrencyLimiter('TEST_MAX_CONCURRENT', 'TEST_QUEUE_TIMEOUT', 'TEST_MAX_QUEUE')
+    release = threading.Event()
+    started, results = [], {}
+
+    @limiter
+    def view(n):
+        started.append(n)
+        if n == 0:
+            release.wait(5)
+        return 'ok'
+
+    def call(n):
+        with app.app_context():
+            result = view(n)
+            results[n] = result if result == 'ok' else (result.status_code, result.headers['Retry-After'])
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in (0, 1)]
+    threads[0].start()
+    _wait_for(lambda: started == [0])
+    # The second caller queues for the slot; a third finds the queue full
+    threads[1].start()
+    _wait_for(lambda: limiter._waiting == 1)
+    call(2)
+    assert results == {2: (429, '1')}
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == {0: 'ok', 1: 'ok', 2: (429, '1')}
+    assert started == [0, 1]
+
+    # A queued caller that doesn't get the slot within the timeout is shed as well
+    release.clear()
+    blocker = threading.Thread(target=call, args=(0,))
+    blocker.start()
+    _wait_for(lambda: started == [0, 1, 0])
+    call(3)
+    release.set()
+    blocker.join()
+    assert results[3] == (429, '1')
+    assert started == [0, 1, 0]
@@ -0,0 +1,134 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import bulk_io
+from app import db
+from models import FoodItem, FoodType
+from sharding import shards
+
+T0 = datetime(2026, 1, 1, 12)
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    app = make_app(SHARD_DATABASE_URIS=f"a=sqlite:///{tmp_path / 'a.db'},b=sqlite:///{tmp_path / 'b.db'}",
+                   SHARD_MOVE_GRACE=0)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def user_on(make_user):
+    """Create a user whose food log lives on `shard` (None: the primary)."""
+    def make(email, shard):
+        user, headers = make_user(email)
+        user.shard = shard
+        db.session.commit()
+        return user.id, headers
+    return make
+
+
+def _log(user_id, shard, minutes):
+    """Items for `user_id` on `shard`, logged `minutes` after T0."""
+    food_type = FoodType.query.filter_by(type='Fruit').first() or FoodType(type='Fruit')
+    db.session.add(food_type)
+    db.session.flush()
+    with shards.using(shard):
+        bulk_io.insert_items([{
+            'name': f'Apple {m}', 'volume': 100, 'food_type_id': food_type.id, 'user_id': user_id,
+            'timestamp': T0 + timedelta(minutes=m), 'date_uploaded': T0, 'calories': 52, 'carbs': 14, 'fat': 0.2,
+            'protein': 0.3,
+        } for m in minutes])
+    db.session.commit()
+
+
+def _ids(user_id, shard):
+    with shards.using(shard):
+        return sorted(item.id for item in FoodItem.query.filter_by(user_id=user_id))
+
+
+def _names(user_id, shard):
+    with shards.using(shard):
+        return sorted(item.name for item in FoodItem.query.filter_by(user_id=user_id))
+
+
+def test_requests_are_routed_to_the_users_shard(app, user_on):
+    user_id, headers = user_on('alice@test.io', 'b')
+    client = app.test_client()
+    response = client.post('/food-items/food-items', headers=headers,
+                           json={'foods': [{'name': 'Apple', 'type': 'Fruit', 'carbs': 14}]})
+    assert response.status_code == 201
+    assert _names(user_id, 'b') == ['Apple']
+    assert _names(user_id, 'a') == _names(user_id, None) == []
+    assert [item['name'] for item in client.get('/food-items/food-items', headers=headers).get_json()] == ['Apple']
+
+
+def test_interrupted_move_resumes_with_from(app, user_on):
+    user_id, _ = user_on('alice@test.io', 'a')
+    _log(user_id, 'a', range(5))
+    ids = _ids(user_id, 'a')
+    deletes = []
+
+    def fail_second_delete(conn, cursor, statement, *args):
+        if statement.startswith('DELETE FROM food_item '):
+            deletes.append(statement)
+            if len(deletes) == 2:
+                raise RuntimeError('interrupted')
+
+    event.listen(shards.engine('a'), 'before_cursor_execute', fail_second_delete)
+    with pytest.raises(RuntimeError):
+        shards.move_user(user_id, 'b', batch_size=2)
+    event.remove(shards.engine('a'), 'before_cursor_execute', fail_second_delete)
+    db.session.rollback()
+    # The second batch was copied to b but is still on a
+    assert len(_names(user_id, 'a')) == 3
+    assert len(_names(user_id, 'b')) == 4
+
+    result = app.test_cli_runner().invoke(args=['shards', 'move-user', str(user_id), 'b', '--from', 'a',
+                                                '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert _names(user_id, 'a') == []
+    assert _names(user_id, 'b') == [f'Apple {m}' for m in range(5)]
+    assert _ids(user_id, 'b') == ids
+
+
+def test_item_ids_are_unique_across_shards(app, user_on):
+    alice, alice_headers = user_on('alice@test.io', 'a')
+    bob, _ = user_on('bob@test.io', 'b')
+    carol, _ = user_on('carol@test.io', None)
+    _log(alice, 'a', range(3))
+    _log(bob, 'b', range(3))
+    _log(carol, None, range(3))
+    response = app.test_client().post('/food-items/food-items', headers=alice_headers,
+                                      json={'foods': [{'name': 'Rice', 'type': 'Grain', 'carbs': 42}]})
+    assert response.status_code == 201
+    ids = _ids(alice, 'a') + _ids(bob, 'b') + _ids(carol, None)
+    assert len(ids) == len(set(ids)) == 10
+
+
+def test_admin_listing_merges_shards_in_order_across_pages(app, user_on, make_user):
+    _, admin_headers = make_user('admin@test.io', admin=True)
+    alice, _ = user_on('alice@test.io', 'a')
+    bob, _ = user_on('bob@test.io', 'b')
+    carol, _ = user_on('carol@test.io', None)
+    _log(alice, 'a', [0, 3, 6, 9])
+    _log(bob, 'b', [1, 4, 7])
+    _log(carol, None, [2, 5, 8])
+    client = app.test_client()
+
+    seen = []
+    for page in (1, 2, 3, 4):
+        body = client.get(f'/auth-user/admin/all-food-items?page={page}&per_page=3', headers=admin_headers).get_json()
+        assert body['total_items'] == 10 and body['total_pages'] == 4
+        assert body['has_next'] == (page < 4)
+        seen += [(item['name'], item['shard']) for item in body['food_items']]
+    owner = {0: 'a', 1: 'b', 2: None}
+    assert seen == [(f'Apple {m}', owner[m % 3]) for m in range(9, -1, -1)]
+
+    export = client.get('/auth-user/admin/food-items/export?format=csv', headers=admin_headers).get_data(as_text=True)
+    rows = list(csv.DictReader(io.StringIO(export)))
+    assert [(row['name'], row['shard'] or None) for row in rows] == seen[::-1]
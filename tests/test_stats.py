@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+import stats
+from app import db
+from models import DailyFoodStats, DailyFoodTypeStats, DailyStats, DailyUserActivity, FoodItem
+from sharding import shards
+
+FOODS = [{'name': 'Rice', 'type': 'Grain', 'calories': 195, 'carbs': 42},
+         {'name': 'Apple', 'type': 'Fruit', 'calories': 52, 'carbs': 14}]
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    app = make_app(SHARD_DATABASE_URIS=f"a=sqlite:///{tmp_path / 'a.db'},b=sqlite:///{tmp_path / 'b.db'}",
+                   SHARD_MOVE_GRACE=0)
+    with app.app_context():
+        yield app
+
+
+def _aggregates():
+    """Every aggregate row, without rows whose counters are all zero."""
+    snapshot = {}
+    for model in (DailyStats, DailyFoodTypeStats, DailyFoodStats, DailyUserActivity):
+        keys = [c.name for c in model.__table__.primary_key]
+        counters = [c.name for c in model.__table__.columns if c.name not in keys]
+        for row in db.session.query(model):
+            values = tuple(round(getattr(row, name) or 0, 6) for name in counters)
+            if not counters or any(values):
+                snapshot[(model.__tablename__,) + tuple(getattr(row, name) for name in keys)] = values
+    return snapshot
+
+
+def assert_matches_rebuild():
+    db.session.commit()
+    incremental = _aggregates()
+    stats.rebuild()
+    assert incremental == _aggregates()
+
+
+def _import(client, headers, rows, url='/food-items/food-items/import'):
+    body = 'user_id,name,food_type,carbs,timestamp\n' + ''.join(f"{','.join(map(str, row))}\n" for row in rows)
+    response = client.post(url, data=body, content_type='text/csv', headers=headers)
+    assert response.status_code == 201, response.get_json()
+
+
+def _item_id(user_id, timestamp, name):
+    with shards.using(shards.shards_for([user_id])[user_id]):
+        item = FoodItem.query.filter_by(user_id=user_id, timestamp=datetime.fromisoformat(timestamp), name=name)
+        return item.one().id
+
+
+def test_incremental_aggregates_match_rebuild(app, make_user):
+    alice, alice_headers = make_user('alice@test.io')
+    bob, bob_headers = make_user('bob@test.io')
+    _, admin_headers = make_user('admin@test.io', admin=True)
+    alice.shard = 'a'
+    db.session.commit()
+    alice_id, bob_id = alice.id, bob.id
+    client = app.test_client()
+
+    for headers in (alice_headers, bob_headers):
+        assert client.post('/food-items/food-items', json={'foods': FOODS}, headers=headers).status_code == 201
+    _import(client, alice_headers, [('', 'Rice', 'Grain', 42, '2026-01-01T12:00:00'),
+                                    ('', 'Apple', 'Fruit', 14, '2026-01-01T12:00:00'),
+                                    ('', 'Bread', 'Grain', 20, '2026-01-02T08:00:00')])
+    # Joins the meal imported before
+    _import(client, alice_headers, [('', 'Pear', 'Fruit', 15, '2026-01-01T12:00:00')])
+    assert_matches_rebuild()
+
+    # One item of a meal, then the only item of a day
+    for name, timestamp in (('Pear', '2026-01-01 12:00:00'), ('Bread', '2026-01-02 08:00:00')):
+        item_id = _item_id(alice_id, timestamp, name)
+        assert client.delete(f'/food-items/food-items/{item_id}', headers=alice_headers).status_code == 200
+        assert_matches_rebuild()
+    for name in ('Rice', 'Apple'):
+        item_id = _item_id(alice_id, '2026-01-01 12:00:00', name)
+        assert client.delete(f'/food-items/food-items/{item_id}', headers=alice_headers).status_code == 200
+    assert_matches_rebuild()
+
+    shards.move_user(alice_id, 'b')
+    assert_matches_rebuild()
+
+    # Admin import across shards, into an existing meal and a new one
+    _import(client, admin_headers, [(alice_id, 'Rice', 'Grain', 42, '2026-01-03T12:00:00'),
+                                    (bob_id, 'Rice', 'Grain', 42, '2026-01-03T12:00:00'),
+                                    (bob_id, 'Apple', 'Fruit', 14, '2026-01-03T12:00:00')],
+            url='/auth-user/admin/food-items/import')
+    _import(client, admin_headers, [(bob_id, 'Pear', 'Fruit', 15, '2026-01-03T12:00:00')],
+            url='/auth-user/admin/food-items/import')
+    assert_matches_rebuild()
@@ -0,0 +1,80 @@
+import io
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import db
+from benchmarks.stubs import meal_image
+from models import AnalysisUsage
+from usage import usage
+from tests.test_images import FakeOpenAIClient
+
+RESPONSE = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5), model='gpt-4o')
+
+
+@pytest.fixture(autouse=True)
+def fresh_usage(monkeypatch):
+    # No flusher, and nothing left over from other tests' apps
+    monkeypatch.setattr(usage, '_start', lambda: None)
+    for name in ('_pending', '_flushing'):
+        monkeypatch.setattr(usage, name, [])
+    monkeypatch.setattr(usage, '_counters', {})
+    monkeypatch.setattr(usage, '_reserved', type(usage._reserved)())
+
+
+def test_failed_calls_do_not_count_against_the_quota(make_app, make_user):
+    app = make_app(ANALYZE_DAILY_CALL_QUOTA=2)
+    with app.app_context():
+        user, _ = make_user()
+        now = datetime.utcnow()
+        db.session.add_all([
+            AnalysisUsage(user_id=user.id, created_at=now, cache_hit=False, prompt_tokens=10, completion_tokens=5),
+            AnalysisUsage(user_id=user.id, created_at=now, cache_hit=False, status='error'),
+            AnalysisUsage(user_id=user.id, created_at=now, cache_hit=True),
+        ])
+        db.session.commit()
+        assert usage.used_today(user.id) == (1, 15)
+
+        assert usage.quota_exceeded(user) is None
+        with pytest.raises(RuntimeError):
+            with usage.upstream_call(user.id, 'f' * 64, 100):
+                raise RuntimeError('upstream failed')
+        assert usage.used_today(user.id) == (1, 15)
+
+        assert usage.quota_exceeded(user) is None
+        with usage.upstream_call(user.id, 'e' * 64, 100) as call:
+            call.response = RESPONSE
+        assert usage.used_today(user.id) == (2, 30)
+        assert usage.quota_exceeded(user) is not None
+
+
+class SlowOpenAIClient(FakeOpenAIClient):
+    def _create(self, **kwargs):
+        time.sleep(0.2)
+        return super()._create(**kwargs)
+
+
+def test_concurrent_calls_of_one_user_stay_within_the_quota(make_app, make_user, tmp_path):
+    app = make_app(ANALYZE_DAILY_CALL_QUOTA=2, IMAGE_STORE_DIR=str(tmp_path / 'images'))
+    app.extensions['openai_client'] = client = SlowOpenAIClient()
+    with app.app_context():
+        _, headers = make_user()
+    statuses = []
+
+    def analyze(n):
+        response = app.test_client().post('/image-information/analyze', headers=headers,
+                                          content_type='multipart/form-data',
+                                          data={'image': (io.BytesIO(meal_image(f'quota-{n}')), 'meal.png')})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=analyze, args=(n,)) for n in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [200, 200, 429, 429, 429]
+    assert len(client.calls) == 2
+    assert not usage._reserved
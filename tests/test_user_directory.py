@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import bulk_io
+from app import db
+from models import FoodType, User
+from sharding import shards
+
+PEOPLE = [('Ana', 'Lopez', 'ana@test.io'), ('Ann', 'Smith', 'ann.smith@test.io'), ('Bob', 'Anders', 'bob@test.io'),
+          ('Carl', 'Ng', 'carl_1@test.io'), ('Dana', 'Annis', 'carlx1@test.io')]
+
+
+@pytest.fixture(params=['single', 'sharded'])
+def app(request, make_app, tmp_path):
+    overrides = {}
+    if request.param == 'sharded':
+        overrides['SHARD_DATABASE_URIS'] = f"a=sqlite:///{tmp_path / 'a.db'},b=sqlite:///{tmp_path / 'b.db'}"
+    app = make_app(**overrides)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def directory(app, make_user):
+    """GET /auth-user/admin/users as an admin; the users in PEOPLE exist, spread over the shards."""
+    _, headers = make_user('admin@test.io', admin=True)
+    users = [User(first_name=first, last_name=last, email=email, password='unused') for first, last, email in PEOPLE]
+    db.session.add_all(users)
+    db.session.commit()
+    food_type = FoodType(type='Grain')
+    db.session.add(food_type)
+    db.session.commit()
+    now = datetime.utcnow()
+    for n, user in enumerate(users):
+        if shards.enabled:
+            user.shard = 'ab'[n % 2]
+            db.session.commit()
+        if not n:
+            continue
+        with shards.using(user.shard):
+            shards.replicate_food_types({food_type.id})
+            # n items: one a month ago and the rest this week, 10 g carbs each
+            bulk_io.insert_items([{
+                'name': 'Rice', 'volume': None, 'food_type_id': food_type.id, 'user_id': user.id,
+                'timestamp': now - timedelta(days=30 if i == 0 else 1, minutes=i), 'date_uploaded': now,
+                'calories': None, 'carbs': 10, 'fat': None, 'protein': None,
+            } for i in range(n)])
+            db.session.commit()
+    client = app.test_client()
+
+    def get(**params):
+        response = client.get('/auth-user/admin/users', query_string=params, headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return get
+
+
+def _emails(body):
+    return [user['email'] for user in body['users']]
+
+
+def test_keyset_pages_cover_every_user_once(directory):
+    seen, after, pages = [], 0, 0
+    while after is not None:
+        body = directory(after=after, limit=2)
+        assert len(body['users']) <= 2
+        assert body['has_next'] == (body['next_after'] is not None)
+        seen += _emails(body)
+        after = body['next_after']
+        pages += 1
+    assert seen == ['admin@test.io'] + [email for _, _, email in PEOPLE]
+    assert pages == 3
+
+
+def test_activity_columns(directory):
+    users = {user['email']: user for user in directory()['users']}
+    assert users['ana@test.io']['item_count'] == 0
+    assert users['ana@test.io']['last_logged_at'] is None
+    assert users['ana@test.io']['carbs_7d'] == 0
+    # 4 items, one of them logged a month ago
+    assert users['carlx1@test.io']['item_count'] == 4
+    assert users['carlx1@test.io']['carbs_7d'] == 30
+    assert users['carlx1@test.io']['last_logged_at'] is not None
+
+
+@pytest.mark.parametrize('params, expected', [
+    ({'email': 'ANN'}, ['ann.smith@test.io']),
+    ({'email': 'carl_'}, ['carl_1@test.io']),  # `_` is not a wildcard
+    ({'email': 'carl%'}, []),
+    ({'name': 'an'}, ['ana@test.io', 'ann.smith@test.io', 'bob@test.io', 'carlx1@test.io']),
+    ({'name': 'ann smi'}, ['ann.smith@test.io']),
+    ({'name': 'ana lop'}, ['ana@test.io']),
+    ({'role': 'GLUCOCHECK_ADMIN'}, ['admin@test.io']),
+    ({'role': 'GLUCOCHECK_USER', 'name': 'an', 'limit': 1, 'after': 3}, ['bob@test.io']),
+])
+def test_filters(directory, params, expected):
+    assert _emails(directory(**params)) == expected
+
+
+def test_filtered_pages_follow_next_after(directory):
+    first = directory(name='an', limit=3)
+    assert first['has_next']
+    rest = directory(name='an', limit=3, after=first['next_after'])
+    assert not rest['has_next'] and rest['next_after'] is None
+    assert _emails(first) + _emails(rest) == ['ana@test.io', 'ann.smith@test.io', 'bob@test.io', 'carlx1@test.io']
@@ -0,0 +1,90 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import bulk_io
+from app import db
+from models import FoodItem, User
+from sharding import shards
+from shard_routing import current_shard
+from write_buffer import _Submission, write_buffer
+
+FOODS = [{'name': 'Apple', 'type': 'Fruit', 'volume': 100, 'calories': 52, 'carbs': 14, 'fat': 0.2,
+          'protein': 0.3}]
+
+
+@pytest.fixture
+def sharded_app(make_app, tmp_path):
+    app = make_app(SHARD_DATABASE_URIS=f"a=sqlite:///{tmp_path / 'a.db'},b=sqlite:///{tmp_path / 'b.db'}",
+                   WRITE_BUFFER_ENABLED=True)
+    with app.app_context():
+        yield app
+
+
+def _user(email, shard):
+    user = User(first_name='Test', last_name='User', email=email, password='unused')
+    db.session.add(user)
+    db.session.commit()
+    user.shard = shard
+    db.session.commit()
+    return user.id, shard
+
+
+def _submission(user, name='Apple'):
+    user_id, shard = user
+    return _Submission(user_id, shard, datetime.utcnow(), [dict(FOODS[0], name=name)], None)
+
+
+def _items(user):
+    user_id, shard = user
+    with shards.using(shard):
+        return [item.name for item in FoodItem.query.filter_by(user_id=user_id)]
+
+
+def test_failed_shard_does_not_rewrite_committed_shards(sharded_app, monkeypatch):
+    alice, bob = _user('alice@test.io', 'a'), _user('bob@test.io', 'b')
+    insert_items = bulk_io.insert_items
+
+    def fail_on_b(items):
+        if current_shard() == 'b':
+            raise RuntimeError('shard b is down')
+        return insert_items(items)
+
+    monkeypatch.setattr(bulk_io, 'insert_items', fail_on_b)
+    batch = [_submission(alice), _submission(bob)]
+    write_buffer._commit(batch)
+
+    assert all(s.done.is_set() for s in batch)
+    assert batch[0].error is None
+    assert isinstance(batch[1].error, RuntimeError)
+    assert _items(alice) == ['Apple']
+    assert _items(bob) == []
+
+
+def test_bad_submission_is_retried_alone_on_its_shard(sharded_app, monkeypatch):
+    alice, carol = _user('alice@test.io', 'a'), _user('carol@test.io', 'a')
+    insert_items = bulk_io.insert_items
+
+    def reject_bad(items):
+        if any(item['name'] == 'bad' for item in items):
+            raise ValueError('bad item')
+        return insert_items(items)
+
+    monkeypatch.setattr(bulk_io, 'insert_items', reject_bad)
+    batch = [_submission(alice), _submission(carol, 'bad')]
+    write_buffer._commit(batch)
+
+    assert batch[0].error is None
+    assert isinstance(batch[1].error, ValueError)
+    assert _items(alice) == ['Apple']
+    assert _items(carol) == []
+
+
+def test_unconfirmed_save_is_accepted_not_failed(make_app, make_user, monkeypatch):
+    app = make_app(WRITE_BUFFER_ENABLED=True, WRITE_BUFFER_ACK_TIMEOUT=0.05)
+    monkeypatch.setattr(write_buffer, '_commit', lambda batch: time.sleep(0.5))
+    with app.app_context():
+        _, headers = make_user()
+        response = app.test_client().post('/food-items/food-items', json={'foods': FOODS}, headers=headers)
+    assert response.status_code == 202
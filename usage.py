@@ -0,0 +1,327 @@
+#usage.py
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from flask import current_app, g
+
+from app import db
+from models import AnalysisUsage, User
+
+
+class _Call:
+    """Filled in by the caller inside UsageRecorder.upstream_call()."""
+    __slots__ = ('response',)
+
+    def __init__(self):
+        self.response = None
+
+
+def _tokens(response):
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+
+
+def _counts(row):
+    # Only answered upstream calls use up the quota; a failed call shouldn't lock the user out
+    return not row['cache_hit'] and row['status'] == 'ok'
+
+
+def _day(value):
+    # SQLite hands back date() results as text
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+class UsageRecorder:
+    """Per-call accounting and per-user daily quotas for /analyze.
+
+    Every analysis (cache hits included) becomes one analysis_usage row with
+    the model's token counts, image size, upstream latency and outcome. Rows
+    are buffered in the process and written by a flusher thread with one
+    multi-row insert every USAGE_FLUSH_SECONDS (sooner once USAGE_FLUSH_ROWS
+    are waiting), so requests never wait on the insert.
+
+    ANALYZE_DAILY_CALL_QUOTA and ANALYZE_DAILY_TOKEN_QUOTA cap each user's
+    upstream calls and tokens per UTC day (0 = no cap; cache hits and failed
+    calls are free, admins are exempt). They are checked against in-memory counters that are
+    loaded from analysis_usage, re-read every USAGE_SYNC_SECONDS to pick up
+    the other workers' calls, and bumped locally as calls finish. A user can
+    overshoot by what other workers let through within one sync interval.
+    Within a process a call is reserved when it is admitted, so concurrent
+    requests of one user can't all pass the check before any finishes.
+    """
+
+    def __init__(self, app=None):
+        self._cond = threading.Condition()
+        self._pending = []   # rows waiting for the flusher
+        self._flushing = []  # rows being inserted right now
+        self._counters = {}  # (user_id, day) -> [upstream calls, tokens, monotonic time of last sync]
+        self._reserved = Counter()  # (user_id, day) -> calls admitted and not finished yet
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ANALYZE_DAILY_CALL_QUOTA', 0)
+        app.config.setdefault('ANALYZE_DAILY_TOKEN_QUOTA', 0)
+        app.config.setdefault('USAGE_FLUSH_SECONDS', 5.0)
+        app.config.setdefault('USAGE_FLUSH_ROWS', 500)
+        app.config.setdefault('USAGE_SYNC_SECONDS', 30.0)
+        app.extensions['usage'] = self
+        app.teardown_request(self._release_request)
+
+    # Recording
+
+    def record(self, user_id, image_sha256, image_bytes, cache_hit, response=None, latency=None, status='ok'):
+        """Queue one analysis for the usage table and count it against the user's quota."""
+        prompt_tokens, completion_tokens = _tokens(response)
+        row = {
+            'user_id': user_id,
+            'created_at': datetime.utcnow(),
+            'image_sha256': image_sha256,
+            'image_bytes': image_bytes,
+            'cache_hit': cache_hit,
+            'model': getattr(response, 'model', None),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency_ms': round(latency * 1000) if latency is not None else None,
+            'status': status,
+        }
+        self._start()
+        with self._cond:
+            self._pending.append(row)
+            counter = self._counters.get((user_id, row['created_at'].date()))
+            if counter is not None and _counts(row):
+                counter[0] += 1
+                counter[1] += (prompt_tokens or 0) + (completion_tokens or 0)
+            if len(self._pending) >= current_app.config['USAGE_FLUSH_ROWS']:
+                self._cond.notify()
+
+    @contextmanager
+    def upstream_call(self, user_id, image_sha256, image_bytes):
+        """Time the model call in the block and record it; set `.response` on the yielded object."""
+        call = _Call()
+        reservation = g.pop('usage_reservation', None)
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception:
+            self._release(reservation)
+            self.record(user_id, image_sha256, image_bytes, cache_hit=False,
+                        latency=time.perf_counter() - started, status='error')
+            raise
+        # Counted by record() from here on
+        self.record(user_id, image_sha256, image_bytes, cache_hit=False, response=call.response,
+                    latency=time.perf_counter() - started)
+        self._release(reservation)
+
+    def _release(self, reservation):
+        if reservation is None:
+            return
+        with self._cond:
+            self._reserved[reservation] -= 1
+            if self._reserved[reservation] <= 0:
+                del self._reserved[reservation]
+
+    def _release_request(self, exc=None):
+        # Admitted but the request ended before upstream_call()
+        self._release(g.pop('usage_reservation', None))
+
+    def _start(self):
+        # Per process: a worker forked after the parent started the thread needs its own
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._pending, self._flushing, self._counters = [], [], {}
+                    self._reserved = Counter()
+                self._thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='usage-flush', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self, app):
+        interval = app.config['USAGE_FLUSH_SECONDS']
+        max_rows = app.config['USAGE_FLUSH_ROWS']
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= max_rows, timeout=interval)
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception("Usage flush failed")
+                finally:
+                    db.session.remove()
+
+    def flush(self):
+        """Insert the buffered rows now; returns how many were written."""
+        with self._cond:
+            if self._flushing or not self._pending:
+                return 0  # the flusher is on it, or there's nothing to write
+            self._flushing, self._pending = self._pending, []
+        rows = self._flushing
+        try:
+            db.session.execute(db.insert(AnalysisUsage), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._cond:
+                # Try again with the next batch, unless the table has been unwritable for a while
+                if len(self._pending) < 100 * current_app.config['USAGE_FLUSH_ROWS']:
+                    self._pending[:0] = rows
+                self._flushing = []
+            raise
+        with self._cond:
+            self._flushing = []
+        return len(rows)
+
+    def drain(self, timeout):
+        """Flush what is buffered before the process exits; returns the rows left unwritten."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._pending and not self._flushing:
+                    return 0
+            try:
+                self.flush()
+            except Exception:
+                current_app.logger.exception("Usage flush failed")
+                time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+            else:
+                time.sleep(0.05)
+        with self._cond:
+            return len(self._pending) + len(self._flushing)
+
+    def report(self, date_from, date_to, top=10):
+        """Admin usage figures for days in [date_from, date_to]: totals, per day and the heaviest users.
+
+        This worker's buffered calls are written first; other workers' show up
+        within USAGE_FLUSH_SECONDS.
+        """
+        self.flush()
+        return _report(date_from, date_to, top)
+
+    # Quotas
+
+    def used_today(self, user_id):
+        """(upstream calls, tokens) of `user_id` today (UTC), as far as this process knows.
+
+        Calls admitted by quota_exceeded() and still running count as calls.
+        """
+        day = datetime.utcnow().date()
+        key = (user_id, day)
+        counter = self._counters.get(key)
+        if counter is not None and time.monotonic() - counter[2] < current_app.config['USAGE_SYNC_SECONDS']:
+            return counter[0] + self._reserved[key], counter[1]
+
+        start = datetime.combine(day, datetime.min.time())
+        calls, tokens = db.session.query(
+            db.func.count(),
+            db.func.coalesce(db.func.sum(db.func.coalesce(AnalysisUsage.prompt_tokens, 0)
+                                         + db.func.coalesce(AnalysisUsage.completion_tokens, 0)), 0),
+        ).filter(AnalysisUsage.user_id == user_id, AnalysisUsage.created_at >= start,
+                 AnalysisUsage.cache_hit.is_(False), AnalysisUsage.status == 'ok').one()
+        with self._cond:
+            # Rows of this process that aren't in the table yet
+            for row in self._pending + self._flushing:
+                if row['user_id'] == user_id and _counts(row) and row['created_at'] >= start:
+                    calls += 1
+                    tokens += (row['prompt_tokens'] or 0) + (row['completion_tokens'] or 0)
+            if any(k[1] != day for k in self._counters):
+                self._counters = {k: v for k, v in self._counters.items() if k[1] == day}
+            self._counters[key] = [calls, int(tokens), time.monotonic()]
+            return calls + self._reserved[key], int(tokens)
+
+    def quota_exceeded(self, user):
+        """Seconds until `user` may call the model again today, or None while under quota.
+
+        When under quota, one call is reserved for this request until its
+        upstream_call() finishes (or the request ends without one).
+        """
+        config = current_app.config
+        call_quota, token_quota = config['ANALYZE_DAILY_CALL_QUOTA'], config['ANALYZE_DAILY_TOKEN_QUOTA']
+        if not (call_quota or token_quota) or user.is_super_user():
+            return None
+        self.used_today(user.id)  # loads or refreshes the counter
+        now = datetime.utcnow()
+        key = (user.id, now.date())
+        with self._cond:
+            # Checked and reserved under the lock, so concurrent requests see each other
+            calls, tokens = self._counters.get(key, (0, 0))[:2]
+            calls += self._reserved[key]
+            if (call_quota and calls >= call_quota) or (token_quota and tokens >= token_quota):
+                midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+                return (midnight - now).total_seconds()
+            self._reserved[key] += 1
+        self._release(g.pop('usage_reservation', None))
+        g.usage_reservation = key
+        return None
+
+
+def _day_column():
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return db.func.date(AnalysisUsage.created_at)
+    return db.cast(AnalysisUsage.created_at, db.Date)
+
+
+def _report(date_from, date_to, top):
+    in_range = (AnalysisUsage.created_at >= datetime.combine(date_from, datetime.min.time()),
+                AnalysisUsage.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    upstream = db.case((AnalysisUsage.cache_hit.is_(False), 1), else_=0)
+    tokens = db.func.coalesce(AnalysisUsage.prompt_tokens, 0) + db.func.coalesce(AnalysisUsage.completion_tokens, 0)
+    figures = (
+        db.func.count().label('calls'),
+        db.func.sum(upstream).label('upstream_calls'),
+        db.func.sum(db.case((AnalysisUsage.status != 'ok', 1), else_=0)).label('errors'),
+        db.func.sum(AnalysisUsage.prompt_tokens).label('prompt_tokens'),
+        db.func.sum(AnalysisUsage.completion_tokens).label('completion_tokens'),
+        db.func.sum(AnalysisUsage.image_bytes).label('image_bytes'),
+        db.func.avg(AnalysisUsage.latency_ms).label('avg_latency_ms'),
+        db.func.max(AnalysisUsage.latency_ms).label('max_latency_ms'),
+    )
+
+    def shape(row):
+        calls, upstream_calls = int(row.calls or 0), int(row.upstream_calls or 0)
+        return {
+            'calls': calls,
+            'upstream_calls': upstream_calls,
+            'cache_hits': calls - upstream_calls,
+            'cache_hit_rate': (calls - upstream_calls) / calls if calls else None,
+            'errors': int(row.errors or 0),
+            'prompt_tokens': int(row.prompt_tokens or 0),
+            'completion_tokens': int(row.completion_tokens or 0),
+            'image_bytes': int(row.image_bytes or 0),
+            'avg_latency_ms': round(float(row.avg_latency_ms), 1) if row.avg_latency_ms is not None else None,
+            'max_latency_ms': row.max_latency_ms,
+        }
+
+    totals = db.session.query(*figures).filter(*in_range).one()
+    day = _day_column().label('day')
+    days = db.session.query(day, *figures).filter(*in_range).group_by(day).order_by(day).all()
+    users = db.session.query(AnalysisUsage.user_id, User.email, *figures)\
+        .join(User, User.id == AnalysisUsage.user_id)\
+        .filter(*in_range)\
+        .group_by(AnalysisUsage.user_id, User.email)\
+        .order_by(db.func.sum(tokens).desc(), db.func.count().desc())\
+        .limit(top).all()
+
+    return {
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'quotas': {
+            'daily_calls': current_app.config['ANALYZE_DAILY_CALL_QUOTA'] or None,
+            'daily_tokens': current_app.config['ANALYZE_DAILY_TOKEN_QUOTA'] or None,
+        },
+        'totals': shape(totals),
+        'per_day': [{'day': _day(row.day).isoformat(), **shape(row)} for row in days],
+        'top_users': [{'user_id': row.user_id, 'email': row.email, **shape(row)} for row in users],
+    }
+
+
+usage = UsageRecorder()
@@ -0,0 +1,214 @@
+#write_buffer.py
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app
+
+from app import db
+import bulk_io
+import glycemic
+import stats
+from images import image_store
+from sharding import shards
+
+_NUTRIENTS = ('calories', 'carbs', 'fat', 'protein')
+
+
+class _Submission:
+    """One request's food items, waiting for the commit that includes them."""
+    __slots__ = ('user_id', 'shard', 'timestamp', 'foods', 'image_id', 'done', 'error')
+
+    def __init__(self, user_id, shard, timestamp, foods, image_id):
+        self.user_id = user_id
+        self.shard = shard
+        self.timestamp = timestamp
+        self.foods = foods
+        self.image_id = image_id
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitBuffer:
+    """Write-behind buffer that commits food items from concurrent requests together.
+
+    With WRITE_BUFFER_ENABLED, save_food_items hands its validated rows to
+    this process's flusher thread and blocks. The flusher collects
+    submissions for up to WRITE_BUFFER_MAX_DELAY_MS (or until
+    WRITE_BUFFER_MAX_ROWS rows), writes them with multi-row inserts in one
+    transaction per shard and then releases every waiting request, so a 201
+    still means the rows are committed. If a shard's combined commit fails,
+    that shard's submissions are retried on their own so one bad request
+    can't fail the rest; shards that committed are never written again.
+    Batching only happens between requests served by the same
+    process at the same time, i.e. with gthread or gevent workers.
+    """
+
+    def __init__(self, app=None):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('WRITE_BUFFER_ENABLED', False)
+        app.config.setdefault('WRITE_BUFFER_MAX_DELAY_MS', 2)
+        app.config.setdefault('WRITE_BUFFER_MAX_ROWS', 1000)
+        app.config.setdefault('WRITE_BUFFER_ACK_TIMEOUT', 30)
+        app.extensions['write_buffer'] = self
+
+    @property
+    def enabled(self):
+        return current_app.config['WRITE_BUFFER_ENABLED']
+
+    def counters(self):
+        """Commits, submissions and rows written by this process so far."""
+        return dict(self._counters)
+
+    def save(self, user_id, foods, timestamp, image_id=None):
+        """Queue `foods` (save_food_items payload entries) and return once they are committed.
+
+        Raises KeyError for an entry without name or type, TimeoutError if
+        no commit confirmed the rows within WRITE_BUFFER_ACK_TIMEOUT (they
+        stay queued and may still be saved), or the error that made their
+        commit fail.
+        """
+        foods = [{
+            'name': food['name'], 'type': food['type'], 'volume': food.get('volume'),
+            **{n: food.get(n) for n in _NUTRIENTS},
+        } for food in foods]
+        if not foods:
+            return
+        submission = _Submission(user_id, shards.current(), timestamp, foods, image_id)
+        # Don't sit on a pooled connection while waiting: the flusher needs one
+        db.session.close()
+        self._start()
+        self._queue.put(submission)
+        if not submission.done.wait(current_app.config['WRITE_BUFFER_ACK_TIMEOUT']):
+            raise TimeoutError("The food items were not confirmed in time")
+        if submission.error is not None:
+            raise submission.error
+
+    def _start(self):
+        # Per process: a worker forked from a parent that already had the thread must start its own
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='write-buffer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _collect(self, max_delay, max_rows):
+        """Block for a first submission, then take more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        rows = len(batch[0].foods)
+        deadline = time.monotonic() + max_delay
+        while rows < max_rows:
+            try:
+                remaining = deadline - time.monotonic()
+                submission = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(submission)
+            rows += len(submission.foods)
+        return batch
+
+    def _run(self, app):
+        max_delay = app.config['WRITE_BUFFER_MAX_DELAY_MS'] / 1000.0
+        max_rows = app.config['WRITE_BUFFER_MAX_ROWS']
+        while True:
+            batch = self._collect(max_delay, max_rows)
+            with app.app_context():
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    app.logger.exception("Write buffer flush failed")
+                    for submission in batch:
+                        if not submission.done.is_set():
+                            submission.error = e
+                            submission.done.set()
+                finally:
+                    db.session.remove()
+
+    def _commit(self, batch):
+        # Food types are created idempotently, so they can go first in a transaction of their own
+        type_ids = bulk_io.FoodTypeResolver().resolve({food['type'] for s in batch for food in s.foods})
+        db.session.commit()
+
+        by_shard = defaultdict(list)
+        for submission in batch:
+            by_shard[submission.shard].append(submission)
+        entries = []
+        for key, submissions in by_shard.items():
+            entries.extend(self._commit_shard(key, submissions, type_ids))
+        if entries:
+            self._record(entries)
+        for submission in batch:
+            submission.done.set()
+
+    def _commit_shard(self, key, submissions, type_ids):
+        """Write the submissions living on shard `key` in one transaction on that bind.
+
+        A commit spanning several binds isn't atomic, so each shard commits on
+        its own and only a failed shard's submissions are retried, one by one.
+        On the primary the stats and glycemic cache go into the same
+        transaction; for other shards their entries are returned for _record.
+        """
+        try:
+            with shards.using(key):
+                items = self._write(submissions, type_ids)
+                if key is None:
+                    stats.record_items(items)
+                    glycemic.invalidate(items)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(submissions) == 1:
+                submissions[0].error = e
+                return []
+            current_app.logger.warning("Group commit of %d submissions on shard %s failed (%s); retrying one by one",
+                                       len(submissions), key, e)
+            return [entry for s in submissions for entry in self._commit_shard(key, [s], type_ids)]
+        self._counters.update(commits=1, submissions=len(submissions), rows=len(items))
+        return [] if key is None else items
+
+    def _record(self, entries):
+        """Add items already committed on their shards to the primary's stats and glycemic cache."""
+        for attempt in range(2):
+            try:
+                stats.record_items(entries)
+                glycemic.invalidate(entries)
+                db.session.commit()
+                return
+            except Exception:
+                db.session.rollback()
+        # The rows are saved, so the requests still succeed; retrying them would only duplicate the items
+        current_app.logger.exception("Recording %d saved food items failed; run `flask stats rebuild` and "
+                                     "check their days' glycemic load", len(entries))
+
+    def _write(self, submissions, type_ids):
+        """Insert the submissions' items and image links on the current shard; returns the items."""
+        items = [{
+            'name': food['name'], 'volume': food['volume'], 'food_type_id': type_ids[food['type']],
+            'timestamp': s.timestamp, 'date_uploaded': s.timestamp, 'user_id': s.user_id,
+            **{n: food[n] for n in _NUTRIENTS},
+        } for s in submissions for food in s.foods]
+        ids = bulk_io.insert_items(items)
+        start = 0
+        for s in submissions:
+            if s.image_id:
+                image_store.link(s.image_id, ids[start:start + len(s.foods)])
+            start += len(s.foods)
+        return items
+
+
+write_buffer = GroupCommitBuffer()